@@ -0,0 +1,262 @@
+import argparse
+import datetime
+import json
+import os
+import random
+
+
+# The row counts of the Udacity dataset, as listed in the README. A scale
+# factor of 1 generates a dataset of this size.
+songs_at_scale_1 = 385252
+artists_at_scale_1 = 45266
+events_at_scale_1 = 8056
+users_at_scale_1 = 105
+
+# The fields of the events, in the order of the columns of the table
+# 'staging_events'. This is also the order of the JSONPaths file.
+event_fields = [
+    'artist',
+    'auth',
+    'firstName',
+    'gender',
+    'itemInSession',
+    'lastName',
+    'length',
+    'level',
+    'location',
+    'method',
+    'page',
+    'registration',
+    'sessionId',
+    'song',
+    'status',
+    'ts',
+    'userAgent',
+    'userId'
+]
+
+# The pages of the events, and how often they show up.
+pages = [
+    ('NextSong', 80),
+    ('Home', 8),
+    ('Login', 3),
+    ('Logout', 3),
+    ('Settings', 2),
+    ('Help', 2),
+    ('Upgrade', 1),
+    ('About', 1)
+]
+
+# The first day of the log data.
+first_day = datetime.date(2018, 11, 1)
+
+# The number of days of the log data.
+days = 30
+
+user_agents = [
+    '"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36"',
+    (
+        '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.78.2 (KHTML, like Gecko) '
+        'Version/7.0.6 Safari/537.78.2"'
+    ),
+    'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0'
+]
+
+locations = [
+    'San Francisco-Oakland-Hayward, CA',
+    'New York-Newark-Jersey City, NY-NJ-PA',
+    'Atlanta-Sandy Springs-Roswell, GA',
+    'Chicago-Naperville-Elgin, IL-IN-WI',
+    'Lansing-East Lansing, MI'
+]
+
+
+def random_id(rng, prefix, length=16, letters=0):
+
+    """
+    Generates an identifier like the ones of the Million Song Dataset.
+
+    Args:
+        rng (Random): The random generator.
+        prefix (str): The prefix of the identifier, like 'SO'.
+        length (int): The number of characters after the prefix.
+        letters (int): How many of them are letters only. The track
+            identifiers start with letters, which name the song
+            directories copied in batches by letter.
+
+    Returns:
+        (str): The identifier.
+    """
+
+    return prefix + ''.join(
+        rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ' if n < letters else 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
+        for n in range(length)
+    )
+
+
+def generate_songs(rng, scale):
+
+    """
+    Generates the song data.
+
+    Args:
+        rng (Random): The random generator.
+        scale (float): The scale factor.
+
+    Returns:
+        (list): The tuples (track identifier, song object).
+    """
+
+    artists = []
+    for n in range(max(1, int(artists_at_scale_1 * scale))):
+        located = rng.random() < 0.4
+        artists.append({
+            'artist_id': random_id(rng, 'AR'),
+            'artist_name': 'Artist {}'.format(n),
+            'artist_location': rng.choice(locations) if located else '',
+            'artist_latitude': round(rng.uniform(-90, 90), 5) if located else None,
+            'artist_longitude': round(rng.uniform(-180, 180), 5) if located else None
+        })
+
+    songs = []
+    for n in range(max(1, int(songs_at_scale_1 * scale))):
+        song = {'num_songs': 1}
+        song.update(rng.choice(artists))
+        song.update({
+            'song_id': random_id(rng, 'SO'),
+            'title': 'Song {}'.format(n),
+            'duration': round(rng.uniform(30, 600), 5),
+            'year': rng.choice([0, rng.randint(1950, 2018)])
+        })
+        songs.append((random_id(rng, 'TR', letters=5), song))
+    return songs
+
+
+def generate_events(rng, scale, songs):
+
+    """
+    Generates the log data. The songs played are picked among the given
+    ones, so the fact table gets populated.
+
+    Args:
+        rng (Random): The random generator.
+        scale (float): The scale factor.
+        songs (list): The tuples (track identifier, song object).
+
+    Returns:
+        (dict): The events of every day, by date.
+    """
+
+    users = [
+        {
+            'userId': str(n + 1),
+            'firstName': 'First{}'.format(n + 1),
+            'lastName': 'Last{}'.format(n + 1),
+            'gender': rng.choice('MF'),
+            'level': rng.choice(['free', 'paid']),
+            'location': rng.choice(locations),
+            'userAgent': rng.choice(user_agents),
+            'registration': float(1540000000000 + rng.randint(0, 10 ** 9))
+        }
+        for n in range(max(1, int(users_at_scale_1 * scale)))
+    ]
+    names, weights = zip(*pages)
+
+    events = {}
+    count = max(1, int(events_at_scale_1 * scale))
+    for n in range(count):
+        day = first_day + datetime.timedelta(days=n * days // count)
+        ts = datetime.datetime(day.year, day.month, day.day) + datetime.timedelta(
+            seconds=rng.randint(0, 86399)
+        )
+        user = rng.choice(users)
+
+        # Users upgrade from time to time.
+        if user['level'] == 'free' and rng.random() < 0.01:
+            user['level'] = 'paid'
+
+        page = rng.choices(names, weights)[0]
+        song = rng.choice(songs)[1] if page == 'NextSong' else None
+        event = {
+            'artist': song['artist_name'] if song else None,
+            'auth': 'Logged In',
+            'firstName': user['firstName'],
+            'gender': user['gender'],
+            'itemInSession': rng.randint(0, 100),
+            'lastName': user['lastName'],
+            'length': song['duration'] if song else None,
+            'level': user['level'],
+            'location': user['location'],
+            'method': 'PUT' if page == 'NextSong' else 'GET',
+            'page': page,
+            'registration': user['registration'],
+            'sessionId': rng.randint(1, 1200),
+            'song': song['title'] if song else None,
+            'status': 200,
+            'ts': int(ts.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000),
+            'userAgent': user['userAgent'],
+            'userId': user['userId']
+        }
+        events.setdefault(day, []).append(event)
+    return events
+
+
+def generate(target, scale=1.0, seed=42):
+
+    """
+    Generates a synthetic Sparkify dataset with the same layout as the
+    Udacity bucket: 'song_data/A/B/C/TRABC...json' files holding a song
+    object each, 'log_data/YYYY/MM/YYYY-MM-DD-events.json' files holding
+    an event per line, and the JSONPaths file 'log_json_path.json'. The
+    same scale factor and seed generate the same dataset.
+
+    Args:
+        target (str): The directory where the dataset is written.
+        scale (float): The scale factor, 1 being the Udacity dataset.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        (dict): The number of songs and events, and the bytes written.
+    """
+
+    rng = random.Random(seed)
+    songs = generate_songs(rng, scale)
+    events = generate_events(rng, scale, songs)
+    written = 0
+
+    for track, song in songs:
+        directory = os.path.join(target, 'song_data', track[2], track[3], track[4])
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, '{}.json'.format(track)), 'w') as f:
+            written += f.write(json.dumps(song))
+
+    for day, day_events in sorted(events.items()):
+        directory = os.path.join(target, 'log_data', day.strftime('%Y'), day.strftime('%m'))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, day.strftime('%Y-%m-%d-events.json')), 'w') as f:
+            for event in day_events:
+                written += f.write(json.dumps(event) + '\n')
+
+    with open(os.path.join(target, 'log_json_path.json'), 'w') as f:
+        json.dump({
+            'jsonpaths': ["$['{}']".format(field) for field in event_fields]
+        }, f, indent=4)
+
+    return {
+        'songs': len(songs),
+        'events': sum(len(e) for e in events.values()),
+        'bytes': written
+    }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Generates a synthetic Sparkify dataset.'
+    )
+    parser.add_argument('target', help='the directory where the dataset is written')
+    parser.add_argument('--scale', type=float, default=1.0, help='the scale factor (1, 10, 100...)')
+    parser.add_argument('--seed', type=int, default=42, help='the seed of the random generator')
+    args = parser.parse_args()
+
+    print(generate(args.target, args.scale, args.seed))
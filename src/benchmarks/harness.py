@@ -0,0 +1,110 @@
+import argparse
+import config
+import database
+import json
+import local_engine
+import metrics
+import migrations
+import os
+import subprocess
+import time
+
+from benchmarks import generator
+
+
+def get_commit():
+
+    """
+    Gets the commit of the working tree, to tell the results apart.
+
+    Returns:
+        (str): The commit hash, or None outside a git repository.
+    """
+
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(dsn, data, scale, seed, output):
+
+    """
+    Generates a synthetic dataset (unless it already exists), runs the
+    ETL against a PostgreSQL stand-in, and writes the wall time, rows and
+    bytes of every stage to a JSON results file.
+
+    Args:
+        dsn (str): The DSN of the PostgreSQL stand-in.
+        data (str): The directory of the dataset.
+        scale (float): The scale factor of the dataset.
+        seed (int): The seed of the dataset.
+        output (str): The path of the results file.
+    """
+
+    if not os.path.isdir(data):
+        print('Generating the dataset (scale {}) into \'{}\''.format(scale, data))
+        generator.generate(data, scale, seed)
+
+    results = {
+        'commit': get_commit(),
+        'scale': scale,
+        'seed': seed,
+        'stages': []
+    }
+
+    start = time.time()
+    local_engine.run_locally(dsn, data)
+    results['seconds'] = round(time.time() - start, 3)
+
+    # The bytes of the tables written by the stages, their batches named
+    # after them like 'staging_songs:3'.
+    with database.connect() as conn, conn.cursor() as cur:
+        for record in metrics.records:
+            table = record['stage'].split(':')[0]
+            size = None
+            if table in migrations.tables:
+                cur.execute('SELECT pg_total_relation_size(%s);', (table,))
+                size = cur.fetchone()[0]
+            results['stages'].append({
+                'name': record['stage'],
+                'seconds': record['seconds'],
+                'rows': record['rows'],
+                'bytes': size
+            })
+            print('{:<24} {:>9.3f}s {:>10} rows {:>12} bytes'.format(
+                record['stage'], record['seconds'], record['rows'], size if size is not None else '-'
+            ))
+    conn.close()
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to \'{}\' ({:.3f}s)'.format(output, results['seconds']))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the ETL on synthetic data against a PostgreSQL stand-in.'
+    )
+    parser.add_argument(
+        '--dsn',
+        default=config.LOCAL_DSN,
+        help='the DSN of the PostgreSQL stand-in'
+    )
+    parser.add_argument('--scale', type=float, default=1.0, help='the scale factor (1, 10, 100...)')
+    parser.add_argument('--seed', type=int, default=42, help='the seed of the dataset')
+    parser.add_argument('--data', help='the directory of the dataset')
+    parser.add_argument('--output', default='results.json', help='the path of the results file')
+    args = parser.parse_args()
+
+    run_benchmark(
+        args.dsn,
+        args.data or 'sparkify-data-{}x-{}'.format(args.scale, args.seed),
+        args.scale,
+        args.seed,
+        args.output
+    )
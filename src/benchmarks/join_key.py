@@ -0,0 +1,160 @@
+import argparse
+import config
+import local_engine
+import metrics
+import psycopg2
+import psycopg2.extras
+import random
+import sql_queries
+import time
+
+from benchmarks import generator
+
+
+# The schema where the benchmark tables are created.
+schema = 'benchmark_join_key'
+
+# The songplays join before the join keys: two wide VARCHAR comparisons
+# between tables distributed on different columns.
+join_by_name = """
+    SELECT COUNT(*)
+      FROM staging_events
+      JOIN staging_songs
+        ON staging_events.artist = staging_songs.artist_name
+       AND staging_events.song = staging_songs.title
+     WHERE staging_events.page = 'NextSong';
+"""
+
+# The songplays join using the join keys, co-located.
+join_by_key = """
+    SELECT COUNT(*)
+      FROM staging_plays
+      JOIN staging_song_keys
+        ON staging_plays.join_key = staging_song_keys.join_key;
+"""
+
+
+def generate(scale, seed=42):
+
+    """
+    Generates the synthetic songs and events of the given scale.
+
+    Args:
+        scale (float): The scale factor, 1 being the Udacity dataset.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        (tuple): The lists of song rows and event rows.
+    """
+
+    rng = random.Random(seed)
+    songs = generator.generate_songs(rng, scale)
+    events = generator.generate_events(rng, scale, songs)
+    song_rows = [
+        (song['song_id'], song['title'], song['artist_name'], song['artist_id'])
+        for _, song in songs
+    ]
+    event_rows = [
+        (event['artist'], event['song'], event['page'], int(event['userId']), event['sessionId'])
+        for day_events in events.values()
+        for event in day_events
+    ]
+    return song_rows, event_rows
+
+
+def timed(cur, query, repeat):
+
+    """
+    Runs a query several times and gets the best time.
+
+    Args:
+        cur (cursor): The cursor used to run the query.
+        query (str): The query to run.
+        repeat (int): The number of runs.
+
+    Returns:
+        (tuple): The first row of the result and the best seconds.
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        cur.execute(query)
+        row = cur.fetchone()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return row, best
+
+
+def run(scale, repeat, dsn=None):
+
+    """
+    Loads synthetic data into the staging tables of a scratch schema and
+    compares the songplays join by name with the join by key. On a
+    PostgreSQL stand-in, the Redshift-only clauses are translated.
+
+    Args:
+        scale (float): The scale factor, 1 being the Udacity dataset.
+        repeat (int): The number of runs of every join.
+        dsn (str): The DSN of the database. Defaults to the database
+            Sparkify.
+    """
+
+    song_rows, event_rows = generate(scale)
+
+    with psycopg2.connect(dsn or config.SPARKIFYDB_DSN) as conn:
+        conn.set_session(autocommit=True)
+        with conn.cursor() as cur:
+            translate = (lambda query: query) if metrics.is_redshift(cur) else local_engine.translate
+
+            cur.execute('DROP SCHEMA IF EXISTS {} CASCADE;'.format(schema))
+            cur.execute('CREATE SCHEMA {};'.format(schema))
+            cur.execute('SET search_path TO {};'.format(schema))
+            for query in [
+                sql_queries.staging_events_table_create,
+                sql_queries.staging_songs_table_create,
+                sql_queries.staging_plays_table_create,
+                sql_queries.staging_song_keys_table_create
+            ]:
+                cur.execute(translate(query))
+
+            print('Loading {} songs and {} events'.format(len(song_rows), len(event_rows)))
+            psycopg2.extras.execute_values(
+                cur,
+                'INSERT INTO staging_songs (song_id, title, artist_name, artist_id) VALUES %s',
+                song_rows,
+                page_size=1000
+            )
+            psycopg2.extras.execute_values(
+                cur,
+                'INSERT INTO staging_events (artist, song, page, userId, sessionId) VALUES %s',
+                event_rows,
+                page_size=1000
+            )
+
+            start = time.time()
+            cur.execute(sql_queries.staging_plays_insert)
+            cur.execute(sql_queries.staging_song_keys_insert)
+            print('Join keys computed in {:.3f}s'.format(time.time() - start))
+            for table in ['staging_events', 'staging_songs', 'staging_plays', 'staging_song_keys']:
+                cur.execute('ANALYZE {};'.format(table))
+
+            (by_name,), name_seconds = timed(cur, join_by_name, repeat)
+            (by_key,), key_seconds = timed(cur, join_by_key, repeat)
+            print('Join by name: {} rows in {:.3f}s'.format(by_name, name_seconds))
+            print('Join by key:  {} rows in {:.3f}s'.format(by_key, key_seconds))
+
+            cur.execute('DROP SCHEMA {} CASCADE;'.format(schema))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Compares the songplays join by name with the join by key.'
+    )
+    parser.add_argument('--scale', type=float, default=1.0, help='the scale factor (1, 10, 100...)')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of runs of every join')
+    parser.add_argument('--dsn', help='the DSN of the database (defaults to the database Sparkify)')
+    args = parser.parse_args()
+
+    run(args.scale, args.repeat, args.dsn)
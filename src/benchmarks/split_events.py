@@ -0,0 +1,97 @@
+import argparse
+import os
+import shutil
+import split_events
+import storage
+import tempfile
+import time
+
+from benchmarks import generator
+
+
+def split_serially(source_url, target_url, keys):
+
+    """
+    Splits the given log files one after another, in this process.
+
+    Args:
+        source_url (str): The URL of the log data.
+        target_url (str): The URL where the outputs are written.
+        keys (list): The keys of the log files.
+
+    Returns:
+        (tuple): The numbers of plays and user events, and the bytes
+            written.
+    """
+
+    plays, users, written = 0, 0, 0
+    for key in keys:
+        result = split_events.split_file(source_url, target_url, key)
+        plays += result['plays'][0]
+        users += result['users'][0]
+        written += result['plays'][1] + result['users'][1]
+    return plays, users, written
+
+
+def run(scale, workers, data=None):
+
+    """
+    Generates a synthetic dataset, unless given one, and measures the
+    throughput of the event splitter: serially, then with a process pool.
+
+    Args:
+        scale (float): The scale factor, 1 being the Udacity dataset.
+        workers (int): The size of the process pool.
+        data (str): The directory of an existing dataset, if any.
+    """
+
+    scratch = tempfile.mkdtemp(prefix='split-events-')
+    try:
+        directory = data or os.path.join(scratch, 'data')
+        if not os.path.isdir(os.path.join(directory, 'log_data')):
+            print('Generating a dataset of scale {} in {}'.format(scale, directory))
+            generator.generate(directory, scale)
+
+        source_url = os.path.join(directory, 'log_data')
+        objects = [o for o in storage.open_store(source_url).list() if o[0].endswith('.json')]
+        size = sum(size for _, size in objects)
+        keys = [key for key, _ in objects]
+        print('Splitting {} log files, {} bytes'.format(len(objects), size))
+
+        start = time.time()
+        plays, users, written = split_serially(source_url, os.path.join(scratch, 'serial'), keys)
+        serial_seconds = time.time() - start
+        events = plays + users
+
+        start = time.time()
+        split_events.split_events(source_url, os.path.join(scratch, 'pool'), workers=workers)
+        pool_seconds = time.time() - start
+
+        for name, seconds in [('Serial', serial_seconds), ('Pool of {}'.format(workers), pool_seconds)]:
+            print('{}: {:.3f}s, {:.0f} events/s, {:.1f} MB/s'.format(
+                name,
+                seconds,
+                events / seconds,
+                size / seconds / 1024 / 1024
+            ))
+        print('Kept {} plays and {} user events, {} bytes gzipped ({:.1f}% of the input)'.format(
+            plays,
+            users,
+            written,
+            100.0 * written / size if size else 0
+        ))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Measures the throughput of the event splitter.'
+    )
+    parser.add_argument('--scale', type=float, default=1.0, help='the scale factor (1, 10, 100...)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='the size of the process pool')
+    parser.add_argument('--data', help='the directory of an existing dataset')
+    args = parser.parse_args()
+
+    run(args.scale, args.workers, args.data)
@@ -0,0 +1,50 @@
+import datetime
+import metrics
+import sql_queries
+
+
+def prepare(cur, resume):
+
+    """
+    Creates the checkpoints table if needed and gets the stages completed
+    by previous runs. Unless resuming, the checkpoints are cleared first,
+    but those of the days of log data already in the staging tables.
+
+    Args:
+        cur (cursor): The cursor used to run the queries.
+        resume (bool): Whether the previous run is being resumed.
+
+    Returns:
+        (set): The names of the stages already completed.
+    """
+
+    cur.execute(sql_queries.etl_checkpoints_table_create)
+    if not resume:
+        cur.execute(sql_queries.etl_checkpoints_delete)
+    cur.execute(sql_queries.etl_checkpoints_select)
+    return set(row[0] for row in cur.fetchall())
+
+
+def run_stage(conn, stage, queries):
+
+    """
+    Runs the queries of a stage and records its completion in a single
+    transaction. If any query fails, the partial rows of the stage are
+    rolled back along with the checkpoint, so a re-run can't duplicate
+    them. The stage is measured and its record emitted to the metrics
+    sink.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        stage (str): The name of the stage.
+        queries (list): The queries of the stage.
+    """
+
+    with metrics.stage(stage) as record, conn, conn.cursor() as cur:
+        for query in queries:
+            cur.execute(query)
+            record.measure(cur, copy=query.lstrip().upper().startswith('COPY'))
+        cur.execute(
+            sql_queries.etl_checkpoints_insert,
+            (stage, datetime.datetime.utcnow())
+        )
@@ -0,0 +1,200 @@
+import argparse
+import config
+import gzip
+import io
+import json
+import manifest_planner
+import math
+import metrics
+import os
+import storage
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+# The key of the compaction plan in the target store.
+plan_key = '_plan.json'
+
+
+def part_key(number):
+
+    """
+    Gets the key of a compacted part.
+
+    Args:
+        number (int): The number of the part.
+
+    Returns:
+        (str): The key of the part.
+    """
+
+    return 'part-{:05d}.json.gz'.format(number)
+
+
+def get_plan(source, target, parts):
+
+    """
+    Gets the compaction plan: the song files that go into every part. The
+    plan is saved in the target store along with the listing of the song
+    files it was made from, and read from there afterwards, so a resumed
+    run compacts the very same parts. The song files added since go into
+    new parts, while a removed or modified song file makes a new plan,
+    the parts of the previous one being deleted.
+
+    Args:
+        source (object): The store containing the song files.
+        target (object): The store where the parts are written.
+        parts (int): The desired number of parts.
+
+    Returns:
+        (list): The lists of song file keys, one per part.
+    """
+
+    objects = [o for o in source.list() if o[0].endswith('.json')]
+    plan = {'objects': [], 'parts': []}
+    if target.exists(plan_key):
+        plan = json.loads(target.read(plan_key).decode('utf-8'))
+        planned = dict(plan['objects'])
+        listed = dict(objects)
+        if any(listed.get(key) != size for key, size in planned.items()):
+            metrics.log(' --> Song files removed or modified since the plan, compacting them again')
+            for key, _ in target.list('part-'):
+                target.delete(key)
+            plan = {'objects': [], 'parts': []}
+        elif len(listed) == len(planned):
+            return plan['parts']
+
+    # The song files not planned yet go into new parts, as large as the
+    # parts of the first plan.
+    planned = set(key for key, _ in plan['objects'])
+    added = [o for o in objects if o[0] not in planned]
+    capacity = max([len(keys) for keys in plan['parts']] + [math.ceil(len(objects) / parts) if objects else 0])
+    if plan['parts']:
+        metrics.log(' --> {} song files added since the plan'.format(len(added)))
+    if added:
+        batches = manifest_planner.balance(added, [capacity] * math.ceil(len(added) / capacity))
+        plan['parts'] += [[key for key, _ in batch] for batch in batches]
+    plan['objects'] = objects
+    target.write(plan_key, json.dumps(plan).encode('utf-8'))
+    return plan['parts']
+
+
+def iter_objects(text):
+
+    """
+    Parses the JSON objects of a song file, which usually holds a single
+    object but may hold several of them one after another.
+
+    Args:
+        text (str): The content of the song file.
+
+    Yields:
+        (dict): The objects of the file.
+    """
+
+    decoder = json.JSONDecoder()
+    position = 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position == len(text):
+            return
+        obj, position = decoder.raw_decode(text, position)
+        yield obj
+
+
+def compact_part(source_url, target_url, number, keys):
+
+    """
+    Compacts the given song files into a gzip-compressed part holding a
+    JSON object per line. The part is skipped if it already exists.
+
+    Args:
+        source_url (str): The URL of the song data.
+        target_url (str): The URL where the parts are written.
+        number (int): The number of the part.
+        keys (list): The keys of the song files of the part.
+
+    Returns:
+        (tuple): The number of songs written and the size of the part, or
+            None if the part was already compacted.
+    """
+
+    source = storage.open_store(source_url)
+    target = storage.open_store(target_url)
+    if target.exists(part_key(number)):
+        return None
+
+    songs = 0
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as f:
+        for key in keys:
+            for obj in iter_objects(source.read(key).decode('utf-8')):
+                f.write(json.dumps(obj).encode('utf-8'))
+                f.write(b'\n')
+                songs += 1
+
+    target.write(part_key(number), buffer.getvalue())
+    return songs, buffer.tell()
+
+
+def compact_songs(source_url=None, target_url=None, parts=None, workers=None):
+
+    """
+    Compacts the song data into a few hundred parts of roughly equal size.
+    The parts already compacted by a previous run are skipped.
+
+    Args:
+        source_url (str): The URL of the song data. Defaults to the
+            setting 'SONG_DATA'.
+        target_url (str): The URL where the parts are written. Defaults
+            to the setting 'SONG_DATA_COMPACTED'.
+        parts (int): The desired number of parts. Defaults to the
+            setting 'COMPACTION_PARTS'.
+        workers (int): The size of the process pool. Defaults to the
+            setting 'COMPACTION_WORKERS' (the CPU count if unset).
+    """
+
+    source_url = source_url or config.S3_SONG_DATA
+    target_url = target_url or config.S3_SONG_DATA_COMPACTED
+    parts = parts or config.ETL_COMPACTION_PARTS
+    workers = workers or config.ETL_COMPACTION_WORKERS or os.cpu_count()
+
+    metrics.log('Planning the compaction of \'{}\''.format(source_url))
+    plan = get_plan(storage.open_store(source_url), storage.open_store(target_url), parts)
+
+    metrics.log('Compacting {} parts into \'{}\''.format(len(plan), target_url))
+    skipped = 0
+    with metrics.stage('compact_songs') as record, ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            compact_part,
+            [source_url] * len(plan),
+            [target_url] * len(plan),
+            range(1, len(plan) + 1),
+            plan
+        )
+        for number, result in enumerate(results, 1):
+            if result is None:
+                skipped += 1
+            else:
+                metrics.log(' --> Part {}: {} songs, {} bytes'.format(number, *result))
+                record['rows'] += result[0]
+        record['files'] = len(plan) - skipped
+
+    metrics.log(' --> {} parts compacted, {} skipped'.format(len(plan) - skipped, skipped))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Compacts the song data into gzipped NDJSON parts.'
+    )
+    parser.add_argument('--source', help='the URL of the song data')
+    parser.add_argument('--target', help='the URL where the parts are written')
+    parser.add_argument('--parts', type=int, help='the desired number of parts')
+    parser.add_argument('--workers', type=int, help='the size of the process pool')
+    args = parser.parse_args()
+
+    compact_songs(args.source, args.target, args.parts, args.workers)
+    metrics.log('Song data compacted :-)')
+    metrics.print_summary()
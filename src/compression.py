@@ -0,0 +1,75 @@
+import config
+import database
+import json
+import metrics
+import os
+
+
+# The tables whose compression is analyzed.
+tables = [
+    'staging_events',
+    'staging_songs',
+    'staging_plays',
+    'staging_song_keys',
+    'users',
+    'songs',
+    'artists',
+    'time',
+    'songplays',
+    'daily_plays_by_song',
+    'daily_active_users_by_level',
+    'hourly_plays'
+]
+
+
+def load_encodings(path=None):
+
+    """
+    Loads the column encodings saved by a previous analysis.
+
+    Args:
+        path (str): The path of the encodings file. Defaults to the
+            setting 'ENCODINGS'.
+
+    Returns:
+        (dict): The encoding of every column, by table and column names.
+            Empty if there's no encodings file.
+    """
+
+    path = path or config.ETL_ENCODINGS
+    if not path or not os.path.isfile(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def analyze_compression(path=None):
+
+    """
+    Runs 'ANALYZE COMPRESSION' on the loaded tables of the database
+    Sparkify, and saves the encoding chosen for every column. The next
+    time the tables are created, their DDL declares these encodings.
+
+    Args:
+        path (str): The path of the encodings file. Defaults to the
+            setting 'ENCODINGS'.
+    """
+
+    encodings = {}
+    with database.connect() as conn:
+        conn.set_session(autocommit=True)
+        with conn.cursor() as cur:
+            for table in tables:
+                metrics.log('Analyzing the compression of \'{}\''.format(table))
+                cur.execute('ANALYZE COMPRESSION {};'.format(table))
+                for _, column, encoding, reduction in cur.fetchall():
+                    encodings.setdefault(table, {})[column.lower()] = encoding.lower()
+                    metrics.log(' --> {}: {} ({}% smaller)'.format(column, encoding, reduction))
+
+    with open(path or config.ETL_ENCODINGS, 'w') as f:
+        json.dump(encodings, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    analyze_compression()
+    metrics.log('Column encodings saved :-)')
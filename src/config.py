@@ -26,6 +26,8 @@ REDSHIFT_PORT = _config['REDSHIFT']['PORT']
 REDSHIFT_MASTER_USERNAME = _config['REDSHIFT']['MASTER_USERNAME']
 REDSHIFT_MASTER_USER_PASSWORD = _config['REDSHIFT']['MASTER_USER_PASSWORD']
 REDSHIFT_ENDPOINT_ADDRESS = _config['REDSHIFT']['ENDPOINT_ADDRESS']
+REDSHIFT_SLICES_PER_NODE = _config['REDSHIFT']['SLICES_PER_NODE']
+REDSHIFT_NUMBER_OF_SLICES = int(REDSHIFT_NUMBER_OF_NODES) * int(REDSHIFT_SLICES_PER_NODE)
 
 # ------------- #
 # IAM constants #
@@ -41,12 +43,81 @@ IAM_ROLE_ARN = _config['IAM']['ROLE_ARN']
 S3_LOG_DATA = _config['S3']['LOG_DATA']
 S3_LOG_JSON_PATH = _config['S3']['LOG_JSON_PATH']
 S3_SONG_DATA = _config['S3']['SONG_DATA']
+S3_SONG_DATA_COMPACTED = _config['S3']['SONG_DATA_COMPACTED']
+S3_MANIFESTS = _config['S3']['MANIFESTS']
+S3_ENDPOINT_URL = _config['S3']['ENDPOINT_URL']
+S3_LOG_DATA_SPLIT = _config['S3']['LOG_DATA_SPLIT']
+
+# ------------- #
+# ETL constants #
+# ------------- #
+
+ETL_COPY_MODE = _config['ETL']['COPY_MODE']
+ETL_COPY_WORKERS = _config['ETL'].getint('COPY_WORKERS') or REDSHIFT_NUMBER_OF_SLICES
+ETL_MAX_CONCURRENT_COPIES = _config['ETL'].getint('MAX_CONCURRENT_COPIES')
+ETL_COPY_PLAN = _config['ETL']['COPY_PLAN']
+ETL_MANIFEST_BATCHES = _config['ETL'].getint('MANIFEST_BATCHES')
+ETL_COMPACTION_PARTS = _config['ETL'].getint('COMPACTION_PARTS')
+ETL_COMPACTION_WORKERS = _config['ETL'].getint('COMPACTION_WORKERS')
+ETL_STAGE_WORKERS = _config['ETL'].getint('STAGE_WORKERS')
+ETL_SURROGATE_KEYS = _config['ETL'].getboolean('SURROGATE_KEYS')
+ETL_ENCODINGS = _config['ETL']['ENCODINGS']
+ETL_PROGRESS_INTERVAL = _config['ETL'].getfloat('PROGRESS_INTERVAL')
+ETL_STALL_TIMEOUT = _config['ETL'].getfloat('STALL_TIMEOUT')
+ETL_PROMOTION = _config['ETL']['PROMOTION']
+ETL_SPLIT_EVENTS = _config['ETL'].getboolean('SPLIT_EVENTS')
+ETL_SESSION_PROFILES = _config['ETL'].getboolean('SESSION_PROFILES')
+
+# --------------------- #
+# Maintenance constants #
+# --------------------- #
+
+MAINTENANCE_UNSORTED_THRESHOLD = _config['MAINTENANCE'].getfloat('UNSORTED_THRESHOLD')
+MAINTENANCE_STATS_OFF_THRESHOLD = _config['MAINTENANCE'].getfloat('STATS_OFF_THRESHOLD')
+MAINTENANCE_DELETED_THRESHOLD = _config['MAINTENANCE'].getfloat('DELETED_THRESHOLD')
+
+# ------------- #
+# API constants #
+# ------------- #
+
+API_CONNECTIONS = _config['API'].getint('CONNECTIONS')
+API_CACHE_SIZE = _config['API'].getint('CACHE_SIZE')
+API_CACHE_DIR = _config['API']['CACHE_DIR']
+
+# ------------------ #
+# Snapshot constants #
+# ------------------ #
+
+SNAPSHOT_DIRECTORY = _config['SNAPSHOT']['DIRECTORY']
+SNAPSHOT_BATCH_SIZE = _config['SNAPSHOT'].getint('BATCH_SIZE')
+
+# ---------------- #
+# Export constants #
+# ---------------- #
+
+EXPORT_TARGET = _config['EXPORT']['TARGET']
+
+# ----------------- #
+# Metrics constants #
+# ----------------- #
+
+METRICS_SINK = _config['METRICS']['SINK']
+METRICS_PATH = _config['METRICS']['PATH']
+
+# ---------------------- #
+# Local engine constants #
+# ---------------------- #
+
+LOCAL_DSN = _config['LOCAL']['DSN']
+LOCAL_DATA = _config['LOCAL']['DATA']
+LOCAL_WORKERS = _config['LOCAL'].getint('WORKERS')
 
 # ------------------------ #
 # CloudFormation constants #
 # ------------------------ #
 
 CLOUDFORMATION_STACK_NAME = _config['CLOUDFORMATION']['STACK_NAME']
+CLOUDFORMATION_ENDPOINT_URL = _config['CLOUDFORMATION']['ENDPOINT_URL']
 
 # ------------------ #
 # Sparkify constants #
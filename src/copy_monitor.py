@@ -0,0 +1,218 @@
+import asyncio
+import checkpoint
+import config
+import database
+import metrics
+import time
+
+
+# The progress of the loads run by a session, on Redshift. The table has
+# a row per slice while the data is being loaded.
+redshift_progress = """
+    SELECT SUM(bytes_loaded),
+           SUM(bytes_to_load),
+           SUM(lines)
+      FROM stv_load_state
+     WHERE session = %s
+    HAVING COUNT(*) > 0;
+"""
+
+# The progress of the COPY run by a backend, on PostgreSQL 14 and later.
+postgres_progress = """
+    SELECT bytes_processed,
+           NULLIF(bytes_total, 0),
+           tuples_processed
+      FROM pg_stat_progress_copy
+     WHERE pid = %s;
+"""
+
+# Cancels the query run by a backend.
+cancel_backend = """
+    SELECT pg_cancel_backend(%s);
+"""
+
+
+def redshift_probe(cur, pid):
+
+    """
+    Gets the progress of the COPY run by the given session on Redshift.
+
+    Args:
+        cur (cursor): A cursor of another connection.
+        pid (int): The process ID of the session running the COPY.
+
+    Returns:
+        (tuple): The bytes loaded, the bytes to load and the rows loaded,
+            or None if no load is in progress.
+    """
+
+    cur.execute(redshift_progress, (pid,))
+    return cur.fetchone()
+
+
+def postgres_probe(cur, pid):
+
+    """
+    Gets the progress of the COPY run by the given backend on a local
+    PostgreSQL stand-in.
+
+    Args:
+        cur (cursor): A cursor of another connection.
+        pid (int): The process ID of the backend running the COPY.
+
+    Returns:
+        (tuple): The bytes processed, the bytes to process (None when
+            unknown, like for a COPY FROM STDIN) and the rows processed,
+            or None if no COPY is in progress.
+    """
+
+    cur.execute(postgres_progress, (pid,))
+    return cur.fetchone()
+
+
+def get_probe(cur):
+
+    """
+    Gets the progress probe matching the database.
+
+    Args:
+        cur (cursor): A cursor of the database.
+
+    Returns:
+        (function): The probe, called with a cursor and a process ID.
+    """
+
+    return redshift_probe if metrics.is_redshift(cur) else postgres_probe
+
+
+def format_bytes(size):
+
+    """
+    Formats a number of bytes for humans.
+
+    Args:
+        size (float): The number of bytes.
+
+    Returns:
+        (str): The size, like '12.3 MB'.
+    """
+
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} TB'.format(size)
+
+
+def format_progress(stage, sample, previous, elapsed, interval):
+
+    """
+    Formats a progress line: bytes and rows per second since the previous
+    sample, and the ETA at the average rate since the COPY started.
+
+    Args:
+        stage (str): The name of the stage.
+        sample (tuple): The bytes loaded, the bytes to load and the rows.
+        previous (tuple): The previous sample, or None.
+        elapsed (float): The seconds since the COPY started.
+        interval (float): The seconds since the previous sample.
+
+    Returns:
+        (str): The progress line.
+    """
+
+    loaded, total, rows = [value or 0 for value in sample]
+    previous_loaded, _, previous_rows = [value or 0 for value in previous or (0, 0, 0)]
+    text = ' --> {}: {} loaded, {}/s, {:.0f} rows/s'.format(
+        stage,
+        format_bytes(loaded),
+        format_bytes(max(loaded - previous_loaded, 0) / interval),
+        max(rows - previous_rows, 0) / interval
+    )
+    if total and loaded:
+        eta = (total - loaded) / (loaded / elapsed)
+        text += ', {:.0%} of {}, ETA {:.0f}s'.format(loaded / total, format_bytes(total), eta)
+    return text
+
+
+async def monitor_copy(conn, stage, query, dsn, probe, interval, stall_timeout):
+
+    """
+    Runs a COPY as a checkpointed stage in a worker thread, and polls its
+    progress on a second connection until it's over. If the progress
+    doesn't move for longer than the stall timeout, the COPY is cancelled
+    and its stage fails. A COPY without progress to report, still queued
+    for instance, is never cancelled: the stall timer runs from the first
+    progress sample.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        stage (str): The name of the stage.
+        query (str): The COPY query.
+        dsn (str): The DSN of the monitoring connection.
+        probe (function): The progress probe, or None to pick the one
+            matching the database.
+        interval (float): The seconds between progress samples.
+        stall_timeout (float): The seconds without progress before the
+            COPY is cancelled, or 0 to never cancel it.
+    """
+
+    loop = asyncio.get_running_loop()
+    pid = conn.get_backend_pid()
+    monitor = database.connect(dsn)
+    try:
+        monitor.set_session(autocommit=True)
+        with monitor.cursor() as cur:
+            probe = probe or get_probe(cur)
+            copy = loop.run_in_executor(None, checkpoint.run_stage, conn, stage, [query])
+            start = changed = sampled = time.time()
+            previous, cancelled = None, False
+
+            while True:
+                done, _ = await asyncio.wait([copy], timeout=interval)
+                if done:
+                    return copy.result()
+
+                sample = await loop.run_in_executor(None, probe, cur, pid)
+                now = time.time()
+                if sample != previous:
+                    if sample is not None:
+                        metrics.log(format_progress(stage, sample, previous, now - start, now - sampled))
+                    previous, changed, sampled = sample, now, now
+                elif sample is not None and stall_timeout and now - changed > stall_timeout and not cancelled:
+                    metrics.log(' --> {}: no progress for {:.0f}s, cancelling'.format(stage, now - changed))
+                    await loop.run_in_executor(None, cur.execute, cancel_backend, (pid,))
+                    cancelled = True
+    finally:
+        monitor.close()
+
+
+def run_copy(conn, stage, query, dsn=None, probe=None, interval=None, stall_timeout=None):
+
+    """
+    Runs a COPY as a checkpointed stage, reporting its progress.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        stage (str): The name of the stage.
+        query (str): The COPY query.
+        dsn (str): The DSN of the monitoring connection. Defaults to the
+            database Sparkify.
+        probe (function): The progress probe, called with a cursor and
+            the process ID of the COPY. Defaults to the one matching the
+            database.
+        interval (float): The seconds between progress samples. Defaults
+            to the setting 'PROGRESS_INTERVAL'.
+        stall_timeout (float): The seconds without progress before the
+            COPY is cancelled. Defaults to the setting 'STALL_TIMEOUT'.
+    """
+
+    asyncio.run(monitor_copy(
+        conn,
+        stage,
+        query,
+        dsn or config.SPARKIFYDB_DSN,
+        probe,
+        interval or config.ETL_PROGRESS_INTERVAL,
+        config.ETL_STALL_TIMEOUT if stall_timeout is None else stall_timeout
+    ))
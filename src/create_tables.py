@@ -1,5 +1,7 @@
-import config
-import psycopg2
+import argparse
+import database
+import metrics
+import migrations
 import sql_queries
 
 
@@ -9,45 +11,118 @@ def init_database():
     Initializes the database Sparkify.
     """
 
-    with psycopg2.connect(config.SPARKIFYDB_DSN) as conn:
+    with database.connect() as conn:
         conn.set_session(autocommit=True)
         with conn.cursor() as cur:
 
             # Drops the tables.
-            print('Dropping tables')
-            print(' --> songplays')
-            cur.execute(sql_queries.songplays_table_drop)
-            print(' --> songs')
-            cur.execute(sql_queries.songs_table_drop)
-            print(' --> artists')
-            cur.execute(sql_queries.artists_table_drop)
-            print(' --> users')
-            cur.execute(sql_queries.users_table_drop)
-            print(' --> time')
-            cur.execute(sql_queries.time_table_drop)
-            print(' --> staging_songs')
-            cur.execute(sql_queries.staging_songs_table_drop)
-            print(' --> staging_events')
-            cur.execute(sql_queries.staging_events_table_drop)
+            metrics.log('Dropping tables')
+            with metrics.stage('drop_tables'):
+                metrics.log(' --> data_version')
+                cur.execute(sql_queries.data_version_table_drop)
+                metrics.log(' --> hourly_plays')
+                cur.execute(sql_queries.hourly_plays_table_drop)
+                metrics.log(' --> daily_active_users_by_level')
+                cur.execute(sql_queries.daily_active_users_by_level_table_drop)
+                metrics.log(' --> daily_plays_by_song')
+                cur.execute(sql_queries.daily_plays_by_song_table_drop)
+                metrics.log(' --> songplays')
+                cur.execute(sql_queries.songplays_table_drop)
+                metrics.log(' --> songs')
+                cur.execute(sql_queries.songs_table_drop)
+                metrics.log(' --> artists')
+                cur.execute(sql_queries.artists_table_drop)
+                metrics.log(' --> users')
+                cur.execute(sql_queries.users_table_drop)
+                metrics.log(' --> time')
+                cur.execute(sql_queries.time_table_drop)
+                metrics.log(' --> song_keys')
+                cur.execute(sql_queries.song_keys_table_drop)
+                metrics.log(' --> artist_keys')
+                cur.execute(sql_queries.artist_keys_table_drop)
+                metrics.log(' --> staging_song_keys')
+                cur.execute(sql_queries.staging_song_keys_table_drop)
+                metrics.log(' --> staging_plays')
+                cur.execute(sql_queries.staging_plays_table_drop)
+                metrics.log(' --> staging_songs')
+                cur.execute(sql_queries.staging_songs_table_drop)
+                metrics.log(' --> staging_events')
+                cur.execute(sql_queries.staging_events_table_drop)
+                metrics.log(' --> staging_user_events')
+                cur.execute(sql_queries.staging_user_events_table_drop)
+                metrics.log(' --> load_state')
+                cur.execute(sql_queries.load_state_table_drop)
+                metrics.log(' --> etl_checkpoints')
+                cur.execute(sql_queries.etl_checkpoints_table_drop)
 
             # Creates the tables.
-            print('Creating tables')
-            print(' --> staging_events')
-            cur.execute(sql_queries.staging_events_table_create)
-            print(' --> staging_songs')
-            cur.execute(sql_queries.staging_songs_table_create)
-            print(' --> time')
-            cur.execute(sql_queries.time_table_create)
-            print(' --> users')
-            cur.execute(sql_queries.users_table_create)
-            print(' --> artists')
-            cur.execute(sql_queries.artists_table_create)
-            print(' --> songs')
-            cur.execute(sql_queries.songs_table_create)
-            print(' --> songplays')
-            cur.execute(sql_queries.songplays_table_create)
+            metrics.log('Creating tables')
+            with metrics.stage('create_tables'):
+                metrics.log(' --> load_state')
+                cur.execute(sql_queries.load_state_table_create)
+                metrics.log(' --> etl_checkpoints')
+                cur.execute(sql_queries.etl_checkpoints_table_create)
+                metrics.log(' --> etl_lock')
+                cur.execute(sql_queries.etl_lock_table_create)
+                metrics.log(' --> staging_events')
+                cur.execute(sql_queries.staging_events_table_create)
+                metrics.log(' --> staging_user_events')
+                cur.execute(sql_queries.staging_user_events_table_create)
+                metrics.log(' --> staging_songs')
+                cur.execute(sql_queries.staging_songs_table_create)
+                metrics.log(' --> staging_plays')
+                cur.execute(sql_queries.staging_plays_table_create)
+                metrics.log(' --> staging_song_keys')
+                cur.execute(sql_queries.staging_song_keys_table_create)
+                metrics.log(' --> time')
+                cur.execute(sql_queries.time_table_create)
+                metrics.log(' --> song_keys')
+                cur.execute(sql_queries.song_keys_table_create)
+                metrics.log(' --> artist_keys')
+                cur.execute(sql_queries.artist_keys_table_create)
+                metrics.log(' --> users')
+                cur.execute(sql_queries.users_table_create)
+                metrics.log(' --> artists')
+                cur.execute(sql_queries.artists_table_create)
+                metrics.log(' --> songs')
+                cur.execute(sql_queries.songs_table_create)
+                metrics.log(' --> songplays')
+                cur.execute(sql_queries.songplays_table_create)
+                metrics.log(' --> daily_plays_by_song')
+                cur.execute(sql_queries.daily_plays_by_song_table_create)
+                metrics.log(' --> daily_active_users_by_level')
+                cur.execute(sql_queries.daily_active_users_by_level_table_create)
+                metrics.log(' --> hourly_plays')
+                cur.execute(sql_queries.hourly_plays_table_create)
+                metrics.log(' --> data_version')
+                cur.execute(sql_queries.data_version_table_create)
 
 
 if __name__ == '__main__':
-    init_database()
-    print('Database Sparkify initialized :-)')
+
+    parser = argparse.ArgumentParser(
+        description='Initializes the database Sparkify, or migrates its tables that changed.'
+    )
+    parser.add_argument(
+        '--migrate',
+        action='store_true',
+        help='migrate the tables that changed in place instead of dropping them all'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='with --migrate, only print the planned operations'
+    )
+    args = parser.parse_args()
+    if args.dry_run and not args.migrate:
+        parser.error('--dry-run needs --migrate')
+
+    if args.migrate:
+        migrated = migrations.migrate(args.dry_run)
+        metrics.print_summary()
+        if not migrated:
+            raise SystemExit(1)
+    else:
+        init_database()
+        metrics.log('Database Sparkify initialized :-)')
+        metrics.print_summary()
@@ -0,0 +1,44 @@
+import config
+import psycopg2
+import psycopg2.pool
+
+
+# The cursor class of the connections to the database Sparkify, or None
+# for the default one. The local engine sets its own, which translates
+# the queries for a PostgreSQL stand-in.
+cursor_factory = None
+
+
+def connect(dsn=None):
+
+    """
+    Connects to the database Sparkify.
+
+    Args:
+        dsn (str): The DSN of the database. Defaults to the setting
+            'SPARKIFYDB_DSN'.
+
+    Returns:
+        (connection): The connection.
+    """
+
+    return psycopg2.connect(dsn or config.SPARKIFYDB_DSN, cursor_factory=cursor_factory)
+
+
+def create_pool(size, dsn=None):
+
+    """
+    Creates a thread-safe pool of connections to the database Sparkify.
+
+    Args:
+        size (int): The maximum number of connections.
+        dsn (str): The DSN of the database. Defaults to the setting
+            'SPARKIFYDB_DSN'.
+
+    Returns:
+        (ThreadedConnectionPool): The pool.
+    """
+
+    return psycopg2.pool.ThreadedConnectionPool(
+        1, size, dsn or config.SPARKIFYDB_DSN, cursor_factory=cursor_factory
+    )
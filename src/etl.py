@@ -1,73 +1,463 @@
+import argparse
+import checkpoint
+import compact_songs
 import config
-import psycopg2
+import copy_monitor
+import database
+import datetime
+import incremental
+import log_partitions
+import maintenance
+import manifest_planner
+import metrics
+import parallel_copy
+import promotion
+import scheduler
+import split_events
 import sql_queries
+import staging_lock
+import storage
 import time
 
 
-# A reference to the builtin function 'print()'.
-builtin_print = print
+def copy_serially(conn, batches):
+
+    """
+    Copies data in batches, one after another, using the given
+    connection and reporting the progress of every batch.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        batches (iterable): The tuples (stage name, query) to run.
+
+    Returns:
+        (list): The tuples (stage name, seconds) in batch order.
+    """
+
+    timings = []
+    for stage, query in batches:
+        metrics.log(' --> {} started'.format(stage))
+        start = time.time()
+        copy_monitor.run_copy(conn, stage, query)
+        elapsed = time.time() - start
+        metrics.log(' --> {} finished in {:.1f}s'.format(stage, elapsed))
+        timings.append((stage, elapsed))
+    return timings
+
+
+def run_query(conn, completed, stage, query):
+
+    """
+    Runs a query as a checkpointed stage, unless it's already completed.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        completed (set): The names of the stages already completed.
+        stage (str): The name of the stage.
+        query (str): The query to run.
+    """
+
+    if stage in completed:
+        metrics.log('Skipping the completed stage \'{}\''.format(stage))
+    else:
+        checkpoint.run_stage(conn, stage, [query])
 
 
-def print(text):
+def copy_events(conn, completed, batches, serial):
 
     """
-    Prints a timestamp next to the the given text.
+    Copies the events from S3 to the 'staging_events' table, reporting
+    the progress of every COPY. The batches of a date range, one per day,
+    are copied concurrently, and each one records its own completion.
 
     Args:
-        text (str): The text to print.
+        conn (connection): A connection not in autocommit mode.
+        completed (set): The names of the stages already completed.
+        batches (list): The tuples (stage name, query) to copy the log
+            data.
+        serial (bool): Whether to copy the batches one after another.
     """
 
-    return builtin_print('{} | {}'.format(
-        time.strftime('%H:%M:%S', time.gmtime()),
-        text
-    ))
+    for stage, _ in batches:
+        if stage in completed:
+            metrics.log('Skipping the completed stage \'{}\''.format(stage))
+    batches = [(stage, query) for stage, query in batches if stage not in completed]
+    if len(batches) > 1 and config.ETL_COPY_MODE == 'concurrent' and not serial:
+        parallel_copy.run_copies(batches)
+    else:
+        copy_serially(conn, batches)
 
 
-def load_staging_tables():
+def copy_songs(conn, completed, queries, serial):
 
     """
-    Populates the database Sparkify.
+    Copies the songs from S3 to the 'staging_songs' table.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        completed (set): The names of the stages already completed.
+        queries (list): The queries to copy the song data.
+        serial (bool): Whether to copy the batches one after another.
     """
 
-    with psycopg2.connect(config.SPARKIFYDB_DSN) as conn:
-        conn.set_session(autocommit=True)
-        with conn.cursor() as cur:
+    start = time.time()
+    batches = [
+        ('staging_songs:{}'.format(number), query)
+        for number, query in enumerate(queries, 1)
+        if 'staging_songs:{}'.format(number) not in completed
+    ]
+    if config.ETL_COPY_MODE == 'concurrent' and not serial:
+        timings = parallel_copy.run_copies(batches)
+    else:
+        timings = copy_serially(conn, batches)
+    with conn, conn.cursor() as cur:
+        cur.execute(sql_queries.staging_songs_count)
+        metrics.log(' --> {} batches ({:.1f}s of COPY) in {:.1f}s, {} rows'.format(
+            len(timings),
+            sum(elapsed for _, elapsed in timings),
+            time.time() - start,
+            cur.fetchone()[0]
+        ))
+
 
-            print('Importing data. This may take awhile, please be patient.')
+def promote(conn, completed, table):
 
-            # Copies the events from S3 to the 'staging_events' table.
-            print('Copying events into the staging table \'staging_events\'')
-            cur.execute(sql_queries.staging_events_copy)
+    """
+    Promotes the new contents of a table through a shadow table, unless
+    it's already completed.
 
-            # Copies the songs from S3 to the 'staging_songs' table.
-            print('Copying songs into the staging table \'staging_songs\'')
-            counter = 1
-            for query in sql_queries.staging_songs_copies():
-                print(' --> Batch {}'.format(counter))
-                cur.execute(query)
-                counter += 1
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        completed (set): The names of the stages already completed.
+        table (str): The name of the table.
+    """
 
-            # Inserts the users using the staging tables as source.
-            print('Populating the table \'users\'')
-            cur.execute(sql_queries.users_table_insert)
+    if table in completed:
+        metrics.log('Skipping the completed stage \'{}\''.format(table))
+    else:
+        promotion.promote(conn, completed, table)
 
-            # Inserts the songs using the staging tables as source.
-            print('Populating the table \'songs\'')
-            cur.execute(sql_queries.songs_table_insert)
 
-            # Inserts the artists using the staging tables as source.
-            print('Populating the table \'artists\'')
-            cur.execute(sql_queries.artists_table_insert)
+def merge(conn, completed, table):
 
-            # Inserts the timestamps using the staging tables as source.
-            print('Populating the table \'time\'')
-            cur.execute(sql_queries.time_table_insert)
+    """
+    Merges the staged rows into a table, unless it's already completed.
 
-            # Inserts the songplays using the staging tables as source.
-            print('Populating the table \'songplays\'')
-            cur.execute(sql_queries.songplays_table_insert)
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        completed (set): The names of the stages already completed.
+        table (str): The name of the table, also the name of the stage.
+    """
+
+    if table in completed:
+        metrics.log('Skipping the completed stage \'{}\''.format(table))
+    else:
+        checkpoint.run_stage(conn, table, getattr(sql_queries, '{}_table_merge'.format(table)))
+
+
+def assign_surrogate_keys(conn, completed):
+
+    """
+    Adds the new natural keys of songs and artists to the key maps, if
+    the surrogate keys are enabled.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        completed (set): The names of the stages already completed.
+    """
+
+    if not config.ETL_SURROGATE_KEYS:
+        return
+    if 'key_maps' in completed:
+        metrics.log('Skipping the completed stage \'key_maps\'')
+    else:
+        checkpoint.run_stage(conn, 'key_maps', sql_queries.key_maps_insert)
+
+
+def update_rollups(conn, completed):
+
+    """
+    Recomputes the days of the staged events in the rollups.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        completed (set): The names of the stages already completed.
+    """
+
+    if 'rollups' in completed:
+        metrics.log('Skipping the completed stage \'rollups\'')
+    else:
+        checkpoint.run_stage(conn, 'rollups', sql_queries.rollups_update)
+
+
+def publish(conn):
+
+    """
+    Records a new data version once the load is complete, which
+    invalidates the results cached by the query API. It isn't
+    checkpointed, so a resumed run publishes its data as well.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+    """
+
+    with metrics.stage('data_version'), conn, conn.cursor() as cur:
+        cur.execute(sql_queries.data_version_insert, (datetime.datetime.utcnow(),))
+
+
+def analyze(conn, completed):
+
+    """
+    Refreshes the statistics of all the tables once the load is done,
+    since the COPYs don't update them.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        completed (set): The names of the stages already completed.
+    """
+
+    if 'analyze' in completed:
+        metrics.log('Skipping the completed stage \'analyze\'')
+    else:
+        checkpoint.run_stage(conn, 'analyze', sql_queries.analyze_tables)
+
+
+def plan_event_copies(first=None, last=None):
+
+    """
+    Generates the queries to copy the log data of a date range, a day at
+    a time, only for the days with files. With the setting 'SPLIT_EVENTS'
+    on, the plays and the user events written by 'split_events.py' are
+    copied into their own staging tables instead, side by side.
+
+    Args:
+        first (date): The first day of the range, if any.
+        last (date): The last day of the range, included.
+
+    Returns:
+        (list): The tuples (stage name, query).
+    """
+
+    source = storage.open_store(config.S3_LOG_DATA)
+    partitions = [('1', '')]
+    if first:
+        partitions = [
+            (day.isoformat(), prefix)
+            for day, prefix, _ in log_partitions.list_partitions(source, first, last)
+        ]
+        metrics.log(' --> {} days of log data from {} to {}'.format(len(partitions), first, last))
+
+    if not config.ETL_SPLIT_EVENTS:
+        return [
+            ('staging_events:{}'.format(name), sql_queries.staging_events_prefix_copy(source.url(prefix)))
+            for name, prefix in partitions
+        ]
+
+    target = storage.open_store(config.S3_LOG_DATA_SPLIT)
+    return [
+        ('staging_{}:{}'.format(table, name), copy(target.url('{}/{}'.format(kind, prefix))))
+        for name, prefix in partitions
+        for kind, table, copy in [
+            ('plays', 'events', sql_queries.staging_events_split_copy),
+            ('users', 'user_events', sql_queries.staging_user_events_copy)
+        ]
+    ]
+
+
+def load_staging_tables(resume=False, serial=False, first=None, last=None):
+
+    """
+    Populates the database Sparkify. The stages run as a dependency graph:
+    the independent ones (both COPYs, the dimension inserts) run at the
+    same time. Every stage records its completion in the table
+    'etl_checkpoints' within its own transaction. A ranged load empties
+    the staging tables first, unless resumed, and merges into the tables
+    already loaded.
+
+    Args:
+        resume (bool): Whether to skip the stages completed by the
+            previous run.
+        serial (bool): Whether to run the stages one after another.
+        first (date): The first day of the log data loaded, if any.
+        last (date): The last day of the log data loaded, included.
+    """
+
+    # The staging tables are shared with the other runs, so no other run
+    # may load them at the same time.
+    run = 'ranged load from {} to {}'.format(first, last) if first else 'full load'
+    with staging_lock.hold(run):
+        with database.connect() as conn:
+            with conn.cursor() as cur:
+
+                # A ranged load merges into the tables already loaded, from
+                # empty staging tables, whose days are copied again.
+                if first and not resume:
+                    for query in sql_queries.staging_tables_truncate:
+                        cur.execute(query)
+                    cur.execute(sql_queries.etl_checkpoints_delete_partitions)
+                completed = checkpoint.prepare(cur, resume)
+        conn.close()
+
+        metrics.log('Importing data. This may take awhile, please be patient.')
+
+        # Plans the batches: manifests balanced by size, or letters.
+        if config.ETL_COPY_PLAN == 'manifest':
+            metrics.log('Writing the COPY manifests')
+            events_copies, songs_copies = manifest_planner.plan_copies()
+        else:
+            events_copies = [sql_queries.staging_events_copy]
+            songs_copies = list(sql_queries.staging_songs_copies())
+        events_batches = [
+            ('staging_events:{}'.format(number), query)
+            for number, query in enumerate(events_copies, 1)
+        ]
+
+        # The events of a date range are copied a day at a time instead, and
+        # the split events from their own prefixes.
+        partitioned = bool(first) or config.ETL_SPLIT_EVENTS
+        if partitioned:
+            events_batches = plan_event_copies(first, last)
+
+        # The tables of a ranged load are merged, as a swap would replace
+        # them with the range alone.
+        def insert(table):
+            if first:
+                return lambda conn: merge(conn, completed, table)
+            if config.ETL_PROMOTION == 'swap':
+                return lambda conn: promote(conn, completed, table)
+            query = getattr(sql_queries, '{}_table_insert'.format(table))
+            return lambda conn: run_query(conn, completed, table, query)
+
+        # A swap of 'artists' drops the foreign key of 'songs', so both
+        # can't be promoted at the same time.
+        songs_inputs = ['staging_songs', 'song_keys', 'artist_keys']
+        if config.ETL_PROMOTION == 'swap':
+            songs_inputs.append('artists')
+
+        scheduler.run_stages([
+            scheduler.Stage(
+                'staging_events', [], ['staging_events', 'staging_user_events'],
+                lambda conn: copy_events(conn, completed, events_batches, serial or not partitioned)
+            ),
+            scheduler.Stage(
+                'staging_songs', [], ['staging_songs'],
+                lambda conn: copy_songs(conn, completed, songs_copies, serial)
+            ),
+            scheduler.Stage(
+                'staging_plays', ['staging_events'], ['staging_plays'],
+                lambda conn: run_query(conn, completed, 'staging_plays', sql_queries.staging_plays_insert)
+            ),
+            scheduler.Stage(
+                'staging_song_keys', ['staging_songs'], ['staging_song_keys'],
+                lambda conn: run_query(conn, completed, 'staging_song_keys', sql_queries.staging_song_keys_insert)
+            ),
+            scheduler.Stage(
+                'key_maps', ['staging_songs'], ['song_keys', 'artist_keys'],
+                lambda conn: assign_surrogate_keys(conn, completed)
+            ),
+            # The users are always merged, as the plays already loaded
+            # reference the keys of their versions.
+            scheduler.Stage(
+                'users', ['staging_events', 'staging_user_events'], ['users'],
+                lambda conn: merge(conn, completed, 'users')
+            ),
+            scheduler.Stage('songs', songs_inputs, ['songs'], insert('songs')),
+            scheduler.Stage(
+                'artists', ['staging_songs', 'artist_keys'], ['artists'], insert('artists')
+            ),
+            scheduler.Stage('time', ['staging_events'], ['time'], insert('time')),
+            scheduler.Stage(
+                'songplays',
+                [
+                    'staging_plays', 'staging_song_keys', 'song_keys', 'artist_keys',
+                    'users', 'songs', 'artists', 'time'
+                ],
+                ['songplays'],
+                insert('songplays')
+            ),
+            scheduler.Stage(
+                'rollups',
+                ['staging_events', 'songplays'],
+                sql_queries.rollup_tables,
+                lambda conn: update_rollups(conn, completed)
+            ),
+            scheduler.Stage(
+                'analyze',
+                ['songplays', 'users', 'songs', 'artists', 'time'] + sql_queries.rollup_tables,
+                [],
+                lambda conn: analyze(conn, completed)
+            ),
+            scheduler.Stage(
+                'data_version',
+                ['songplays', 'users', 'songs', 'artists', 'time'] + sql_queries.rollup_tables,
+                ['data_version'],
+                publish
+            )
+        ], serial=serial)
+
+
+def populate(resume=False, serial=False, incremental_load=False, first=None, last=None):
+
+    """
+    Runs the whole ETL: the preparation of the source files the settings
+    call for, the load of the tables, and the maintenance.
+
+    Args:
+        resume (bool): Whether to skip the stages completed by the
+            previous run.
+        serial (bool): Whether to run the stages one after another.
+        incremental_load (bool): Whether to load only the new S3 objects
+            and merge them into the tables.
+        first (date): The first day of the log data loaded, if any.
+        last (date): The last day of the log data loaded, included.
+    """
+
+    if incremental_load:
+        incremental.load_incremental(first, last)
+    else:
+        if config.ETL_COPY_PLAN == 'compacted':
+            compact_songs.compact_songs()
+        if config.ETL_SPLIT_EVENTS:
+            split_events.split_events(first=first, last=last)
+        load_staging_tables(resume, serial, first, last)
+    maintenance.maintain()
 
 
 if __name__ == "__main__":
-    load_staging_tables()
-    print('Database Sparkify populated :-)')
+
+    parser = argparse.ArgumentParser(description='Populates the database Sparkify.')
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='skip the stages completed by the previous run'
+    )
+    parser.add_argument(
+        '--serial',
+        action='store_true',
+        help='run the stages and the song batches one after another'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='load only the new S3 objects and merge them into the tables'
+    )
+    parser.add_argument(
+        '--from',
+        dest='first',
+        type=log_partitions.parse_date,
+        help='the first day of the log data loaded, like 2018-11-01'
+    )
+    parser.add_argument(
+        '--to',
+        dest='last',
+        type=log_partitions.parse_date,
+        help='the last day of the log data loaded (defaults to --from)'
+    )
+    args = parser.parse_args()
+    if args.last and not args.first:
+        parser.error('--to needs --from')
+    last = args.last or args.first
+
+    populate(args.resume, args.serial, args.incremental, args.first, last)
+    metrics.log('Database Sparkify populated :-)')
+    metrics.print_summary()
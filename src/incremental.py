@@ -0,0 +1,250 @@
+import config
+import database
+import datetime
+import json
+import log_partitions
+import manifest_planner
+import metrics
+import psycopg2.extras
+import sql_queries
+import staging_lock
+import storage
+import time
+
+
+def create_tables(cur):
+
+    """
+    Creates the tables that don't exist yet, the load state included. The
+    existing tables and their data are left untouched.
+
+    Args:
+        cur (cursor): The cursor used to run the queries.
+    """
+
+    cur.execute(sql_queries.load_state_table_create)
+    cur.execute(sql_queries.etl_checkpoints_table_create)
+    cur.execute(sql_queries.staging_events_table_create)
+    cur.execute(sql_queries.staging_user_events_table_create)
+    cur.execute(sql_queries.staging_songs_table_create)
+    cur.execute(sql_queries.staging_plays_table_create)
+    cur.execute(sql_queries.staging_song_keys_table_create)
+    cur.execute(sql_queries.time_table_create)
+    cur.execute(sql_queries.song_keys_table_create)
+    cur.execute(sql_queries.artist_keys_table_create)
+    cur.execute(sql_queries.users_table_create)
+    cur.execute(sql_queries.artists_table_create)
+    cur.execute(sql_queries.songs_table_create)
+    cur.execute(sql_queries.songplays_table_create)
+    cur.execute(sql_queries.daily_plays_by_song_table_create)
+    cur.execute(sql_queries.daily_active_users_by_level_table_create)
+    cur.execute(sql_queries.hourly_plays_table_create)
+    cur.execute(sql_queries.data_version_table_create)
+
+
+def find_new_objects(cur, source, url, first=None, last=None):
+
+    """
+    Lists the objects of a source that are not in the load state yet. For
+    the events, the listing can be restricted to the days of a range.
+
+    Args:
+        cur (cursor): The cursor used to run the queries.
+        source (str): The name of the source, 'events' or 'songs'.
+        url (str): The URL of the source data.
+        first (date): The first day of the events listed, if any.
+        last (date): The last day of the events listed, included.
+
+    Returns:
+        (tuple): The store of the source and its new objects, as tuples
+            (key, size in bytes).
+    """
+
+    cur.execute(sql_queries.load_state_select, (source,))
+    loaded = set(row[0] for row in cur.fetchall())
+    store = storage.open_store(url)
+    if first:
+        listed = [
+            o for _, _, objects in log_partitions.list_partitions(store, first, last)
+            for o in objects
+        ]
+    else:
+        listed = store.list()
+    objects = [
+        o for o in listed
+        if o[0].endswith('.json') and store.url(o[0]) not in loaded
+    ]
+    return store, objects
+
+
+def get_ts_range(store, key):
+
+    """
+    Reads the range of the event times of a log file. A COPY doesn't tell
+    which file every row came from, so the range is read from the file
+    itself.
+
+    Args:
+        store (object): The store of the log data.
+        key (str): The key of the log file.
+
+    Returns:
+        (tuple): The first and last event times, or None if the file has
+            no timed event.
+    """
+
+    times = [
+        json.loads(line).get('ts')
+        for line in store.read(key).splitlines()
+        if line.strip()
+    ]
+    times = [ts for ts in times if ts is not None]
+    if not times:
+        return None, None
+    return tuple(
+        datetime.datetime.utcfromtimestamp(ts / 1000)
+        for ts in [min(times), max(times)]
+    )
+
+
+def copy_new_objects(cur, store, objects, name, copy):
+
+    """
+    Writes the manifests of the given objects and copies them, as the
+    measured stage 'staging_<name>'.
+
+    Args:
+        cur (cursor): The cursor used to run the queries.
+        store (object): The store of the source.
+        objects (list): The tuples (key, size in bytes) to copy.
+        name (str): The name of the manifests.
+        copy (function): Generates the COPY query of a manifest.
+    """
+
+    target = storage.open_store(config.S3_MANIFESTS)
+    prefix = 'incremental-{}-{}'.format(time.strftime('%Y%m%d%H%M%S', time.gmtime()), name)
+    with metrics.stage('staging_{}'.format(name)) as record:
+        for number, batch in enumerate(manifest_planner.plan(objects), 1):
+            key = '{}-{:04d}.manifest'.format(prefix, number)
+            target.write(key, manifest_planner.manifest(store, batch))
+            metrics.log(' --> Batch {}: {} files'.format(number, len(batch)))
+            cur.execute(copy(target.url(key)))
+            record.measure(cur, copy=True)
+
+
+def load_incremental(first=None, last=None):
+
+    """
+    Loads the S3 objects that haven't been ingested yet, and merges them
+    into the dimension and fact tables. On a fresh database, this loads
+    the whole history.
+
+    Args:
+        first (date): The first day of the log data loaded, if any.
+        last (date): The last day of the log data loaded, included.
+    """
+
+    # The staging tables are truncated, so no other run may load them.
+    with staging_lock.hold('incremental'):
+        conn = database.connect()
+        try:
+            conn.set_session(autocommit=True)
+            with conn.cursor() as cur:
+
+                create_tables(cur)
+
+                # Finds the objects not ingested yet.
+                metrics.log('Looking for new objects')
+                events_store, events = find_new_objects(
+                    cur, 'events', config.S3_LOG_DATA, first, last
+                )
+                songs_store, songs = find_new_objects(cur, 'songs', config.S3_SONG_DATA)
+                metrics.log(' --> {} log files, {} song files'.format(len(events), len(songs)))
+                if not events and not songs:
+                    return
+
+                # Copies the new objects into the truncated staging tables.
+                metrics.log('Copying new events into the staging table \'staging_events\'')
+                cur.execute(sql_queries.staging_events_truncate)
+                cur.execute(sql_queries.staging_user_events_truncate)
+                cur.execute(sql_queries.etl_checkpoints_delete_partitions)
+                copy_new_objects(
+                    cur, events_store, events, 'events',
+                    sql_queries.staging_events_manifest_copy
+                )
+                metrics.log('Copying new songs into the staging table \'staging_songs\'')
+                cur.execute(sql_queries.staging_songs_truncate)
+                copy_new_objects(
+                    cur, songs_store, songs, 'songs',
+                    lambda url: next(sql_queries.staging_songs_copies([url]))
+                )
+
+                # Computes the join keys of the new plays.
+                metrics.log('Computing the join keys of the plays')
+                cur.execute(sql_queries.staging_plays_truncate)
+                with metrics.stage('staging_plays') as record:
+                    cur.execute(sql_queries.staging_plays_insert)
+                    record.measure(cur)
+
+            # Reads the range of the events brought by every log file.
+            ranges = [get_ts_range(events_store, key) for key, _ in events]
+
+            # Merges the delta and records the load state in one transaction,
+            # so a failed run leaves no trace and can be repeated.
+            conn.set_session(autocommit=False)
+            with conn, conn.cursor() as cur:
+
+                if config.ETL_SURROGATE_KEYS:
+                    metrics.log('Assigning the surrogate keys')
+                    with metrics.stage('key_maps') as record:
+                        for query in sql_queries.key_maps_insert:
+                            cur.execute(query)
+                            record.measure(cur)
+
+                # The plays are matched to the songs on the join keys, like
+                # in a full load, so the keys of the new songs are merged.
+                metrics.log('Merging the join keys of the songs')
+                with metrics.stage('merge_staging_song_keys') as record:
+                    for query in sql_queries.staging_song_keys_merge:
+                        cur.execute(query)
+                        record.measure(cur)
+
+                for table in ['users', 'songs', 'artists', 'time', 'songplays']:
+                    metrics.log('Merging the table \'{}\''.format(table))
+                    with metrics.stage('merge_{}'.format(table)) as record:
+                        for query in getattr(sql_queries, '{}_table_merge'.format(table)):
+                            cur.execute(query)
+                            record.measure(cur)
+
+                metrics.log('Updating the rollups')
+                with metrics.stage('rollups') as record:
+                    for query in sql_queries.rollups_update:
+                        cur.execute(query)
+                        record.measure(cur)
+
+                metrics.log('Recording the load state')
+                now = datetime.datetime.utcnow()
+                psycopg2.extras.execute_values(
+                    cur,
+                    sql_queries.load_state_insert,
+                    [
+                        (events_store.url(key), 'events', min_ts, max_ts, now)
+                        for (key, _), (min_ts, max_ts) in zip(events, ranges)
+                    ] +
+                    [(songs_store.url(key), 'songs', None, None, now) for key, _ in songs],
+                    template='(%s, %s, %s, %s, %s)',
+                    page_size=1000
+                )
+
+                cur.execute(sql_queries.data_version_insert, (now,))
+                cur.execute(sql_queries.load_state_watermark)
+                metrics.log(' --> Events loaded up to {}'.format(cur.fetchone()[0]))
+
+            # Refreshes the statistics, since the COPYs don't update them.
+            metrics.log('Analyzing the tables')
+            conn.set_session(autocommit=True)
+            with metrics.stage('analyze'), conn.cursor() as cur:
+                for query in sql_queries.analyze_tables:
+                    cur.execute(query)
+        finally:
+            conn.close()
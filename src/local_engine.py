@@ -0,0 +1,411 @@
+import argparse
+import compact_songs
+import config
+import create_tables
+import csv
+import database
+import datetime
+import etl
+import gzip
+import io
+import json
+import log_partitions
+import metrics
+import migrations
+import multiprocessing
+import os
+import psycopg2.extensions
+import re
+import sql_queries
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+# The Redshift clauses that PostgreSQL doesn't understand, and their
+# translation. Primary and foreign keys are informational in Redshift,
+# so they're dropped rather than enforced.
+translations = [
+    (r'IDENTITY\(\d+, \d+\)', 'GENERATED BY DEFAULT AS IDENTITY'),
+    (r'\bPRIMARY KEY\b', ''),
+    (r'\bREFERENCES \w+\(\w+\)', ''),
+    (r'\bDISTSTYLE \w+', ''),
+    (r'\bDISTKEY\b', ''),
+    (r'\bSORTKEY\b', ''),
+    (r'\bENCODE \w+', ''),
+    (r'DATE_PART\(WEEKDAY,', "DATE_PART('dow',"),
+    (r'DATE_PART\((\w+),', r"DATE_PART('\1',")
+]
+
+# The S3 URLs of the dataset, and the local paths standing in for them.
+# The COPYs built when 'sql_queries' is imported still hold the URLs.
+locations = {}
+
+# The process pool parsing the files of the COPYs, shared by all of them.
+# Its workers are forked from a server process, as the COPYs run in
+# threads.
+executor = None
+
+# The integer types, whose values may be written as floats in the JSON
+# objects, like the registration times of the events.
+integer_types = ['SMALLINT', 'INTEGER', 'BIGINT']
+
+# The number of source files handed to a worker at a time.
+chunk_size = 64
+
+
+def translate(query):
+
+    """
+    Translates a Redshift query for a PostgreSQL stand-in.
+
+    Args:
+        query (str): The Redshift query.
+
+    Returns:
+        (str): The PostgreSQL query.
+    """
+
+    for pattern, replacement in translations:
+        query = re.sub(pattern, replacement, query)
+    return query
+
+
+def locate(url):
+
+    """
+    Gets the local path standing in for a URL of the dataset.
+
+    Args:
+        url (str): The S3 URL or local path of an object or a prefix.
+
+    Returns:
+        (str): The local path.
+    """
+
+    for original in sorted(locations, key=len, reverse=True):
+        if url.startswith(original):
+            return locations[original] + url[len(original):]
+    if url.startswith('file://'):
+        return url[len('file://'):]
+    return url
+
+
+def list_sources(url, manifest):
+
+    """
+    Lists the local files read by a COPY: the entries of its manifest, or
+    every file whose path starts with its prefix, like the keys of a S3
+    prefix.
+
+    Args:
+        url (str): The URL in the clause 'FROM' of the COPY.
+        manifest (bool): Whether the URL is a manifest.
+
+    Returns:
+        (list): The paths of the files, sorted.
+    """
+
+    path = locate(url)
+    if manifest:
+        with open(path, 'r') as f:
+            return [locate(entry['url']) for entry in json.load(f)['entries']]
+
+    # Only the directories on the way to the prefix, or under it, are
+    # walked.
+    paths = []
+    for root, directories, files in os.walk(os.path.dirname(path)):
+        directories[:] = [
+            name for name in directories
+            if os.path.join(root, name).startswith(path) or path.startswith(os.path.join(root, name) + os.sep)
+        ]
+        for name in files:
+            source = os.path.join(root, name)
+            if not name.startswith('.') and source.startswith(path):
+                paths.append(source)
+    return sorted(paths)
+
+
+def blank_as_null(value):
+
+    """
+    Turns blank strings into None, like 'BLANKSASNULL' and 'EMPTYASNULL'.
+
+    Args:
+        value (object): The value of a field.
+
+    Returns:
+        (object): The value, or None if it's a blank string.
+    """
+
+    return None if isinstance(value, str) and not value.strip() else value
+
+
+def read_rows(path, compressed, fields, columns, epoch):
+
+    """
+    Parses the rows of a source file like a COPY in JSON format. Run by
+    the workers of the pool.
+
+    Args:
+        path (str): The path of the file.
+        compressed (bool): Whether the file is gzipped.
+        fields (list): The keys of the objects, in column order, or None
+            to match them to the columns by name, like 'auto ignorecase'.
+        columns (list): The tuples (name, declared type) of the columns.
+        epoch (bool): Whether the timestamps are epoch milliseconds.
+
+    Returns:
+        (list): The rows of the file.
+    """
+
+    with (gzip.open if compressed else open)(path, 'rt') as f:
+        text = f.read()
+
+    rows = []
+    for obj in compact_songs.iter_objects(text):
+        if fields is None:
+            obj = {key.lower(): value for key, value in obj.items()}
+        row = []
+        for field, (name, declared) in zip(fields or [name for name, _ in columns], columns):
+            value = blank_as_null(obj.get(field))
+            if value is not None and declared == 'TIMESTAMP' and epoch:
+                value = datetime.datetime.utcfromtimestamp(value / 1000)
+            if isinstance(value, float) and declared in integer_types:
+                value = round(value)
+            length = re.match(r'VARCHAR\((\d+)\)', declared)
+            if value is not None and length:
+                value = str(value)[:int(length.group(1))]
+            row.append(value)
+        rows.append(row)
+    return rows
+
+
+class RowStream:
+
+    """
+    A file-like object reading rows as CSV, for a 'COPY FROM STDIN'. The
+    rows are pulled as the database reads, so they're never all held.
+    """
+
+    def __init__(self, rows):
+
+        """
+        Args:
+            rows (iterable): The rows.
+        """
+
+        self.rows = iter(rows)
+        self.buffer = b''
+
+    def read(self, size=-1):
+
+        """
+        Reads the next lines of CSV.
+
+        Args:
+            size (int): The number of bytes wanted, or -1 for all.
+
+        Returns:
+            (bytes): The lines read, empty once the rows are exhausted.
+        """
+
+        text = io.StringIO()
+        writer = csv.writer(text)
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            writer.writerow(row)
+            self.buffer += text.getvalue().encode('utf-8')
+            text.seek(0)
+            text.truncate()
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class LocalCursor(psycopg2.extensions.cursor):
+
+    """
+    A cursor of a PostgreSQL stand-in of the database Sparkify. It
+    translates the Redshift queries, and runs the COPYs from S3 as
+    'COPY FROM STDIN' of the local files standing in for the bucket.
+    """
+
+    def execute(self, query, vars=None):
+
+        """
+        Runs a query.
+
+        Args:
+            query (str): The Redshift query.
+            vars (object): The parameters of the query.
+        """
+
+        if isinstance(query, str) and re.match(r'\s*COPY \w+\s+FROM \'', query):
+            return self.copy_from_source(query)
+        if isinstance(query, str):
+            query = translate(query)
+        return super().execute(query, vars)
+
+    def copy_from_source(self, query):
+
+        """
+        Runs a COPY from S3 as a 'COPY FROM STDIN', with its JSON mapping,
+        time format, compression and manifest. The files are parsed by a
+        process pool, and copied as the workers return them.
+
+        Args:
+            query (str): The COPY query.
+        """
+
+        table = re.search(r'COPY (\w+)', query).group(1)
+        url = re.search(r"FROM '([^']*)'", query).group(1)
+        mapping = re.search(r"JSON '([^']*)'", query).group(1)
+        paths = list_sources(url, re.search(r'\bMANIFEST\b', query) is not None)
+
+        ddl = getattr(sql_queries, '{}_table_create'.format(table))
+        columns = [
+            (name, column['type'])
+            for name, column in migrations.parse_table(ddl)['columns'].items()
+            if not column['identity']
+        ]
+        fields = None
+        if not mapping.startswith('auto'):
+            with open(locate(mapping), 'r') as f:
+                fields = [re.match(r"\$\['(\w+)'\]", p).group(1) for p in json.load(f)['jsonpaths']]
+
+        batches = executor.map(
+            read_rows,
+            paths,
+            [re.search(r'\bGZIP\b', query) is not None] * len(paths),
+            [fields] * len(paths),
+            [columns] * len(paths),
+            ['epochmillisecs' in query] * len(paths),
+            chunksize=chunk_size
+        )
+        self.copy_expert(
+            'COPY {} ({}) FROM STDIN WITH (FORMAT csv);'.format(table, ', '.join(n for n, _ in columns)),
+            RowStream(row for rows in batches for row in rows)
+        )
+
+
+def activate(dsn=None, data=None, pool_size=None):
+
+    """
+    Points the ETL at a local PostgreSQL database standing in for
+    Redshift, and at a local directory standing in for the bucket. The
+    connections opened afterwards use the cursor 'LocalCursor'.
+
+    Args:
+        dsn (str): The DSN of the PostgreSQL stand-in. Defaults to the
+            setting 'LOCAL_DSN'.
+        data (str): The directory of the dataset, laid out like the S3
+            bucket. Defaults to the setting 'LOCAL_DATA'.
+        pool_size (int): The size of the process pool parsing the files of
+            a COPY. Defaults to the setting 'LOCAL_WORKERS' (the CPU count
+            if unset).
+    """
+
+    global executor
+    data = os.path.abspath(data or config.LOCAL_DATA)
+    if executor is None:
+        executor = ProcessPoolExecutor(
+            max_workers=pool_size or config.LOCAL_WORKERS or os.cpu_count(),
+            mp_context=multiprocessing.get_context('forkserver')
+        )
+    settings = [
+        ('S3_LOG_DATA', 'log_data'),
+        ('S3_LOG_JSON_PATH', 'log_json_path.json'),
+        ('S3_SONG_DATA', 'song_data'),
+        ('S3_SONG_DATA_COMPACTED', 'compacted_song_data'),
+        ('S3_LOG_DATA_SPLIT', 'split_log_data'),
+        ('S3_MANIFESTS', 'manifests')
+    ]
+    for name, path in settings:
+        if getattr(config, name):
+            locations[getattr(config, name)] = os.path.join(data, path)
+        setattr(config, name, os.path.join(data, path))
+
+    config.SPARKIFYDB_DSN = dsn or config.LOCAL_DSN
+    database.cursor_factory = LocalCursor
+
+
+def run_locally(dsn=None, data=None, pool_size=None, resume=False, serial=False, incremental_load=False,
+                first=None, last=None):
+
+    """
+    Runs the ETL end to end against a local PostgreSQL database standing
+    in for Redshift, reading the dataset from a local directory. The
+    database is initialized first, unless the run is resumed, incremental
+    or ranged, as those load into the tables already there.
+
+    Args:
+        dsn (str): The DSN of the PostgreSQL stand-in. Defaults to the
+            setting 'LOCAL_DSN'.
+        data (str): The directory of the dataset, laid out like the S3
+            bucket. Defaults to the setting 'LOCAL_DATA'.
+        pool_size (int): The size of the process pool parsing the files of
+            a COPY.
+        resume (bool): Whether to skip the stages completed by the
+            previous run.
+        serial (bool): Whether to run the stages one after another.
+        incremental_load (bool): Whether to load only the new files and
+            merge them into the tables.
+        first (date): The first day of the log data loaded, if any.
+        last (date): The last day of the log data loaded, included.
+    """
+
+    activate(dsn, data, pool_size)
+    metrics.log('Running the ETL on \'{}\' from \'{}\''.format(config.SPARKIFYDB_DSN, config.S3_LOG_DATA))
+    if not resume and not incremental_load and not first:
+        create_tables.init_database()
+    etl.populate(resume, serial, incremental_load, first, last)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Runs the ETL end to end on a local PostgreSQL database and dataset.'
+    )
+    parser.add_argument('--dsn', help='the DSN of the PostgreSQL stand-in')
+    parser.add_argument('--data', help='the directory of the dataset')
+    parser.add_argument('--workers', type=int, help='the size of the process pool parsing the files')
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='skip the stages completed by the previous run'
+    )
+    parser.add_argument(
+        '--serial',
+        action='store_true',
+        help='run the stages and the song batches one after another'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='load only the new files and merge them into the tables'
+    )
+    parser.add_argument(
+        '--from',
+        dest='first',
+        type=log_partitions.parse_date,
+        help='the first day of the log data loaded, like 2018-11-01'
+    )
+    parser.add_argument(
+        '--to',
+        dest='last',
+        type=log_partitions.parse_date,
+        help='the last day of the log data loaded (defaults to --from)'
+    )
+    args = parser.parse_args()
+    if args.last and not args.first:
+        parser.error('--to needs --from')
+
+    run_locally(
+        args.dsn, args.data, args.workers, args.resume, args.serial, args.incremental,
+        args.first, args.last or args.first
+    )
+    metrics.log('Database Sparkify loaded locally :-)')
+    metrics.print_summary()
@@ -0,0 +1,81 @@
+import datetime
+
+
+def parse_date(text):
+
+    """
+    Parses a date given on the command line.
+
+    Args:
+        text (str): The date, like '2018-11-01'.
+
+    Returns:
+        (date): The date.
+    """
+
+    return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def get_days(first, last):
+
+    """
+    Expands a range of dates into its days.
+
+    Args:
+        first (date): The first day of the range.
+        last (date): The last day of the range, included.
+
+    Returns:
+        (list): The days of the range, in order.
+    """
+
+    return [
+        first + datetime.timedelta(days=offset)
+        for offset in range((last - first).days + 1)
+    ]
+
+
+def day_prefix(day):
+
+    """
+    Gets the prefix of the log files of a day, which are laid out by year
+    and month, like '2018/11/2018-11-01-events.json'.
+
+    Args:
+        day (date): The day.
+
+    Returns:
+        (str): The prefix of the keys of the day.
+    """
+
+    return day.strftime('%Y/%m/%Y-%m-%d')
+
+
+def list_partitions(store, first, last):
+
+    """
+    Lists the log files of every day of a range. The store is listed once
+    per month, and the days without any file are left out, since a COPY
+    from a prefix matching nothing fails.
+
+    Args:
+        store (object): The store of the log data.
+        first (date): The first day of the range.
+        last (date): The last day of the range, included.
+
+    Returns:
+        (list): The tuples (day, prefix, objects) of the days with files,
+            the objects being tuples (key, size in bytes).
+    """
+
+    months = {}
+    partitions = []
+    for day in get_days(first, last):
+        month = day.strftime('%Y/%m/')
+        if month not in months:
+            months[month] = [o for o in store.list(month) if o[0].endswith('.json')]
+        prefix = day_prefix(day)
+        objects = [o for o in months[month] if o[0].startswith(prefix)]
+        if objects:
+            partitions.append((day, prefix, objects))
+    return partitions
@@ -0,0 +1,173 @@
+import argparse
+import config
+import database
+import metrics
+import time
+
+
+# The state of the tables of the database Sparkify, on Redshift. The
+# rows marked for deletion are counted in 'tbl_rows' but not in
+# 'estimated_visible_rows'.
+table_info_select = """
+    SELECT "table",
+           size,
+           tbl_rows,
+           estimated_visible_rows,
+           unsorted,
+           stats_off
+      FROM svv_table_info
+     WHERE "schema" = 'public';
+"""
+
+# The commands run by the maintenance, by operation.
+commands = {
+    'sort': 'VACUUM SORT ONLY {};',
+    'delete': 'VACUUM DELETE ONLY {};',
+    'full': 'VACUUM FULL {};',
+    'analyze': 'ANALYZE {};'
+}
+
+
+def plan_maintenance(rows, unsorted_threshold, stats_off_threshold, deleted_threshold):
+
+    """
+    Decides which tables need to be vacuumed or analyzed. A table is
+    sorted if its unsorted percentage is above the threshold, its deleted
+    rows are reclaimed if their percentage is, and both are done by a
+    single full vacuum if both are. A table is analyzed if its statistics
+    are more stale than the threshold. The operations are ordered by
+    benefit: the megabytes of the table they fix, vacuums first.
+
+    Args:
+        rows (list): The rows of 'SVV_TABLE_INFO': the tuples (table,
+            size in MB, rows, visible rows, unsorted %, stats off %).
+        unsorted_threshold (float): The unsorted percentage above which
+            a table is sorted.
+        stats_off_threshold (float): The stale statistics percentage
+            above which a table is analyzed.
+        deleted_threshold (float): The deleted rows percentage above
+            which a table is vacuumed.
+
+    Returns:
+        (list): The tuples (table, operation, benefit in MB) to run, in
+            order.
+    """
+
+    vacuums, analyzes = [], []
+    for table, size, total, visible, unsorted, stats_off in rows:
+        unsorted = unsorted or 0
+        stats_off = stats_off or 0
+        deleted = 100.0 * (total - visible) / total if total and visible is not None else 0
+
+        sort = unsorted > unsorted_threshold
+        delete = deleted > deleted_threshold
+        if sort and delete:
+            vacuums.append((table, 'full', size * max(unsorted, deleted) / 100))
+        elif sort:
+            vacuums.append((table, 'sort', size * unsorted / 100))
+        elif delete:
+            vacuums.append((table, 'delete', size * deleted / 100))
+
+        if stats_off > stats_off_threshold:
+            analyzes.append((table, 'analyze', size * stats_off / 100))
+
+    def by_benefit(operations):
+        return sorted(operations, key=lambda operation: operation[2], reverse=True)
+
+    return by_benefit(vacuums) + by_benefit(analyzes)
+
+
+def get_unsorted(cur):
+
+    """
+    Gets the unsorted percentage of every table.
+
+    Args:
+        cur (cursor): The cursor used to run the queries.
+
+    Returns:
+        (dict): The unsorted percentage of every table, by name.
+    """
+
+    cur.execute(table_info_select)
+    return {row[0]: row[4] or 0 for row in cur.fetchall()}
+
+
+def maintain(dry_run=False):
+
+    """
+    Vacuums and analyzes the tables of the database Sparkify that need it,
+    in order of benefit, and reports the time spent against the unsorted
+    percentage recovered. Does nothing on a database other than Redshift.
+
+    Args:
+        dry_run (bool): Whether to only print the planned operations.
+    """
+
+    with database.connect() as conn:
+        conn.set_session(autocommit=True)
+        with conn.cursor() as cur:
+
+            if not metrics.is_redshift(cur):
+                metrics.log('Skipping the maintenance, only available on Redshift')
+                return
+
+            metrics.log('Planning the maintenance')
+            cur.execute(table_info_select)
+            rows = cur.fetchall()
+            operations = plan_maintenance(
+                rows,
+                config.MAINTENANCE_UNSORTED_THRESHOLD,
+                config.MAINTENANCE_STATS_OFF_THRESHOLD,
+                config.MAINTENANCE_DELETED_THRESHOLD
+            )
+            if not operations:
+                metrics.log(' --> Nothing to do')
+                return
+            for table, operation, benefit in operations:
+                metrics.log(' --> {} ({:.0f} MB to fix)'.format(
+                    commands[operation].format(table),
+                    benefit
+                ))
+            if dry_run:
+                return
+
+            unsorted = {row[0]: row[4] or 0 for row in rows}
+            start = time.time()
+            recovered = 0
+            for table, operation, _ in operations:
+                with metrics.stage('{}:{}'.format(operation, table)):
+                    stage_start = time.time()
+                    cur.execute(commands[operation].format(table))
+                    elapsed = time.time() - stage_start
+
+                if operation in ['sort', 'full']:
+                    after = get_unsorted(cur).get(table, 0)
+                    recovered += unsorted[table] - after
+                    metrics.log(' --> {}: {:.1f}% to {:.1f}% unsorted in {:.1f}s'.format(
+                        table, unsorted[table], after, elapsed
+                    ))
+                else:
+                    metrics.log(' --> {}: {} in {:.1f}s'.format(table, operation, elapsed))
+
+            metrics.log(' --> {} operations in {:.1f}s, {:.1f} unsorted points recovered'.format(
+                len(operations),
+                time.time() - start,
+                recovered
+            ))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Vacuums and analyzes the tables of the database Sparkify that need it.'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='only print the planned operations'
+    )
+    args = parser.parse_args()
+
+    maintain(args.dry_run)
+    metrics.print_summary()
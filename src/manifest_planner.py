@@ -0,0 +1,162 @@
+import argparse
+import config
+import json
+import sql_queries
+import storage
+
+
+def balance(objects, capacities):
+
+    """
+    Bins the given objects into batches balanced by byte size. The objects
+    are sorted from the largest to the smallest and dealt back and forth
+    over the batches (snake order), skipping the batches that are full.
+
+    Args:
+        objects (list): The tuples (key, size in bytes) to bin.
+        capacities (list): The number of objects of every batch.
+
+    Returns:
+        (list): The batches, every one a list of tuples (key, size).
+    """
+
+    bins = [[] for _ in capacities]
+    order = list(range(len(bins))) + list(reversed(range(len(bins))))
+    position = 0
+    for obj in sorted(objects, key=lambda o: (-o[1], o[0])):
+        slot = order[position % len(order)]
+        while len(bins[slot]) >= capacities[slot]:
+            position += 1
+            slot = order[position % len(order)]
+        bins[slot].append(obj)
+        position += 1
+    return [sorted(b) for b in bins if b]
+
+
+def plan(objects, batches=None, slices=None):
+
+    """
+    Plans the batches for the given objects. Every batch holds a number of
+    files multiple of the cluster's slice count, so all the slices take a
+    share of the work of every COPY; only the last batch takes the files
+    that don't fill a whole round of slices.
+
+    Args:
+        objects (list): The tuples (key, size in bytes) to plan.
+        batches (int): The desired number of batches. Defaults to the
+            setting 'MANIFEST_BATCHES'.
+        slices (int): The cluster's slice count. Defaults to
+            NUMBER_OF_NODES x SLICES_PER_NODE.
+
+    Returns:
+        (list): The batches, every one a list of tuples (key, size).
+    """
+
+    batches = batches or config.ETL_MANIFEST_BATCHES
+    slices = slices or config.REDSHIFT_NUMBER_OF_SLICES
+
+    # Splits the rounds of slices as evenly as possible between batches.
+    rounds, leftover = divmod(len(objects), slices)
+    batches = max(1, min(batches, rounds))
+    capacities = [
+        slices * (rounds // batches + (1 if number < rounds % batches else 0))
+        for number in range(batches)
+    ]
+    capacities[-1] += leftover
+    return balance(objects, capacities)
+
+
+def manifest(store, batch):
+
+    """
+    Builds the content of a COPY manifest.
+
+    Args:
+        store (object): The store containing the objects.
+        batch (list): The tuples (key, size in bytes) of the batch.
+
+    Returns:
+        (bytes): The manifest, JSON encoded.
+    """
+
+    return json.dumps({
+        'entries': [
+            {
+                'url': store.url(key),
+                'mandatory': True,
+                'meta': {'content_length': size}
+            }
+            for key, size in batch
+        ]
+    }, indent=2).encode('utf-8')
+
+
+def write_manifests(source, target, name, batches=None, slices=None):
+
+    """
+    Lists the objects of a source, plans them in batches and writes a
+    manifest per batch.
+
+    Args:
+        source (str): The URL of the source data.
+        target (str): The URL where the manifests are written.
+        name (str): The name of the manifests, like 'songs'.
+        batches (int): The desired number of batches.
+        slices (int): The cluster's slice count.
+
+    Returns:
+        (list): The URLs of the manifests written.
+    """
+
+    source_store = storage.open_store(source)
+    target_store = storage.open_store(target)
+    objects = [o for o in source_store.list() if o[0].endswith('.json')]
+
+    urls = []
+    for number, batch in enumerate(plan(objects, batches, slices), 1):
+        key = '{}-{:04d}.manifest'.format(name, number)
+        target_store.write(key, manifest(source_store, batch))
+        urls.append(target_store.url(key))
+    return urls
+
+
+def plan_copies(batches=None, slices=None):
+
+    """
+    Writes the manifests of the song data and the log data, and generates
+    the queries to copy them.
+
+    Args:
+        batches (int): The desired number of batches per source.
+        slices (int): The cluster's slice count.
+
+    Returns:
+        (tuple): The lists of queries to copy the events and the songs.
+    """
+
+    events = write_manifests(
+        config.S3_LOG_DATA, config.S3_MANIFESTS, 'events', batches, slices
+    )
+    songs = write_manifests(
+        config.S3_SONG_DATA, config.S3_MANIFESTS, 'songs', batches, slices
+    )
+    return (
+        [sql_queries.staging_events_manifest_copy(url) for url in events],
+        list(sql_queries.staging_songs_copies(songs))
+    )
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Plans the COPY manifests of the song and log data.'
+    )
+    parser.add_argument('source', help='the URL of the source data')
+    parser.add_argument('target', help='the URL where the manifests are written')
+    parser.add_argument('--name', default='songs', help='the name of the manifests')
+    parser.add_argument('--batches', type=int, help='the desired number of batches')
+    parser.add_argument('--slices', type=int, help='the cluster\'s slice count')
+    args = parser.parse_args()
+
+    for url in write_manifests(args.source, args.target, args.name, args.batches, args.slices):
+        print(url)
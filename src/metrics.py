@@ -0,0 +1,237 @@
+import config
+import contextlib
+import datetime
+import json
+import threading
+import time
+
+
+# The records of the stages run by this process.
+records = []
+
+# Guards the records and the sinks, written from several threads.
+lock = threading.Lock()
+
+# Whether the database is Redshift, found out on the first measure.
+redshift = None
+
+# The bytes scanned by the last query, and the microseconds it spent
+# queued and running in its WLM queue, on Redshift.
+query_bytes_and_times = """
+    SELECT (SELECT COALESCE(SUM(bytes), 0)
+              FROM svl_query_summary
+             WHERE query = pg_last_query_id()
+               AND label LIKE 'scan%'),
+           COALESCE(SUM(total_queue_time), 0),
+           COALESCE(SUM(total_exec_time), 0)
+      FROM stl_wlm_query
+     WHERE query = pg_last_query_id();
+"""
+
+# The lines and files loaded by the last COPY, on Redshift.
+copy_lines_and_files = """
+    SELECT COALESCE(SUM(lines_scanned), 0),
+           COUNT(DISTINCT filename)
+      FROM stl_load_commits
+     WHERE query = pg_last_copy_id();
+"""
+
+# The bytes read by the last COPY, on Redshift.
+copy_bytes = """
+    SELECT COALESCE(SUM(bytes), 0)
+      FROM stl_file_scan
+     WHERE query = pg_last_copy_id();
+"""
+
+# The microseconds the last COPY spent queued and running in its WLM
+# queue, on Redshift.
+copy_times = """
+    SELECT COALESCE(SUM(total_queue_time), 0),
+           COALESCE(SUM(total_exec_time), 0)
+      FROM stl_wlm_query
+     WHERE query = pg_last_copy_id();
+"""
+
+
+def log(text):
+
+    """
+    Prints a timestamp next to the the given text.
+
+    Args:
+        text (str): The text to print.
+    """
+
+    print('{} | {}'.format(time.strftime('%H:%M:%S', time.gmtime()), text))
+
+
+def is_redshift(cur):
+
+    """
+    Checks whether the database is Redshift. The system tables used to
+    measure the bytes and files loaded don't exist anywhere else, like
+    on a local PostgreSQL stand-in.
+
+    Args:
+        cur (cursor): A cursor of the database.
+
+    Returns:
+        (bool): True if the database is Redshift.
+    """
+
+    global redshift
+    if redshift is None:
+        cur.execute('SELECT version();')
+        redshift = 'Redshift' in cur.fetchone()[0]
+    return redshift
+
+
+class Record(dict):
+
+    """
+    The metrics of a stage: start and end time, duration, rows, bytes
+    scanned, files loaded, and seconds spent queued and running in the
+    WLM queues.
+    """
+
+    def measure(self, cur, copy=False):
+
+        """
+        Adds the metrics of the last query run by the given cursor.
+
+        Args:
+            cur (cursor): The cursor that ran the query.
+            copy (bool): Whether the query was a COPY.
+        """
+
+        self['rows'] += max(cur.rowcount, 0)
+        if not is_redshift(cur):
+            return
+        if copy:
+            cur.execute(copy_lines_and_files)
+            lines, files = cur.fetchone()
+            self['rows'] = max(self['rows'], lines)
+            self['files'] = (self['files'] or 0) + files
+            cur.execute(copy_bytes)
+            self['bytes'] = (self['bytes'] or 0) + cur.fetchone()[0]
+            cur.execute(copy_times)
+            queue, execution = cur.fetchone()
+        else:
+            cur.execute(query_bytes_and_times)
+            scanned, queue, execution = cur.fetchone()
+            self['bytes'] = (self['bytes'] or 0) + scanned
+        self['queue_seconds'] = round((self['queue_seconds'] or 0) + queue / 1000000.0, 3)
+        self['exec_seconds'] = round((self['exec_seconds'] or 0) + execution / 1000000.0, 3)
+
+
+@contextlib.contextmanager
+def stage(name):
+
+    """
+    Measures a stage and emits its record to the sink once it's over,
+    whether it succeeds or not.
+
+    Args:
+        name (str): The name of the stage.
+
+    Yields:
+        (Record): The record of the stage, to add measures to.
+    """
+
+    record = Record(
+        stage=name,
+        start=datetime.datetime.utcnow().isoformat(),
+        end=None,
+        seconds=None,
+        rows=0,
+        bytes=None,
+        files=None,
+        queue_seconds=None,
+        exec_seconds=None,
+        status='running'
+    )
+    start = time.time()
+    try:
+        yield record
+        record['status'] = 'completed'
+    except BaseException:
+        record['status'] = 'failed'
+        raise
+    finally:
+        record['end'] = datetime.datetime.utcnow().isoformat()
+        record['seconds'] = round(time.time() - start, 3)
+        emit(record)
+
+
+def emit(record):
+
+    """
+    Keeps a record and writes it to the JSON-lines sink, if enabled.
+
+    Args:
+        record (Record): The record of a stage.
+    """
+
+    with lock:
+        records.append(record)
+        if config.METRICS_SINK == 'jsonl':
+            with open(config.METRICS_PATH, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+
+def flush():
+
+    """
+    Writes the records to the Prometheus text file, if enabled. The file
+    is rewritten as a whole, as expected by the textfile collectors.
+    """
+
+    if config.METRICS_SINK != 'prometheus':
+        return
+
+    metrics = [
+        ('seconds', 'sparkify_etl_stage_duration_seconds', 'Duration of the stage.'),
+        ('rows', 'sparkify_etl_stage_rows', 'Rows written by the stage.'),
+        ('bytes', 'sparkify_etl_stage_bytes_scanned', 'Bytes scanned by the stage.'),
+        ('files', 'sparkify_etl_stage_files_loaded', 'Files loaded by the stage.'),
+        ('queue_seconds', 'sparkify_etl_stage_queue_seconds', 'Seconds queued in WLM by the stage.'),
+        ('exec_seconds', 'sparkify_etl_stage_exec_seconds', 'Seconds run in WLM by the stage.')
+    ]
+    lines = []
+    with lock:
+        for key, name, description in metrics:
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} gauge'.format(name))
+            for record in records:
+                if record[key] is not None:
+                    lines.append('{}{{stage="{}",status="{}"}} {}'.format(
+                        name, record['stage'], record['status'], record[key]
+                    ))
+    with open(config.METRICS_PATH, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def print_summary():
+
+    """
+    Prints a table summing up the records of the run, and flushes them.
+    """
+
+    flush()
+    if not records:
+        return
+
+    print('{:<24} {:>10} {:>10} {:>12} {:>6} {:>8} {:>8}  {}'.format(
+        'Stage', 'Seconds', 'Rows', 'Bytes', 'Files', 'Queued', 'Running', 'Status'
+    ))
+    for record in records:
+        print('{:<24} {:>10.1f} {:>10} {:>12} {:>6} {:>8} {:>8}  {}'.format(
+            record['stage'],
+            record['seconds'],
+            record['rows'],
+            '-' if record['bytes'] is None else record['bytes'],
+            '-' if record['files'] is None else record['files'],
+            '-' if record['queue_seconds'] is None else '{:.1f}'.format(record['queue_seconds']),
+            '-' if record['exec_seconds'] is None else '{:.1f}'.format(record['exec_seconds']),
+            record['status']
+        ))
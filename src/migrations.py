@@ -0,0 +1,590 @@
+import argparse
+import database
+import metrics
+import promotion
+import re
+import sql_queries
+
+
+# The tables of the database Sparkify, in creation order: the tables
+# referenced by a foreign key come first.
+tables = [
+    'load_state',
+    'etl_checkpoints',
+    'etl_lock',
+    'staging_events',
+    'staging_user_events',
+    'staging_songs',
+    'staging_plays',
+    'staging_song_keys',
+    'time',
+    'song_keys',
+    'artist_keys',
+    'users',
+    'artists',
+    'songs',
+    'songplays',
+    'daily_plays_by_song',
+    'daily_active_users_by_level',
+    'hourly_plays',
+    'data_version'
+]
+
+# The names given by the catalog to the types declared in the queries,
+# and the length of the types declared without one.
+type_names = {
+    'VARCHAR': 'character varying',
+    'CHAR': 'character',
+    'SMALLINT': 'smallint',
+    'INTEGER': 'integer',
+    'BIGINT': 'bigint',
+    'FLOAT': 'double precision',
+    'BOOLEAN': 'boolean',
+    'DATE': 'date',
+    'TIMESTAMP': 'timestamp without time zone'
+}
+default_lengths = {
+    'VARCHAR': 256,
+    'CHAR': 1
+}
+
+# The distribution styles of 'PG_CLASS.RELDISTSTYLE', on Redshift. The
+# others are the automatic ones.
+diststyles = {
+    0: 'EVEN',
+    1: 'KEY',
+    8: 'ALL'
+}
+
+# The columns of the tables of the current schema.
+columns_select = """
+    SELECT pg_class.relname,
+           pg_attribute.attname,
+           format_type(pg_attribute.atttypid, pg_attribute.atttypmod),
+           pg_attribute.attnotnull
+      FROM pg_attribute
+      JOIN pg_class
+        ON pg_attribute.attrelid = pg_class.oid
+      JOIN pg_namespace
+        ON pg_class.relnamespace = pg_namespace.oid
+     WHERE pg_namespace.nspname = current_schema()
+       AND pg_class.relkind = 'r'
+       AND pg_attribute.attnum > 0
+       AND NOT pg_attribute.attisdropped
+  ORDER BY pg_class.relname,
+           pg_attribute.attnum;
+"""
+
+# The primary and foreign keys of the tables of the current schema.
+constraints_select = """
+    SELECT pg_class.relname,
+           pg_get_constraintdef(pg_constraint.oid)
+      FROM pg_constraint
+      JOIN pg_class
+        ON pg_constraint.conrelid = pg_class.oid
+      JOIN pg_namespace
+        ON pg_class.relnamespace = pg_namespace.oid
+     WHERE pg_namespace.nspname = current_schema()
+       AND pg_constraint.contype IN ('p', 'f');
+"""
+
+# The encodings, distribution and sort keys of the columns, on Redshift.
+column_keys_select = """
+    SELECT tablename,
+           "column",
+           encoding,
+           distkey,
+           sortkey
+      FROM pg_table_def
+     WHERE schemaname = current_schema();
+"""
+
+# The distribution styles of the tables, on Redshift.
+diststyles_select = """
+    SELECT pg_class.relname,
+           pg_class.reldiststyle
+      FROM pg_class
+      JOIN pg_namespace
+        ON pg_class.relnamespace = pg_namespace.oid
+     WHERE pg_namespace.nspname = current_schema()
+       AND pg_class.relkind = 'r';
+"""
+
+# The primary and foreign keys, as written by 'PG_GET_CONSTRAINTDEF'. The
+# identifiers that are keywords, like the table 'time', come quoted.
+primary_key_pattern = re.compile(r'PRIMARY KEY \((.*)\)')
+foreign_key_pattern = re.compile(r'FOREIGN KEY \("?(\w+)"?\) REFERENCES (?:"?\w+"?\.)?"?(\w+)"?\s*\("?(\w+)"?\)')
+
+# The in-place changes, by kind.
+alters = {
+    'add_column': 'ALTER TABLE {} ADD COLUMN {} {};',
+    'drop_column': 'ALTER TABLE {} DROP COLUMN {};',
+    'alter_type': 'ALTER TABLE {} ALTER COLUMN {} TYPE {};',
+    'alter_encoding': 'ALTER TABLE {} ALTER COLUMN {} ENCODE {};',
+    'alter_diststyle': 'ALTER TABLE {} ALTER DISTSTYLE {};',
+    'alter_distkey': 'ALTER TABLE {} ALTER DISTKEY {};',
+    'alter_sortkey': 'ALTER TABLE {} ALTER SORTKEY ({});'
+}
+
+
+def split_definitions(body):
+
+    """
+    Splits the body of a 'CREATE TABLE' query into its column
+    definitions, on the commas outside of parentheses.
+
+    Args:
+        body (str): The text between the parentheses of the query.
+
+    Returns:
+        (list): The column definitions.
+    """
+
+    definitions, depth, start = [], 0, 0
+    for position, char in enumerate(body):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and not depth:
+            definitions.append(body[start:position])
+            start = position + 1
+    definitions.append(body[start:])
+    return [' '.join(d.split()) for d in definitions if d.strip()]
+
+
+def parse_table(ddl):
+
+    """
+    Describes a table as data, from its 'CREATE TABLE' query.
+
+    Args:
+        ddl (str): The 'CREATE TABLE' query, as written in 'sql_queries'.
+
+    Returns:
+        (dict): The columns of the table, by name, each with its declared
+            type, nullability, identity and encoding, and the primary key,
+            foreign keys, distribution style, distribution and sort keys
+            of the table.
+    """
+
+    start = ddl.index('(')
+    end = ddl.rindex(')')
+    diststyle = re.search(r'\bDISTSTYLE (\w+)', ddl[end:])
+    table = {
+        'columns': {},
+        'primary_key': [],
+        'foreign_keys': {},
+        'diststyle': diststyle.group(1) if diststyle else None,
+        'distkey': None,
+        'sortkey': []
+    }
+
+    for definition in split_definitions(ddl[start + 1:end]):
+        name, declared, attributes = re.match(r'(\w+) (\w+(?:\([\d, ]+\))?)(.*)', definition).groups()
+        name = name.lower()
+        encoding = re.search(r'\bENCODE (\w+)', attributes)
+        reference = re.search(r'\bREFERENCES (\w+)\((\w+)\)', attributes)
+        table['columns'][name] = {
+            'type': declared,
+            'not_null': 'NOT NULL' in attributes or 'PRIMARY KEY' in attributes,
+            'identity': 'IDENTITY' in attributes,
+            'encoding': encoding.group(1).lower() if encoding else None
+        }
+        if 'PRIMARY KEY' in attributes:
+            table['primary_key'].append(name)
+        if reference:
+            table['foreign_keys'][name] = (reference.group(1), reference.group(2).lower())
+        if re.search(r'\bDISTKEY\b', attributes):
+            table['distkey'] = name
+        if re.search(r'\bSORTKEY\b', attributes):
+            table['sortkey'].append(name)
+    return table
+
+
+def canonical_type(declared, redshift):
+
+    """
+    Gets the name given by the catalog to a declared type.
+
+    Args:
+        declared (str): The declared type, like 'VARCHAR(1024)'.
+        redshift (bool): Whether the database is Redshift, where the
+            VARCHARs declared without a length get a default one.
+
+    Returns:
+        (str): The type, like 'character varying(1024)'.
+    """
+
+    name, length = re.match(r'(\w+)(?:\((\d+)\))?$', declared).groups()
+    if length is None and name in default_lengths and (redshift or name != 'VARCHAR'):
+        length = default_lengths[name]
+    canonical = type_names.get(name, name.lower())
+    return '{}({})'.format(canonical, length) if length else canonical
+
+
+def get_desired():
+
+    """
+    Describes the tables declared in 'sql_queries', as data.
+
+    Returns:
+        (dict): The description of every table, by name.
+    """
+
+    return {
+        table: parse_table(getattr(sql_queries, '{}_table_create'.format(table)))
+        for table in tables
+    }
+
+
+def get_live(cur, redshift):
+
+    """
+    Describes the tables of the database as data, from its catalog.
+
+    Args:
+        cur (cursor): The cursor used to run the queries.
+        redshift (bool): Whether the database is Redshift, whose catalog
+            also holds the encodings, distribution and sort keys.
+
+    Returns:
+        (dict): The description of every table, by name, in the format
+            of 'parse_table', with the types as named by the catalog.
+    """
+
+    live = {}
+    cur.execute(columns_select)
+    for table, column, column_type, not_null in cur.fetchall():
+        description = live.setdefault(table, {
+            'columns': {},
+            'primary_key': [],
+            'foreign_keys': {},
+            'diststyle': None,
+            'distkey': None,
+            'sortkey': []
+        })
+        description['columns'][column] = {
+            'type': column_type,
+            'not_null': not_null,
+            'identity': False,
+            'encoding': None
+        }
+
+    cur.execute(constraints_select)
+    for table, definition in cur.fetchall():
+        primary_key = primary_key_pattern.match(definition)
+        foreign_key = foreign_key_pattern.match(definition)
+        if primary_key:
+            live[table]['primary_key'] = [c.strip().strip('"') for c in primary_key.group(1).split(',')]
+        elif foreign_key:
+            live[table]['foreign_keys'][foreign_key.group(1)] = (foreign_key.group(2), foreign_key.group(3))
+
+    if not redshift:
+        return live
+
+    cur.execute(column_keys_select)
+    sortkeys = {}
+    for table, column, encoding, distkey, sortkey in cur.fetchall():
+        if table not in live:
+            continue
+        live[table]['columns'][column]['encoding'] = encoding
+        if distkey:
+            live[table]['distkey'] = column
+        if sortkey:
+            sortkeys.setdefault(table, []).append((abs(sortkey), column))
+    for table, columns in sortkeys.items():
+        live[table]['sortkey'] = [column for _, column in sorted(columns)]
+
+    cur.execute(diststyles_select)
+    for table, diststyle in cur.fetchall():
+        if table in live:
+            live[table]['diststyle'] = diststyles.get(diststyle, 'AUTO')
+    return live
+
+
+def plan_table(table, desired, live, redshift):
+
+    """
+    Decides how to bring a table from its live definition to the declared
+    one, the cheapest way: columns added, dropped or widened in place,
+    and encodings, distribution and sort keys altered in place, on
+    Redshift. Any other change (a type narrowed or converted, a column
+    made nullable or not, new keys) needs a deep copy into a shadow table,
+    or dropping and creating the table again for the staging tables,
+    whose contents are loaded again by every run. The encodings,
+    distribution and sort keys are only compared when declared, and the
+    primary and foreign keys only on Redshift, as they're not declared on
+    a PostgreSQL stand-in.
+
+    Args:
+        table (str): The name of the table.
+        desired (dict): The declared description of the table.
+        live (dict): The live description of the table, or None if the
+            table doesn't exist.
+        redshift (bool): Whether the database is Redshift.
+
+    Returns:
+        (tuple): The operation, 'create', 'alter', 'deep_copy',
+            'recreate' or None if the table is up to date, and the list
+            of the changes, as tuples (kind, column, value).
+    """
+
+    if live is None:
+        return 'create', []
+
+    in_place, structural = [], []
+    columns = desired['columns']
+    live_columns = live['columns']
+
+    for column, declared in columns.items():
+        declared_type = canonical_type(declared['type'], redshift)
+        current = live_columns.get(column)
+
+        if current is None:
+            if declared['not_null'] or declared['identity']:
+                structural.append(('add_column', column, declared['type']))
+            else:
+                encoding = ''
+                if declared['encoding'] and redshift:
+                    encoding = ' ENCODE {}'.format(declared['encoding'].upper())
+                in_place.append(('add_column', column, declared['type'] + encoding))
+            continue
+
+        if current['type'] != declared_type:
+            widened = re.match(r'character varying\((\d+)\)$', current['type'])
+            wanted = re.match(r'character varying\((\d+)\)$', declared_type)
+            if widened and wanted and int(wanted.group(1)) > int(widened.group(1)):
+                in_place.append(('alter_type', column, 'VARCHAR({})'.format(wanted.group(1))))
+            else:
+                structural.append(('alter_type', column, declared['type']))
+
+        nullability_declared = not declared['identity'] and (redshift or column not in desired['primary_key'])
+        if nullability_declared and current['not_null'] != declared['not_null']:
+            structural.append(('not_null' if declared['not_null'] else 'nullable', column, None))
+
+        if redshift and declared['encoding']:
+            encoding = 'none' if declared['encoding'] == 'raw' else declared['encoding']
+            if current['encoding'] != encoding:
+                in_place.append(('alter_encoding', column, declared['encoding'].upper()))
+
+    for column in live_columns:
+        if column not in columns:
+            kind = 'drop_column'
+            if column == live['distkey'] or column in live['sortkey']:
+                structural.append((kind, column, None))
+            else:
+                in_place.append((kind, column, None))
+
+    if redshift:
+        if desired['primary_key'] != live['primary_key']:
+            structural.append(('primary_key', ', '.join(desired['primary_key']), None))
+        if desired['foreign_keys'] != live['foreign_keys']:
+            structural.append(('foreign_keys', ', '.join(sorted(desired['foreign_keys'])), None))
+        if desired['diststyle'] == 'KEY' and (live['diststyle'], live['distkey']) != ('KEY', desired['distkey']):
+            in_place.append(('alter_distkey', desired['distkey'], None))
+        elif desired['diststyle'] in ('ALL', 'EVEN') and live['diststyle'] != desired['diststyle']:
+            in_place.append(('alter_diststyle', None, desired['diststyle']))
+        if desired['sortkey'] and live['sortkey'] != desired['sortkey']:
+            in_place.append(('alter_sortkey', ', '.join(desired['sortkey']), None))
+
+    if structural:
+        operation = 'recreate' if table.startswith('staging_') else 'deep_copy'
+        return operation, structural + in_place
+    if in_place:
+        return 'alter', in_place
+    return None, []
+
+
+def plan_migration(desired, live, redshift):
+
+    """
+    Plans the migration of every table that changed, in creation order.
+
+    Args:
+        desired (dict): The declared description of every table.
+        live (dict): The live description of every table.
+        redshift (bool): Whether the database is Redshift.
+
+    Returns:
+        (list): The tuples (table, operation, changes) to run, in order.
+    """
+
+    operations = []
+    for table in tables:
+        operation, changes = plan_table(table, desired[table], live.get(table), redshift)
+        if operation:
+            operations.append((table, operation, changes))
+    return operations
+
+
+def format_change(change):
+
+    """
+    Formats a change of a table for the log.
+
+    Args:
+        change (tuple): The kind of the change, its column and its value.
+
+    Returns:
+        (str): The description of the change.
+    """
+
+    kind, column, value = change
+    return ' '.join(str(part) for part in [kind, column, value] if part is not None)
+
+
+def get_alter_queries(table, changes):
+
+    """
+    Gets the queries applying the in-place changes of a table.
+
+    Args:
+        table (str): The name of the table.
+        changes (list): The tuples (kind, column, value) of the changes.
+
+    Returns:
+        (list): The 'ALTER TABLE' queries.
+    """
+
+    queries = []
+    for kind, column, value in changes:
+        arguments = [argument for argument in [column, value] if argument is not None]
+        queries.append(alters[kind].format(table, *arguments))
+    return queries
+
+
+def get_deep_copy_queries(cur, table, live):
+
+    """
+    Gets the queries copying a table into a shadow table with its declared
+    definition, and swapping the shadow in. The table stays readable
+    until the swap. The columns the table and its shadow have in common
+    are copied.
+
+    Args:
+        cur (cursor): The cursor used to look up the foreign keys.
+        table (str): The name of the table.
+        live (dict): The live description of the table.
+
+    Returns:
+        (list): The queries, to be run within a single transaction.
+    """
+
+    columns = ', '.join(
+        column for column in parse_table(getattr(sql_queries, '{}_table_create'.format(table)))['columns']
+        if column in live['columns']
+    )
+    return [
+        sql_queries.shadow_table_drop.format(table),
+        sql_queries.shadow_table_create(table),
+        'INSERT INTO {0}_shadow ({1}) SELECT {1} FROM {0};'.format(table, columns)
+    ] + promotion.get_swap_queries(cur, table)
+
+
+def migrate(dry_run=False):
+
+    """
+    Compares the tables declared in 'sql_queries' with the live catalog
+    of the database Sparkify, and migrates the tables that changed, only
+    them, each the cheapest way. The deep copies aren't run in the
+    background: each runs in its own transaction before the next table
+    is migrated, and this returns once they're all swapped in. Does
+    nothing but planning on a database other than Redshift.
+
+    Args:
+        dry_run (bool): Whether to only print the planned operations.
+
+    Returns:
+        (bool): False if a migration is needed but couldn't be applied.
+    """
+
+    conn = database.connect()
+    try:
+        conn.set_session(autocommit=True)
+        with conn.cursor() as cur:
+            redshift = metrics.is_redshift(cur)
+            metrics.log('Comparing the tables with the catalog')
+            live = get_live(cur, redshift)
+        desired = get_desired()
+        operations = plan_migration(desired, live, redshift)
+
+        if not operations:
+            metrics.log(' --> Nothing to do')
+            return True
+        for table, operation, changes in operations:
+            metrics.log(' --> {}: {}{}'.format(
+                table,
+                operation,
+                ' ({})'.format(', '.join(format_change(c) for c in changes)) if changes else ''
+            ))
+        if dry_run:
+            return True
+        if not redshift:
+            metrics.log('Skipping the migration, only available on Redshift')
+            return False
+
+        # The identity values can't be inserted on Redshift, so the
+        # tables with an IDENTITY column can't be deep-copied.
+        blocked = [
+            table for table, operation, _ in operations
+            if operation == 'deep_copy' and any(c['identity'] for c in desired[table]['columns'].values())
+        ]
+        for table, operation, changes in operations:
+            if table in blocked:
+                metrics.log(
+                    'Skipping \'{}\': its IDENTITY values can\'t be deep-copied, it must be reloaded'.format(table)
+                )
+                continue
+
+            with metrics.stage('migrate:{}'.format(table)) as record:
+                if operation == 'create':
+                    with conn.cursor() as cur:
+                        cur.execute(getattr(sql_queries, '{}_table_create'.format(table)))
+
+                # Some 'ALTER TABLE' can't run within a transaction block.
+                elif operation == 'alter':
+                    with conn.cursor() as cur:
+                        for query in get_alter_queries(table, changes):
+                            cur.execute(query)
+
+                # The deep copy runs here, synchronously: the table stays
+                # readable until the swap, but a load writing to it
+                # meanwhile would conflict with the copy.
+                else:
+                    conn.set_session(autocommit=False)
+                    try:
+                        with conn, conn.cursor() as cur:
+                            if operation == 'recreate':
+                                queries = [
+                                    getattr(sql_queries, '{}_table_drop'.format(table)),
+                                    getattr(sql_queries, '{}_table_create'.format(table))
+                                ]
+                            else:
+                                queries = get_deep_copy_queries(cur, table, live[table])
+                            for query in queries:
+                                cur.execute(query)
+                                record.measure(cur)
+                    finally:
+                        conn.set_session(autocommit=True)
+        return not blocked
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Migrates the tables of the database Sparkify that changed.'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='only print the planned operations'
+    )
+    args = parser.parse_args()
+
+    migrated = migrate(args.dry_run)
+    metrics.print_summary()
+    if not migrated:
+        raise SystemExit(1)
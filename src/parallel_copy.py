@@ -0,0 +1,66 @@
+import config
+import copy_monitor
+import database
+import metrics
+import threading
+import time
+import wlm
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_copies(batches, workers=None, max_concurrent=None):
+
+    """
+    Runs the given COPY batches concurrently. Every worker of the pool
+    opens its own connection to the database Sparkify, and a semaphore
+    limits how many COPYs are executing at the same time. Every batch is
+    checkpointed as a stage of its own, and its progress is reported.
+
+    Args:
+        batches (iterable): The tuples (stage name, query) to run.
+        workers (int): The size of the worker pool. Defaults to the
+            setting 'COPY_WORKERS' (the cluster's slice count if unset).
+        max_concurrent (int): The maximum number of COPYs running at
+            once. Defaults to the setting 'MAX_CONCURRENT_COPIES'.
+
+    Returns:
+        (list): The tuples (stage name, seconds) in batch order.
+    """
+
+    workers = workers or config.ETL_COPY_WORKERS
+    max_concurrent = max_concurrent or config.ETL_MAX_CONCURRENT_COPIES
+    semaphore = threading.BoundedSemaphore(max_concurrent)
+
+    # The connections opened by the workers, one per thread.
+    local = threading.local()
+    connections = []
+    lock = threading.Lock()
+
+    def get_connection():
+        if not hasattr(local, 'conn'):
+            local.conn = database.connect()
+            with lock:
+                connections.append(local.conn)
+        return local.conn
+
+    def copy(stage, query):
+        conn = get_connection()
+        with semaphore, wlm.session(conn, stage):
+            metrics.log(' --> {} started'.format(stage))
+            start = time.time()
+            copy_monitor.run_copy(conn, stage, query)
+            elapsed = time.time() - start
+        metrics.log(' --> {} finished in {:.1f}s'.format(stage, elapsed))
+        return stage, elapsed
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(copy, stage, query)
+                for stage, query in batches
+            ]
+            return [future.result() for future in futures]
+    finally:
+        for conn in connections:
+            conn.close()
@@ -0,0 +1,108 @@
+import checkpoint
+import metrics
+import sql_queries
+
+
+# The tables only ever appended to, whose shadows are moved into them
+# with 'ALTER TABLE APPEND' on Redshift instead of being swapped.
+append_only = ['songplays']
+
+
+def get_shadow_queries(table):
+
+    """
+    Gets the queries building the shadow of a table with its new contents.
+    A shadow left over by a failed run is dropped first.
+
+    Args:
+        table (str): The name of the table.
+
+    Returns:
+        (list): The queries building the shadow.
+    """
+
+    return [
+        sql_queries.shadow_table_drop.format(table),
+        sql_queries.shadow_table_create(table),
+        sql_queries.shadow_table_insert(table)
+    ]
+
+
+def get_swap_queries(cur, table):
+
+    """
+    Gets the queries renaming the shadow of a table over it. The foreign
+    keys referencing the table are dropped along with it, so they're
+    declared again on the shadow once renamed.
+
+    Args:
+        cur (cursor): The cursor used to look up the foreign keys.
+        table (str): The name of the table.
+
+    Returns:
+        (list): The queries swapping the shadow in, to be run within a
+            single transaction.
+    """
+
+    cur.execute(sql_queries.foreign_keys_select, (table,))
+    return [query.format(table) for query in sql_queries.table_swap] + [
+        sql_queries.foreign_key_add.format(referrer, name, definition)
+        for referrer, name, definition in cur.fetchall()
+    ]
+
+
+def append(conn, table):
+
+    """
+    Moves the blocks of the shadow of a table into it, and drops the then
+    empty shadow. If the shadow is gone, it was already appended by a run
+    that failed right after, so there's nothing to do.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        table (str): The name of the table.
+    """
+
+    conn.set_session(autocommit=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql_queries.shadow_table_exists, ('{}_shadow'.format(table),))
+            if not cur.fetchone()[0]:
+                return
+            with metrics.stage('{}:append'.format(table)) as record:
+                cur.execute(sql_queries.table_append.format(table))
+                record.measure(cur)
+                cur.execute(sql_queries.shadow_table_drop.format(table))
+    finally:
+        conn.set_session(autocommit=False)
+
+
+def promote(conn, completed, table):
+
+    """
+    Builds the new contents of a table into its shadow and promotes it, so
+    readers never see the table half-loaded. The shadow is renamed over
+    the table within the transaction that builds it, except for the
+    append-only tables on Redshift, whose shadow is built as a stage of
+    its own and then appended, since 'ALTER TABLE APPEND' can't run in a
+    transaction.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        completed (set): The names of the stages already completed.
+        table (str): The name of the table, also the name of the stage.
+    """
+
+    with conn, conn.cursor() as cur:
+        appended = table in append_only and metrics.is_redshift(cur)
+        swap = [] if appended else get_swap_queries(cur, table)
+
+    if not appended:
+        checkpoint.run_stage(conn, table, get_shadow_queries(table) + swap)
+        return
+
+    shadow = '{}:shadow'.format(table)
+    if shadow not in completed:
+        checkpoint.run_stage(conn, shadow, get_shadow_queries(table))
+    append(conn, table)
+    checkpoint.run_stage(conn, table, [])
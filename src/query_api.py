@@ -0,0 +1,267 @@
+import argparse
+import collections
+import config
+import database
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sql_queries
+import tempfile
+import threading
+
+
+class ResultCache:
+
+    """
+    A LRU cache of query results, kept in memory and optionally on disk.
+    The entries on disk are grouped in a directory per data version, and
+    the directories of the other versions are removed whenever a new one
+    shows up.
+    """
+
+    def __init__(self, size, directory=None):
+
+        """
+        Args:
+            size (int): The maximum number of entries kept in memory.
+            directory (str): The directory of the entries kept on disk,
+                or None to keep them in memory only.
+        """
+
+        self.size = size
+        self.directory = directory
+        self.entries = collections.OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def path(self, version, key):
+
+        """
+        Gets the path of an entry on disk.
+
+        Args:
+            version (str): The data version of the entry.
+            key (str): The key of the entry.
+
+        Returns:
+            (str): The path of the entry.
+        """
+
+        return os.path.join(self.directory, version, '{}.pickle'.format(key))
+
+    def set_version(self, version):
+
+        """
+        Switches the cache to a data version, dropping the entries of the
+        previous one.
+
+        Args:
+            version (str): The data version.
+        """
+
+        if version == self.version:
+            return
+        self.entries.clear()
+        self.version = version
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name != version:
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def get(self, version, key):
+
+        """
+        Gets an entry, counting a hit or a miss.
+
+        Args:
+            version (str): The current data version.
+            key (str): The key of the entry.
+
+        Returns:
+            (tuple): Whether the entry was found, and the entry.
+        """
+
+        with self.lock:
+            self.set_version(version)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            if self.directory and os.path.isfile(self.path(version, key)):
+                with open(self.path(version, key), 'rb') as f:
+                    value = pickle.load(f)
+                self.put(version, key, value, disk=False)
+                self.hits += 1
+                return True, value
+            self.misses += 1
+            return False, None
+
+    def put(self, version, key, value, disk=True):
+
+        """
+        Stores an entry, evicting the least recently used one if the
+        memory is full.
+
+        Args:
+            version (str): The data version of the entry.
+            key (str): The key of the entry.
+            value (object): The entry.
+            disk (bool): Whether to also store the entry on disk.
+        """
+
+        if version != self.version:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+        # Writes to a temporary file first, so a reader never sees a
+        # half-written entry.
+        if disk and self.directory:
+            path = self.path(version, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+            with os.fdopen(handle, 'wb') as f:
+                pickle.dump(value, f)
+            os.replace(temporary, path)
+
+
+class QueryAPI:
+
+    """
+    Runs parameterized analytic queries against the database Sparkify,
+    through a pool of connections. The results are cached by query text,
+    parameters and data version, which 'etl.py' moves every time a load
+    commits, so the cached results are always those of the current data.
+    """
+
+    def __init__(self, dsn=None, connections=None, cache_size=None, cache_directory=None):
+
+        """
+        Args:
+            dsn (str): The DSN of the database. Defaults to the database
+                Sparkify.
+            connections (int): The maximum number of pooled connections.
+                Defaults to the setting 'CONNECTIONS'.
+            cache_size (int): The maximum number of results kept in
+                memory. Defaults to the setting 'CACHE_SIZE'.
+            cache_directory (str): The directory where the results are
+                also kept, if any. Defaults to the setting 'CACHE_DIR'.
+        """
+
+        self.pool = database.create_pool(connections or config.API_CONNECTIONS, dsn)
+        self.cache = ResultCache(
+            cache_size or config.API_CACHE_SIZE,
+            cache_directory or config.API_CACHE_DIR or None
+        )
+
+    def query(self, query, params=None):
+
+        """
+        Runs a query, or gets its result from the cache. The data version
+        is read in the same REPEATABLE READ transaction as the query, so
+        both see the same snapshot, and a result is never cached under the
+        version of another load.
+
+        Args:
+            query (str): The query to run.
+            params (dict): The parameters of the query.
+
+        Returns:
+            (list): The rows of the result.
+        """
+
+        key = hashlib.sha256(json.dumps(
+            [query, params],
+            sort_keys=True,
+            default=str
+        ).encode('utf-8')).hexdigest()
+
+        conn = self.pool.getconn()
+        try:
+            conn.set_session(isolation_level='REPEATABLE READ')
+            with conn, conn.cursor() as cur:
+                cur.execute(sql_queries.data_version_select)
+                loaded_at = cur.fetchone()[0]
+                version = hashlib.sha256(str(loaded_at).encode('utf-8')).hexdigest()[:16]
+
+                found, rows = self.cache.get(version, key)
+                if found:
+                    return rows
+
+                cur.execute(query, params)
+                rows = cur.fetchall()
+        finally:
+            self.pool.putconn(conn)
+
+        with self.cache.lock:
+            self.cache.put(version, key, rows)
+        return rows
+
+    def run(self, name, **params):
+
+        """
+        Runs one of the named analytics queries.
+
+        Args:
+            name (str): The name of the query, as listed in
+                'analytics_queries'.
+            params (dict): The parameters of the query.
+
+        Returns:
+            (list): The rows of the result.
+        """
+
+        return self.query(sql_queries.analytics_queries[name], params)
+
+    def stats(self):
+
+        """
+        Gets the counters of the cache.
+
+        Returns:
+            (dict): The hits, misses and entries in memory.
+        """
+
+        with self.cache.lock:
+            return {
+                'hits': self.cache.hits,
+                'misses': self.cache.misses,
+                'entries': len(self.cache.entries)
+            }
+
+    def close(self):
+
+        """
+        Closes the pooled connections.
+        """
+
+        self.pool.closeall()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Runs one of the analytics queries of the database Sparkify.'
+    )
+    parser.add_argument('name', choices=sorted(sql_queries.analytics_queries))
+    parser.add_argument(
+        '--param',
+        action='append',
+        default=[],
+        help='a parameter of the query, as name=value'
+    )
+    args = parser.parse_args()
+
+    api = QueryAPI()
+    try:
+        for row in api.run(args.name, **dict(p.split('=', 1) for p in args.param)):
+            print(' | '.join(str(value) for value in row))
+        print(api.stats())
+    finally:
+        api.close()
@@ -0,0 +1,83 @@
+import argparse
+import database
+import metrics
+import sql_queries
+
+
+def check_rollups(cur):
+
+    """
+    Compares every rollup with a full recompute from 'songplays'.
+
+    Args:
+        cur (cursor): The cursor used to run the queries.
+
+    Returns:
+        (dict): The number of rows that differ, by rollup.
+    """
+
+    differences = {}
+    for rollup, query in sql_queries.rollups_check.items():
+        cur.execute(query)
+        differences[rollup] = cur.fetchone()[0]
+    return differences
+
+
+def maintain_rollups(rebuild=False, check=False):
+
+    """
+    Recomputes the days of the rollups of the database Sparkify brought by
+    the last load (the days of the staged events), in a single transaction.
+
+    Args:
+        rebuild (bool): Whether to empty the rollups and recompute every
+            day of 'songplays' instead.
+        check (bool): Whether to compare the rollups with a full
+            recompute afterwards.
+
+    Returns:
+        (bool): False if the check found differences, True otherwise.
+    """
+
+    conn = database.connect()
+    try:
+        with metrics.stage('rollups') as record, conn, conn.cursor() as cur:
+            metrics.log('Rebuilding the rollups' if rebuild else 'Updating the rollups')
+            for query in sql_queries.rollups_rebuild if rebuild else sql_queries.rollups_update:
+                cur.execute(query)
+                record.measure(cur)
+
+        if not check:
+            return True
+
+        metrics.log('Checking the rollups against a full recompute')
+        with conn, conn.cursor() as cur:
+            differences = check_rollups(cur)
+        for rollup, count in differences.items():
+            metrics.log(' --> {}: {}'.format(rollup, '{} rows differ'.format(count) if count else 'OK'))
+        return not any(differences.values())
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Recomputes the rollups of songplays for the days of the last load.'
+    )
+    parser.add_argument(
+        '--rebuild',
+        action='store_true',
+        help='recompute the rollups from scratch'
+    )
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='compare the rollups with a full recompute'
+    )
+    args = parser.parse_args()
+
+    consistent = maintain_rollups(args.rebuild, args.check)
+    metrics.print_summary()
+    if not consistent:
+        raise SystemExit(1)
@@ -0,0 +1,180 @@
+import config
+import database
+import metrics
+import time
+import wlm
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Stage:
+
+    """
+    A stage of the ETL. A stage depends on the stages producing any of
+    its inputs, and can't start until all of them are finished.
+    """
+
+    def __init__(self, name, inputs, outputs, run):
+
+        """
+        Args:
+            name (str): The name of the stage.
+            inputs (list): The tables read by the stage.
+            outputs (list): The tables written by the stage.
+            run (function): Runs the stage. Receives a connection not in
+                autocommit mode, taken from the pool.
+        """
+
+        self.name = name
+        self.inputs = set(inputs)
+        self.outputs = set(outputs)
+        self.run = run
+
+
+def get_dependencies(stages):
+
+    """
+    Gets the dependencies of every stage.
+
+    Args:
+        stages (list): The stages of the ETL.
+
+    Returns:
+        (dict): The names of the stages every stage depends on.
+    """
+
+    return {
+        stage.name: set(
+            other.name for other in stages
+            if other is not stage and other.outputs & stage.inputs
+        )
+        for stage in stages
+    }
+
+
+def get_critical_path(stages, durations):
+
+    """
+    Gets the critical path: the chain of dependent stages with the
+    longest total duration, which bounds the wall-clock time of the ETL.
+
+    Args:
+        stages (list): The stages of the ETL, in topological order.
+        durations (dict): The seconds taken by every stage.
+
+    Returns:
+        (tuple): The names of the stages of the path and its seconds.
+    """
+
+    dependencies = get_dependencies(stages)
+    paths = {}
+    for stage in stages:
+        previous = max(
+            (paths[name] for name in dependencies[stage.name]),
+            key=lambda path: path[1],
+            default=([], 0)
+        )
+        paths[stage.name] = (
+            previous[0] + [stage.name],
+            previous[1] + durations[stage.name]
+        )
+    return max(paths.values(), key=lambda path: path[1])
+
+
+def sort_stages(stages):
+
+    """
+    Sorts the stages in topological order, keeping the given order among
+    the stages that don't depend on each other.
+
+    Args:
+        stages (list): The stages of the ETL.
+
+    Returns:
+        (list): The stages in topological order.
+    """
+
+    dependencies = get_dependencies(stages)
+    ordered, done = [], set()
+    while len(ordered) < len(stages):
+        ready = [
+            s for s in stages
+            if s.name not in done and dependencies[s.name] <= done
+        ]
+        if not ready:
+            raise ValueError('The stages have a dependency cycle')
+        ordered.append(ready[0])
+        done.add(ready[0].name)
+    return ordered
+
+
+def run_stages(stages, workers=None, serial=False):
+
+    """
+    Runs the stages of the ETL. The stages whose dependencies are finished
+    run at the same time, every one on its own pooled connection. When
+    all of them are done, reports the critical path and the wall-clock
+    time saved compared to running them one after another.
+
+    Args:
+        stages (list): The stages of the ETL.
+        workers (int): The maximum number of stages running at once.
+            Defaults to the setting 'STAGE_WORKERS'.
+        serial (bool): Whether to run the stages one after another.
+
+    Returns:
+        (dict): The seconds taken by every stage.
+    """
+
+    stages = sort_stages(stages)
+    workers = 1 if serial else workers or config.ETL_STAGE_WORKERS
+    dependencies = get_dependencies(stages)
+    pool = database.create_pool(workers)
+    durations = {}
+
+    def run(stage):
+        conn = pool.getconn()
+        try:
+            start = time.time()
+            with wlm.session(conn, stage.name):
+                stage.run(conn)
+            return time.time() - start
+        finally:
+            pool.putconn(conn)
+
+    start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = list(stages)
+            running = {}
+            while pending or running:
+
+                # Starts the stages whose dependencies are finished.
+                for stage in [s for s in pending if dependencies[s.name] <= set(durations)]:
+                    if len(running) == workers:
+                        break
+                    metrics.log('Stage \'{}\' started'.format(stage.name))
+                    running[executor.submit(run, stage)] = stage
+                    pending.remove(stage)
+
+                # Waits for any of the running stages to finish.
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    durations[stage.name] = future.result()
+                    metrics.log('Stage \'{}\' finished in {:.1f}s'.format(
+                        stage.name,
+                        durations[stage.name]
+                    ))
+    finally:
+        pool.closeall()
+
+    # Reports the critical path and the time saved.
+    wall = time.time() - start
+    path, seconds = get_critical_path(stages, durations)
+    metrics.log('Critical path: {} ({:.1f}s)'.format(' > '.join(path), seconds))
+    metrics.log('Wall-clock time: {:.1f}s, {:.1f}s saved over a serial run'.format(
+        wall,
+        sum(durations.values()) - wall
+    ))
+    return durations
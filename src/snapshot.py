@@ -0,0 +1,280 @@
+import argparse
+import config
+import database
+import json
+import metrics
+import os
+import sql_queries
+import tempfile
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+
+# The dimensions exported, each as a whole when the data version
+# changes. Even 'time' isn't exported past a watermark, as a load can
+# backfill the times before it.
+tables = ['users', 'artists', 'songs', 'time']
+
+# The Arrow types of the PostgreSQL type OIDs found in the dimensions.
+# Any other type is exported as a string.
+arrow_types = {
+    16: 'bool_',
+    20: 'int64',
+    21: 'int16',
+    23: 'int32',
+    700: 'float32',
+    701: 'float64',
+    1042: 'string',
+    1043: 'string',
+    25: 'string',
+    1082: 'date32',
+    1114: 'timestamp'
+}
+
+# The file keeping the state of the snapshot.
+state_key = '_state.json'
+
+
+def require_pyarrow():
+
+    """
+    Checks that the optional dependency 'pyarrow' is installed.
+
+    Raises:
+        ImportError: If 'pyarrow' isn't installed.
+    """
+
+    if pyarrow is None:
+        raise ImportError('The snapshots need pyarrow: pip install pyarrow')
+
+
+def get_schema(description):
+
+    """
+    Gets the Arrow schema of the result of a query.
+
+    Args:
+        description (tuple): The description of the cursor.
+
+    Returns:
+        (Schema): The Arrow schema.
+    """
+
+    fields = []
+    for column in description:
+        name = arrow_types.get(column.type_code, 'string')
+        arrow_type = pyarrow.timestamp('us') if name == 'timestamp' else getattr(pyarrow, name)()
+        fields.append(pyarrow.field(column.name, arrow_type))
+    return pyarrow.schema(fields)
+
+
+def get_batch(rows, schema):
+
+    """
+    Converts rows into an Arrow record batch.
+
+    Args:
+        rows (list): The rows, as tuples.
+        schema (Schema): The Arrow schema of the rows.
+
+    Returns:
+        (RecordBatch): The Arrow record batch.
+    """
+
+    return pyarrow.record_batch([
+        pyarrow.array(
+            values if field.type != pyarrow.string() else [
+                None if value is None else str(value) for value in values
+            ],
+            type=field.type
+        )
+        for field, values in zip(schema, zip(*rows))
+    ], schema=schema)
+
+
+def read_state(directory):
+
+    """
+    Reads the state of a snapshot: the data version and parts of every
+    table.
+
+    Args:
+        directory (str): The directory of the snapshot.
+
+    Returns:
+        (dict): The state of every table, by name.
+    """
+
+    path = os.path.join(directory, state_key)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_state(directory, state):
+
+    """
+    Writes the state of a snapshot. The state is written to a temporary
+    file first and then renamed, so a reader never sees it half-written.
+
+    Args:
+        directory (str): The directory of the snapshot.
+        state (dict): The state of every table, by name.
+    """
+
+    handle, temporary = tempfile.mkstemp(dir=directory, prefix='.')
+    with os.fdopen(handle, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temporary, os.path.join(directory, state_key))
+
+
+def write_part(path, cur, batch_size):
+
+    """
+    Streams the result of a query into an Arrow IPC file, batch by batch.
+    The file is uncompressed, so it can be memory-mapped.
+
+    Args:
+        path (str): The path of the file.
+        cur (cursor): The server-side cursor that ran the query.
+        batch_size (int): The number of rows fetched at once.
+
+    Returns:
+        (int): The number of rows written.
+    """
+
+    rows = cur.fetchmany(batch_size)
+    schema = get_schema(cur.description)
+    count = 0
+
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+    os.close(handle)
+    with pyarrow.OSFile(temporary, 'wb') as sink:
+        with pyarrow.ipc.new_file(sink, schema) as writer:
+            while rows:
+                writer.write_batch(get_batch(rows, schema))
+                count += len(rows)
+                rows = cur.fetchmany(batch_size)
+    os.replace(temporary, path)
+    return count
+
+
+def export_snapshot(directory=None, batch_size=None, full=False):
+
+    """
+    Exports the dimensions of the database Sparkify into Arrow files, one
+    directory per table, streaming them through server-side cursors. The
+    export is incremental: a table is skipped if the data version hasn't
+    changed since its last export.
+
+    Args:
+        directory (str): The directory of the snapshot. Defaults to the
+            setting 'DIRECTORY'.
+        batch_size (int): The number of rows fetched at once. Defaults
+            to the setting 'BATCH_SIZE'.
+        full (bool): Whether to export every table, whatever its data
+            version.
+    """
+
+    require_pyarrow()
+    directory = directory or config.SNAPSHOT_DIRECTORY
+    batch_size = batch_size or config.SNAPSHOT_BATCH_SIZE
+    os.makedirs(directory, exist_ok=True)
+    state = read_state(directory)
+
+    conn = database.connect()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql_queries.data_version_select)
+                version = str(cur.fetchone()[0])
+
+            for table in tables:
+                previous = state.get(table)
+                if previous and previous['version'] == version and not full:
+                    metrics.log('Skipping \'{}\', up to date'.format(table))
+                    continue
+
+                # Numbers the part after the existing ones, which it replaces.
+                parts = previous['parts'] if previous else []
+                number = max([int(p[5:10]) for p in parts], default=0) + 1
+                part = 'part-{:05d}.arrow'.format(number)
+                os.makedirs(os.path.join(directory, table), exist_ok=True)
+
+                with metrics.stage('snapshot:{}'.format(table)) as record:
+                    with conn.cursor(name='snapshot_{}'.format(table)) as cur:
+                        cur.itersize = batch_size
+                        cur.execute('SELECT * FROM {}'.format(table))
+                        count = write_part(os.path.join(directory, table, part), cur, batch_size)
+                    record['rows'] = count
+                    record['files'] = 1
+
+                state[table] = {'version': version, 'parts': [part]}
+                write_state(directory, state)
+                metrics.log(' --> {}: {} rows exported'.format(table, count))
+
+                # Removes the parts replaced.
+                for old in parts:
+                    os.remove(os.path.join(directory, table, old))
+    finally:
+        conn.close()
+
+
+def load_table(table, directory=None):
+
+    """
+    Loads a dimension from the snapshot, without a cluster connection.
+    The parts are memory-mapped, so the data isn't copied in memory.
+
+    Args:
+        table (str): The name of the dimension.
+        directory (str): The directory of the snapshot. Defaults to the
+            setting 'DIRECTORY'.
+
+    Returns:
+        (Table): The Arrow table of the dimension.
+    """
+
+    require_pyarrow()
+    directory = directory or config.SNAPSHOT_DIRECTORY
+    parts = read_state(directory)[table]['parts']
+    return pyarrow.concat_tables([
+        pyarrow.ipc.open_file(pyarrow.memory_map(os.path.join(directory, table, part))).read_all()
+        for part in parts
+    ])
+
+
+def load_frame(table, directory=None):
+
+    """
+    Loads a dimension from the snapshot as a pandas data frame.
+
+    Args:
+        table (str): The name of the dimension.
+        directory (str): The directory of the snapshot. Defaults to the
+            setting 'DIRECTORY'.
+
+    Returns:
+        (DataFrame): The data frame of the dimension.
+    """
+
+    return load_table(table, directory).to_pandas()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Exports the dimensions of the database Sparkify into local Arrow files.'
+    )
+    parser.add_argument('--directory', help='the directory of the snapshot')
+    parser.add_argument('--batch-size', type=int, help='the number of rows fetched at once')
+    parser.add_argument('--full', action='store_true', help='export every table, even if up to date')
+    args = parser.parse_args()
+
+    export_snapshot(args.directory, args.batch_size, args.full)
+    metrics.print_summary()
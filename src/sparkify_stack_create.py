@@ -1,37 +1,19 @@
-import boto3
 import config
+import metrics
 import os
-import time
+import stack_events
+import stat
+import tempfile
 
 
 # The CloudFormation client.
-cloudformation = boto3.client(
-    'cloudformation',
-    region_name=config.AWS_REGION,
-    aws_access_key_id=config.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY
-)
+cloudformation = stack_events.get_client()
 
-# The delay between stack status checks.
-delay = 30
-
-# A reference to the builtin function 'print()'.
-builtin_print = print
-
-
-def print(text):
-
-    """
-    Prints a timestamp next to the the given text.
-
-    Args:
-        text (str): The text to print.
-    """
-
-    return builtin_print('{} | {}'.format(
-        time.strftime('%H:%M:%S', time.gmtime()),
-        text
-    ))
+# The settings written from the outputs of the stack, by output key.
+output_settings = {
+    'SparkifyRoleArn': ('IAM', 'ROLE_ARN'),
+    'SparkifyClusterEndpoint': ('REDSHIFT', 'ENDPOINT_ADDRESS')
+}
 
 
 def get_output_value(description, key):
@@ -51,21 +33,64 @@ def get_output_value(description, key):
     return None if len(outputs) != 1 else outputs[0]['OutputValue']
 
 
-def get_stack_info():
+def get_stack_info(stack_id=None):
 
     """
     Gets the description of the Sparkify stack.
 
+    Args:
+        stack_id (str): The identifier of the stack. Defaults to its
+            name.
+
     Returns:
         (dict): The description of the stack.
     """
 
     response = cloudformation.describe_stacks(
-        StackName=config.CLOUDFORMATION_STACK_NAME
+        StackName=stack_id or config.CLOUDFORMATION_STACK_NAME
     )
     return response['Stacks'][0]
 
 
+def write_settings(path, settings):
+
+    """
+    Writes settings into the config file, line by line, so its comments
+    and layout are kept. The file is written to a temporary file first
+    and then renamed, with the permissions of the original file.
+
+    Args:
+        path (str): The path of the config file.
+        settings (dict): The values to write, by (section, key).
+
+    Raises:
+        ValueError: If a value is missing, like an output of the stack.
+    """
+
+    missing = [key for (_, key), value in settings.items() if value is None]
+    if missing:
+        raise ValueError('Missing values for the settings {}'.format(', '.join(missing)))
+
+    with open(path, 'r') as f:
+        lines = f.readlines()
+
+    section = None
+    for number, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith('[') and stripped.endswith(']'):
+            section = stripped[1:-1]
+        elif '=' in stripped and not stripped.startswith(('#', ';')):
+            key = stripped.split('=', 1)[0].strip()
+            if (section, key) in settings:
+                lines[number] = '{} = {}\n'.format(key, settings[(section, key)])
+
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+    with os.fdopen(handle, 'w') as f:
+        f.writelines(lines)
+    os.chmod(temporary, stat.S_IMODE(os.stat(path).st_mode))
+    os.replace(temporary, path)
+
+
 def create_stack():
 
     """
@@ -78,7 +103,7 @@ def create_stack():
     with open(os.path.join(os.getcwd(), 'sparkify_stack.json'), 'r') as f:
         content = f.read()
 
-    cloudformation.create_stack(
+    response = cloudformation.create_stack(
         StackName=config.CLOUDFORMATION_STACK_NAME,
         TemplateBody=content,
         Capabilities=['CAPABILITY_NAMED_IAM'],
@@ -121,43 +146,42 @@ def create_stack():
             }
         ]
     )
+    return response['StackId']
 
 
 def create_sparkify_stack():
 
     """
-    Launches the Sparkify stack creation and waits for the defined
-    resources to be also created and ready to use.
+    Launches the Sparkify stack creation and tails its events until the
+    defined resources are created and ready to use, or the creation
+    fails. The role ARN and the cluster endpoint are then written into
+    the config file.
+
+    Raises:
+        RuntimeError: If the creation failed.
+        ValueError: If the stack is missing an output.
     """
 
-    # Creates the stack.
-    print('Creating the stack. This may take awhile, please be patient.')
-    create_stack()
-
-    # Until the resources are provisioned.
-    while True:
-
-        # Gets the info corresponding the stack.
-        description = get_stack_info()
-        print('Current status: {}'.format(description['StackStatus']))
+    with metrics.stage('create_stack'):
 
-        # If the resources are provisioned.
-        if description['StackStatus'] == 'CREATE_COMPLETE':
+        # Creates the stack.
+        metrics.log('Creating the stack. This may take awhile, please be patient.')
+        stack_id = create_stack()
 
-            # Prints the role ARN and the cluster endpoint.
-            print('Role ARN: {}'.format(
-                get_output_value(description, 'SparkifyRoleArn')
-            ))
-            print('Cluster endpoint: {}'.format(
-                get_output_value(description, 'SparkifyClusterEndpoint')
-            ))
-            print('Resources created :-)')
-            break
+        # Until the resources are provisioned.
+        stack_events.wait_for_stack(cloudformation, stack_id, 'create')
 
-        # Waits a few seconds until try again.
-        print('Asking again in {} seconds'.format(delay))
-        time.sleep(delay)
+        # Prints the role ARN and the cluster endpoint, and saves them.
+        description = get_stack_info(stack_id)
+        settings = {}
+        for output, setting in output_settings.items():
+            value = get_output_value(description, output)
+            metrics.log('{}: {}'.format(output, value))
+            settings[setting] = value
+        write_settings(os.path.join(os.getcwd(), 'sparkify.cfg'), settings)
+        metrics.log('Resources created, settings saved into \'sparkify.cfg\' :-)')
 
 
 if __name__ == '__main__':
     create_sparkify_stack()
+    metrics.print_summary()
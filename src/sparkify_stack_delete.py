@@ -1,37 +1,10 @@
-import boto3
-import botocore
 import config
-import time
+import metrics
+import stack_events
 
 
 # The CloudFormation client.
-cloudformation = boto3.client(
-    'cloudformation',
-    region_name=config.AWS_REGION,
-    aws_access_key_id=config.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY
-)
-
-# The delay between stack status checks.
-delay = 30
-
-# A reference to the builtin function 'print()'.
-builtin_print = print
-
-
-def print(text):
-
-    """
-    Prints a timestamp next to the the given text.
-
-    Args:
-        text (str): The text to print.
-    """
-
-    return builtin_print('{} | {}'.format(
-        time.strftime('%H:%M:%S', time.gmtime()),
-        text
-    ))
+cloudformation = stack_events.get_client()
 
 
 def get_stack_info():
@@ -63,31 +36,31 @@ def delete_stack():
 def delete_sparkify_stack():
 
     """
-    Launches the Sparkify stack deletion and waits for
-    the defined resources to be also removed.
+    Launches the Sparkify stack deletion and tails its events until
+    the defined resources are removed, or the deletion fails.
+
+    Raises:
+        RuntimeError: If the deletion failed.
     """
 
-    # Deletes the stack.
-    print('Deleting the stack. This may take awhile, please be patient.')
-    delete_stack()
+    with metrics.stage('delete_stack'):
+
+        # Ignores the events that happened before the deletion. The stack
+        # is then followed by its identifier, since its name no longer
+        # resolves once deleted.
+        stack_id = get_stack_info()['StackId']
+        seen = set()
+        stack_events.get_new_events(cloudformation, stack_id, seen)
 
-    # Until the resources are removed.
-    while True:
+        # Deletes the stack.
+        metrics.log('Deleting the stack. This may take awhile, please be patient.')
+        delete_stack()
 
-        try:
-            # Gets the info corresponding the stack.
-            description = get_stack_info()
-        except botocore.exceptions.ClientError:
-            # Boto raises a ClientError if the stack does not exists. This
-            # means that the resources have been properly removed.
-            print('Resources deleted :-)')
-            break
-        else:
-            # Waits a few seconds until try again.
-            print('Current status: {}'.format(description['StackStatus']))
-            print('Asking again in {} seconds'.format(delay))
-            time.sleep(delay)
+        # Until the resources are removed.
+        stack_events.wait_for_stack(cloudformation, stack_id, 'delete', seen)
+        metrics.log('Resources deleted :-)')
 
 
 if __name__ == '__main__':
     delete_sparkify_stack()
+    metrics.print_summary()
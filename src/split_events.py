@@ -0,0 +1,238 @@
+import argparse
+import config
+import gzip
+import io
+import json
+import log_partitions
+import metrics
+import os
+import storage
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+# The fields kept of the plays: those read by the builds of
+# 'staging_plays', 'users', 'time' and 'songplays'.
+play_fields = [
+    'artist',
+    'firstName',
+    'gender',
+    'lastName',
+    'level',
+    'location',
+    'page',
+    'sessionId',
+    'song',
+    'ts',
+    'userAgent',
+    'userId'
+]
+
+# The fields kept of the other events, which only bring user attributes.
+user_fields = [
+    'userId',
+    'firstName',
+    'lastName',
+    'gender',
+    'level',
+    'ts'
+]
+
+
+def output_key(kind, key):
+
+    """
+    Gets the key of the gzipped output of a log file. The outputs keep
+    the layout of the log data, under a prefix per kind, so they can be
+    copied a day at a time.
+
+    Args:
+        kind (str): The kind of events, 'plays' or 'users'.
+        key (str): The key of the log file.
+
+    Returns:
+        (str): The key of the output.
+    """
+
+    return '{}/{}.gz'.format(kind, key)
+
+
+def iter_lines(data):
+
+    """
+    Splits the content of a log file into its non-blank lines.
+
+    Args:
+        data (bytes): The content of the log file.
+
+    Yields:
+        (bytes): The lines of the file.
+    """
+
+    for line in data.splitlines():
+        if line.strip():
+            yield line
+
+
+def parse_events(lines):
+
+    """
+    Parses the events of a log file, one JSON object per line.
+
+    Args:
+        lines (iterable): The lines of the file.
+
+    Yields:
+        (dict): The events.
+    """
+
+    for line in lines:
+        yield json.loads(line)
+
+
+def route_events(events):
+
+    """
+    Routes the events by kind, keeping only the fields read downstream:
+    the plays go to 'plays', and the other events of identified users go
+    to 'users'. The events of anonymous users are dropped.
+
+    Args:
+        events (iterable): The events.
+
+    Yields:
+        (tuple): The kind of the event and its compact version.
+    """
+
+    for event in events:
+        if event.get('page') == 'NextSong':
+            yield 'plays', {field: event.get(field) for field in play_fields}
+        elif event.get('userId') not in (None, ''):
+            yield 'users', {field: event.get(field) for field in user_fields}
+
+
+def split_file(source_url, target_url, key):
+
+    """
+    Splits a log file into a gzipped file of plays and a gzipped file of
+    user events, holding a JSON object per line. The file is skipped if
+    it was already split: the plays are written last, so their output
+    marks the file as done.
+
+    Args:
+        source_url (str): The URL of the log data.
+        target_url (str): The URL where the outputs are written.
+        key (str): The key of the log file.
+
+    Returns:
+        (dict): The number of events and bytes written, by kind, or None
+            if the file was already split.
+    """
+
+    source = storage.open_store(source_url)
+    target = storage.open_store(target_url)
+    if target.exists(output_key('plays', key)):
+        return None
+
+    buffers = {kind: io.BytesIO() for kind in ['plays', 'users']}
+    files = {
+        kind: gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0)
+        for kind, buffer in buffers.items()
+    }
+    counts = {kind: 0 for kind in buffers}
+    for kind, event in route_events(parse_events(iter_lines(source.read(key)))):
+        files[kind].write(json.dumps(event).encode('utf-8'))
+        files[kind].write(b'\n')
+        counts[kind] += 1
+
+    results = {}
+    for kind in ['users', 'plays']:
+        files[kind].close()
+        target.write(output_key(kind, key), buffers[kind].getvalue())
+        results[kind] = (counts[kind], buffers[kind].tell())
+    return results
+
+
+def split_events(source_url=None, target_url=None, first=None, last=None, workers=None):
+
+    """
+    Splits the log data into plays and user events, a log file at a time.
+    The files already split by a previous run are skipped.
+
+    Args:
+        source_url (str): The URL of the log data. Defaults to the
+            setting 'LOG_DATA'.
+        target_url (str): The URL where the outputs are written. Defaults
+            to the setting 'LOG_DATA_SPLIT'.
+        first (date): The first day of the log data split, if any.
+        last (date): The last day of the log data split, included.
+        workers (int): The size of the process pool. Defaults to the
+            setting 'COMPACTION_WORKERS' (the CPU count if unset).
+    """
+
+    source_url = source_url or config.S3_LOG_DATA
+    target_url = target_url or config.S3_LOG_DATA_SPLIT
+    workers = workers or config.ETL_COMPACTION_WORKERS or os.cpu_count()
+
+    source = storage.open_store(source_url)
+    if first:
+        objects = [o for _, _, day in log_partitions.list_partitions(source, first, last) for o in day]
+    else:
+        objects = [o for o in source.list() if o[0].endswith('.json')]
+
+    metrics.log('Splitting {} log files into \'{}\''.format(len(objects), target_url))
+    totals = {'plays': [0, 0], 'users': [0, 0]}
+    skipped = 0
+    with metrics.stage('split_events') as record, ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            split_file,
+            [source_url] * len(objects),
+            [target_url] * len(objects),
+            [key for key, _ in objects]
+        )
+        for result in results:
+            if result is None:
+                skipped += 1
+                continue
+            for kind, (count, size) in result.items():
+                totals[kind][0] += count
+                totals[kind][1] += size
+        record['rows'] = totals['plays'][0] + totals['users'][0]
+        record['bytes'] = totals['plays'][1] + totals['users'][1]
+        record['files'] = 2 * (len(objects) - skipped)
+
+    metrics.log(' --> {} plays and {} user events, {} bytes gzipped out of {} ({} files skipped)'.format(
+        totals['plays'][0],
+        totals['users'][0],
+        record['bytes'],
+        sum(size for _, size in objects),
+        skipped
+    ))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Splits the log data into gzipped plays and user events.'
+    )
+    parser.add_argument('--source', help='the URL of the log data')
+    parser.add_argument('--target', help='the URL where the outputs are written')
+    parser.add_argument(
+        '--from',
+        dest='first',
+        type=log_partitions.parse_date,
+        help='the first day of the log data split, like 2018-11-01'
+    )
+    parser.add_argument(
+        '--to',
+        dest='last',
+        type=log_partitions.parse_date,
+        help='the last day of the log data split (defaults to --from)'
+    )
+    parser.add_argument('--workers', type=int, help='the size of the process pool')
+    args = parser.parse_args()
+    if args.last and not args.first:
+        parser.error('--to needs --from')
+
+    split_events(args.source, args.target, args.first, args.last or args.first, args.workers)
+    metrics.print_summary()
@@ -1,4 +1,7 @@
+import compression
 import config
+import metrics
+import re
 
 # ---------------------- #
 # Table 'staging_events' #
@@ -43,6 +46,8 @@ staging_events_copy = """
              REGION '{}'
                JSON '{}'
     TRUNCATECOLUMNS
+         COMPUPDATE OFF
+         STATUPDATE OFF
        BLANKSASNULL
         EMPTYASNULL;
 """.format(
@@ -52,6 +57,162 @@ staging_events_copy = """
     config.S3_LOG_JSON_PATH
 )
 
+
+def staging_events_manifest_copy(manifest):
+
+    """
+    Generates the query to copy the event files listed in a manifest.
+
+    Args:
+        manifest (str): The URL of the manifest.
+
+    Returns:
+        (str): The query to copy the events of the manifest.
+    """
+
+    return """
+                   COPY staging_events
+                   FROM '{}'
+            CREDENTIALS 'aws_iam_role={}'
+          TIMEFORMAT AS 'epochmillisecs'
+                 REGION '{}'
+                   JSON '{}'
+               MANIFEST
+        TRUNCATECOLUMNS
+             COMPUPDATE OFF
+             STATUPDATE OFF
+           BLANKSASNULL
+            EMPTYASNULL;
+    """.format(
+        manifest,
+        config.IAM_ROLE_ARN,
+        config.AWS_REGION,
+        config.S3_LOG_JSON_PATH
+    )
+
+
+def staging_events_prefix_copy(prefix):
+
+    """
+    Generates the query to copy the event files under a prefix, like the
+    files of a day.
+
+    Args:
+        prefix (str): The URL prefix of the files.
+
+    Returns:
+        (str): The query to copy the events of the prefix.
+    """
+
+    return """
+                   COPY staging_events
+                   FROM '{}'
+            CREDENTIALS 'aws_iam_role={}'
+          TIMEFORMAT AS 'epochmillisecs'
+                 REGION '{}'
+                   JSON '{}'
+        TRUNCATECOLUMNS
+             COMPUPDATE OFF
+             STATUPDATE OFF
+           BLANKSASNULL
+            EMPTYASNULL;
+    """.format(
+        prefix,
+        config.IAM_ROLE_ARN,
+        config.AWS_REGION,
+        config.S3_LOG_JSON_PATH
+    )
+
+
+def staging_events_split_copy(prefix):
+
+    """
+    Generates the query to copy the gzipped plays written by
+    'split_events.py' under a prefix. Their objects hold only some of
+    the fields, matched to the columns by name.
+
+    Args:
+        prefix (str): The URL prefix of the files.
+
+    Returns:
+        (str): The query to copy the plays of the prefix.
+    """
+
+    return """
+                   COPY staging_events
+                   FROM '{}'
+            CREDENTIALS 'aws_iam_role={}'
+          TIMEFORMAT AS 'epochmillisecs'
+                 REGION '{}'
+                   JSON 'auto ignorecase'
+                   GZIP
+        TRUNCATECOLUMNS
+             COMPUPDATE OFF
+             STATUPDATE OFF
+           BLANKSASNULL
+            EMPTYASNULL;
+    """.format(
+        prefix,
+        config.IAM_ROLE_ARN,
+        config.AWS_REGION
+    )
+
+# --------------------------- #
+# Table 'staging_user_events' #
+# --------------------------- #
+
+# With the setting 'SPLIT_EVENTS' on, 'staging_events' only holds the
+# plays, and the user attributes of the other events land here.
+
+staging_user_events_table_drop = "DROP TABLE IF EXISTS staging_user_events;"
+
+staging_user_events_table_create = """
+    CREATE TABLE IF NOT EXISTS staging_user_events (
+           userId INTEGER
+                  DISTKEY
+                  SORTKEY,
+        firstName VARCHAR,
+         lastName VARCHAR,
+           gender VARCHAR(1),
+            level VARCHAR,
+               ts TIMESTAMP
+    )
+    DISTSTYLE KEY;
+"""
+
+
+def staging_user_events_copy(prefix):
+
+    """
+    Generates the query to copy the gzipped user events written by
+    'split_events.py' under a prefix.
+
+    Args:
+        prefix (str): The URL prefix of the files.
+
+    Returns:
+        (str): The query to copy the user events of the prefix.
+    """
+
+    return """
+                   COPY staging_user_events
+                   FROM '{}'
+            CREDENTIALS 'aws_iam_role={}'
+          TIMEFORMAT AS 'epochmillisecs'
+                 REGION '{}'
+                   JSON 'auto ignorecase'
+                   GZIP
+        TRUNCATECOLUMNS
+             COMPUPDATE OFF
+             STATUPDATE OFF
+           BLANKSASNULL
+            EMPTYASNULL;
+    """.format(
+        prefix,
+        config.IAM_ROLE_ARN,
+        config.AWS_REGION
+    )
+
 # --------------------- #
 # Table 'staging_songs' #
 # --------------------- #
@@ -78,15 +239,62 @@ staging_songs_table_create = """
 """
 
 
-def staging_songs_copies():
+def staging_songs_copies(manifests=None):
 
     """
     Generate the queries to copy song data from S3 to the staging table.
+    The batches are split by the first letter of the S3 prefix, unless a
+    list of manifests is given. When the copy plan is 'compacted', a
+    single query loads the gzipped parts written by 'compact_songs.py'.
+
+    Args:
+        manifests (list): The URLs of the manifests, one per batch.
 
     Yields:
         (str): The queries to copy song data in batches.
     """
 
+    if config.ETL_COPY_PLAN == 'compacted':
+        yield """
+                       COPY staging_songs
+                       FROM '{}/part-'
+                CREDENTIALS 'aws_iam_role={}'
+                     REGION '{}'
+                       JSON 'auto'
+                       GZIP
+            TRUNCATECOLUMNS
+                 COMPUPDATE OFF
+                 STATUPDATE OFF
+               BLANKSASNULL
+                EMPTYASNULL;
+        """.format(
+            config.S3_SONG_DATA_COMPACTED,
+            config.IAM_ROLE_ARN,
+            config.AWS_REGION
+        )
+        return
+
+    if manifests is not None:
+        for manifest in manifests:
+            yield """
+                           COPY staging_songs
+                           FROM '{}'
+                    CREDENTIALS 'aws_iam_role={}'
+                         REGION '{}'
+                           JSON 'auto'
+                       MANIFEST
+                TRUNCATECOLUMNS
+                     COMPUPDATE OFF
+                     STATUPDATE OFF
+                   BLANKSASNULL
+                    EMPTYASNULL;
+            """.format(
+                manifest,
+                config.IAM_ROLE_ARN,
+                config.AWS_REGION
+            )
+        return
+
     for char in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
 
         yield """
@@ -96,6 +304,8 @@ def staging_songs_copies():
                      REGION '{}'
                        JSON 'auto'
             TRUNCATECOLUMNS
+                 COMPUPDATE OFF
+                 STATUPDATE OFF
                BLANKSASNULL
                 EMPTYASNULL;
         """.format(
@@ -105,6 +315,101 @@ def staging_songs_copies():
             config.AWS_REGION
         )
 
+
+staging_songs_count = "SELECT COUNT(*) FROM staging_songs;"
+
+# ------------------------------------------------------------------- #
+# Join keys                                                           #
+#                                                                     #
+# Events and songs are matched by the pair artist/title. Instead of   #
+# comparing two wide VARCHAR columns on tables distributed on         #
+# different keys, both sides get a hash of the normalized pair, and   #
+# the narrow tables below are distributed and sorted on that hash, so #
+# the join that builds 'songplays' is co-located.                     #
+# ------------------------------------------------------------------- #
+
+
+def join_key(artist, title):
+
+    """
+    Generates the expression of the join key of an artist/title pair.
+
+    Args:
+        artist (str): The expression of the artist name.
+        title (str): The expression of the song title.
+
+    Returns:
+        (str): The expression of the join key.
+    """
+
+    return "MD5(LOWER(TRIM({})) || '|' || LOWER(TRIM({})))".format(artist, title)
+
+
+staging_plays_table_drop = "DROP TABLE IF EXISTS staging_plays;"
+
+staging_plays_table_create = """
+    CREATE TABLE IF NOT EXISTS staging_plays (
+         join_key CHAR(32)
+                  DISTKEY
+                  SORTKEY,
+               ts TIMESTAMP,
+           userId INTEGER,
+            level VARCHAR,
+        sessionId INTEGER,
+         location VARCHAR,
+        userAgent VARCHAR
+    )
+    DISTSTYLE KEY;
+"""
+
+staging_plays_insert = """
+    INSERT INTO staging_plays (
+                join_key,
+                ts,
+                userId,
+                level,
+                sessionId,
+                location,
+                userAgent)
+         SELECT {} AS join_key,
+                ts,
+                userId,
+                level,
+                sessionId,
+                location,
+                userAgent
+           FROM staging_events
+          WHERE page = 'NextSong'
+            AND artist IS NOT NULL
+            AND song IS NOT NULL;
+""".format(join_key('artist', 'song'))
+
+staging_song_keys_table_drop = "DROP TABLE IF EXISTS staging_song_keys;"
+
+staging_song_keys_table_create = """
+    CREATE TABLE IF NOT EXISTS staging_song_keys (
+         join_key CHAR(32)
+                  DISTKEY
+                  SORTKEY,
+          song_id VARCHAR,
+        artist_id VARCHAR
+    )
+    DISTSTYLE KEY;
+"""
+
+staging_song_keys_insert = """
+    INSERT INTO staging_song_keys (
+                join_key,
+                song_id,
+                artist_id)
+         SELECT DISTINCT {} AS join_key,
+                song_id,
+                artist_id
+           FROM staging_songs
+          WHERE artist_name IS NOT NULL
+            AND title IS NOT NULL;
+""".format(join_key('artist_name', 'title'))
+
 # ----------------- #
 # Table 'songplays' #
 # ----------------- #
@@ -120,8 +425,10 @@ songplays_table_create = """
                     NOT NULL
                     REFERENCES time(start_time),
             user_id INTEGER
+                    NOT NULL,
+           user_key BIGINT
                     NOT NULL
-                    REFERENCES users(user_id),
+                    REFERENCES users(user_key),
               level VARCHAR
                     NOT NULL,
             song_id VARCHAR
@@ -146,64 +453,155 @@ songplays_table_insert = """
     INSERT INTO songplays (
                 start_time,
                 user_id,
+                user_key,
                 level,
                 song_id,
                 artist_id,
                 session_id,
                 location,
                 user_agent)
-         SELECT staging_events.ts AS start_time,
-                staging_events.userId AS user_id,
-                staging_events.level,
-                staging_songs.song_id,
-                staging_songs.artist_id,
-                staging_events.sessionId AS session_id,
-                staging_events.location,
-                staging_events.userAgent AS user_agent
-           FROM staging_events
-           JOIN staging_songs
-             ON staging_events.artist = staging_songs.artist_name
-            AND staging_events.song = staging_songs.title
-          WHERE staging_events.page = 'NextSong';
+         SELECT staging_plays.ts AS start_time,
+                staging_plays.userId AS user_id,
+                users.user_key,
+                staging_plays.level,
+                staging_song_keys.song_id,
+                staging_song_keys.artist_id,
+                staging_plays.sessionId AS session_id,
+                staging_plays.location,
+                staging_plays.userAgent AS user_agent
+           FROM staging_plays
+           JOIN staging_song_keys
+             ON staging_plays.join_key = staging_song_keys.join_key
+           JOIN users
+             ON staging_plays.userId = users.user_id
+            AND staging_plays.ts >= users.effective_from
+            AND staging_plays.ts < users.effective_to;
 """
 
 # ------------- #
 # Table 'users' #
 # ------------- #
 
+# The users are a type 2 slowly changing dimension: a user gets a new
+# version, with its own 'user_key', whenever their level changes. A
+# version is effective from its first event until the next version
+# starts, and the current version until the end of time. The first
+# version is effective from the beginning of time instead, so the plays
+# older than the events loaded so far, like those of a backfill, still
+# find a version.
+
+beginning_of_time = "TIMESTAMP '1900-01-01 00:00:00'"
+
+end_of_time = "TIMESTAMP '9999-12-31 00:00:00'"
+
+# The events bringing user attributes. With the setting 'SPLIT_EVENTS'
+# on, they're read from the plays and from the other events.
+_user_events = "staging_events"
+if config.ETL_SPLIT_EVENTS:
+    _user_events = """(
+                     SELECT userId, firstName, lastName, gender, level, ts
+                       FROM staging_events
+                  UNION ALL
+                     SELECT userId, firstName, lastName, gender, level, ts
+                       FROM staging_user_events
+                    )"""
+
 users_table_drop = "DROP TABLE IF EXISTS users;"
 
 users_table_create = """
     CREATE TABLE IF NOT EXISTS users (
-           user_id INTEGER
-                   PRIMARY KEY,
-        first_name VARCHAR
-                   NOT NULL,
-         last_name VARCHAR
-                   NOT NULL,
-            gender VARCHAR(1)
-                   NOT NULL,
-             level VARCHAR
-                   NOT NULL
+              user_key BIGINT
+                       IDENTITY(0, 1)
+                       PRIMARY KEY,
+               user_id INTEGER
+                       NOT NULL
+                       SORTKEY,
+            first_name VARCHAR
+                       NOT NULL,
+             last_name VARCHAR
+                       NOT NULL,
+                gender VARCHAR(1)
+                       NOT NULL,
+                 level VARCHAR
+                       NOT NULL,
+        effective_from TIMESTAMP
+                       NOT NULL,
+          effective_to TIMESTAMP
+                       NOT NULL
     )
     DISTSTYLE ALL;
 """
 
-users_table_insert = """
-    INSERT INTO users (
+
+def user_versions_select(events):
+
+    """
+    Generates the query splitting the user events into versions, starting
+    from the current versions of the table 'users': a new user starts a
+    version from the beginning of time, and another one with every event
+    whose level differs from the previous one. Each version ends where the
+    next one starts. The current versions keep their 'user_key', while
+    the new versions have none. The events older than the current version
+    of their user are ignored.
+
+    Args:
+        events (str): The table or subquery of the user events.
+
+    Returns:
+        (str): The query selecting the versions.
+    """
+
+    versions = """
+                         SELECT users.user_key,
+                                users.user_id,
+                                users.first_name,
+                                users.last_name,
+                                users.gender,
+                                users.level,
+                                users.effective_from
+                           FROM users
+                          WHERE users.effective_to = {0}
+                            AND users.user_id IN (SELECT userId FROM {1})
+                      UNION ALL
+                         SELECT NULL::BIGINT AS user_key,
+                                events.userId AS user_id,
+                                events.firstName AS first_name,
+                                events.lastName AS last_name,
+                                events.gender,
+                                events.level,
+                                events.ts AS effective_from
+                           FROM {1} AS events
+                      LEFT JOIN users
+                             ON events.userId = users.user_id
+                            AND users.effective_to = {0}
+                          WHERE events.userId IS NOT NULL
+                            AND (users.user_id IS NULL
+                             OR events.ts > users.effective_from)""".format(end_of_time, events)
+
+    return """
+         SELECT user_key,
                 user_id,
                 first_name,
                 last_name,
                 gender,
-                level)
-         SELECT DISTINCT userId AS user_id,
-                firstName AS first_name,
-                lastName AS last_name,
-                gender,
-                level
-           FROM staging_events
-          WHERE user_id IS NOT NULL;
-"""
+                level,
+                CASE WHEN user_key IS NULL AND previous_level IS NULL
+                     THEN {}
+                     ELSE effective_from
+                 END AS effective_from,
+                COALESCE(
+                    LEAD(effective_from) OVER (
+                        PARTITION BY user_id
+                            ORDER BY effective_from),
+                    {}) AS effective_to
+           FROM (SELECT events.*,
+                        LAG(level) OVER (
+                            PARTITION BY user_id
+                                ORDER BY effective_from) AS previous_level
+                   FROM ({}
+                        ) AS events) AS changes
+          WHERE previous_level IS NULL
+             OR previous_level <> level""".format(beginning_of_time, end_of_time, versions)
 
 # ------------- #
 # Table 'songs' #
@@ -324,3 +722,1012 @@ time_table_insert = """
            FROM staging_events
           WHERE ts IS NOT NULL;;
 """
+
+# ------------------ #
+# Table 'load_state' #
+# ------------------ #
+
+load_state_table_drop = "DROP TABLE IF EXISTS load_state;"
+
+load_state_table_create = """
+    CREATE TABLE IF NOT EXISTS load_state (
+            url VARCHAR(1024)
+                PRIMARY KEY,
+         source VARCHAR(16)
+                NOT NULL,
+         min_ts TIMESTAMP,
+         max_ts TIMESTAMP,
+      loaded_at TIMESTAMP
+                NOT NULL
+    )
+    DISTSTYLE ALL;
+"""
+
+load_state_select = "SELECT url FROM load_state WHERE source = %s;"
+
+load_state_watermark = "SELECT MAX(max_ts) FROM load_state WHERE source = 'events';"
+
+load_state_insert = """
+    INSERT INTO load_state (
+                url,
+                source,
+                min_ts,
+                max_ts,
+                loaded_at)
+         VALUES %s;
+"""
+
+staging_events_truncate = "TRUNCATE staging_events;"
+
+staging_user_events_truncate = "TRUNCATE staging_user_events;"
+
+staging_songs_truncate = "TRUNCATE staging_songs;"
+
+staging_plays_truncate = "TRUNCATE staging_plays;"
+
+staging_song_keys_truncate = "TRUNCATE staging_song_keys;"
+
+# A ranged load merges into the tables already loaded, so it starts from
+# empty staging tables.
+staging_tables_truncate = [
+    staging_events_truncate,
+    staging_user_events_truncate,
+    staging_songs_truncate,
+    staging_plays_truncate,
+    staging_song_keys_truncate
+]
+
+# ------------------------------------------------------------------- #
+# Incremental merges                                                  #
+#                                                                     #
+# Every merge deletes the rows of the target whose keys are present   #
+# in the staging tables, which hold only the new data, and inserts    #
+# them again. All of them run in a single transaction.                #
+# ------------------------------------------------------------------- #
+
+# The versions of the users are merged rather than replaced, by every
+# load: the current versions of the users with new events are extended
+# by them, getting an end if their level changed, and the new versions
+# are added. The keys of the versions are never renumbered, as the plays
+# already loaded reference them.
+users_table_merge = [
+    "DROP TABLE IF EXISTS user_versions;",
+    "CREATE TEMP TABLE user_versions AS {};".format(user_versions_select(_user_events)),
+    """
+    UPDATE users
+       SET effective_to = user_versions.effective_to
+      FROM user_versions
+     WHERE users.user_key = user_versions.user_key
+       AND users.effective_to <> user_versions.effective_to;
+    """,
+    """
+    INSERT INTO users (
+                user_id,
+                first_name,
+                last_name,
+                gender,
+                level,
+                effective_from,
+                effective_to)
+         SELECT user_id,
+                first_name,
+                last_name,
+                gender,
+                level,
+                effective_from,
+                effective_to
+           FROM user_versions
+          WHERE user_key IS NULL;
+    """,
+    "DROP TABLE user_versions;"
+]
+
+songs_table_merge = [
+    """
+    DELETE FROM songs
+          USING staging_songs
+          WHERE songs.song_id = staging_songs.song_id;
+    """,
+    songs_table_insert
+]
+
+artists_table_merge = [
+    """
+    DELETE FROM artists
+          USING staging_songs
+          WHERE artists.artist_id = staging_songs.artist_id;
+    """,
+    artists_table_insert
+]
+
+time_table_merge = [
+    """
+    DELETE FROM time
+          USING staging_events
+          WHERE time.start_time = staging_events.ts;
+    """,
+    time_table_insert
+]
+
+# The staging table 'staging_songs' holds only the new songs, so the
+# join keys of the songs are kept across the merges rather than rebuilt:
+# the keys of the staged songs replace theirs.
+staging_song_keys_merge = [
+    """
+    DELETE FROM staging_song_keys
+          USING staging_songs
+          WHERE staging_song_keys.song_id = staging_songs.song_id;
+    """,
+    staging_song_keys_insert
+]
+
+songplays_table_merge = [
+    """
+    DELETE FROM songplays
+          USING staging_plays
+          WHERE songplays.start_time = staging_plays.ts
+            AND songplays.user_id = staging_plays.userId
+            AND songplays.session_id = staging_plays.sessionId;
+    """,
+    songplays_table_insert
+]
+
+# ----------------------- #
+# Table 'etl_checkpoints' #
+# ----------------------- #
+
+# This table is kept free of Redshift clauses, so the checkpoints can be
+# tested against a local PostgreSQL database.
+
+etl_checkpoints_table_drop = "DROP TABLE IF EXISTS etl_checkpoints;"
+
+etl_checkpoints_table_create = """
+    CREATE TABLE IF NOT EXISTS etl_checkpoints (
+               stage VARCHAR(256)
+                     PRIMARY KEY,
+        completed_at TIMESTAMP
+                     NOT NULL
+    );
+"""
+
+etl_checkpoints_select = "SELECT stage FROM etl_checkpoints;"
+
+etl_checkpoints_insert = """
+    INSERT INTO etl_checkpoints (
+                stage,
+                completed_at)
+         VALUES (%s, %s);
+"""
+
+# The checkpoints of the days of log data copied into the staging tables,
+# like 'staging_events:2018-11-01', are kept until the staging tables are
+# emptied, so a day is never copied twice, resuming or not.
+etl_checkpoints_delete = "DELETE FROM etl_checkpoints WHERE stage NOT LIKE 'staging%:____-__-__';"
+
+etl_checkpoints_delete_partitions = "DELETE FROM etl_checkpoints WHERE stage LIKE 'staging%:____-__-__';"
+
+# ---------------- #
+# Table 'etl_lock' #
+# ---------------- #
+
+# A row held by the session of the run using the staging tables, so two
+# runs can't load them at the same time. It's free of Redshift clauses,
+# like the checkpoints.
+
+etl_lock_table_drop = "DROP TABLE IF EXISTS etl_lock;"
+
+etl_lock_table_create = """
+    CREATE TABLE IF NOT EXISTS etl_lock (
+             holder INTEGER
+                    NOT NULL,
+                run VARCHAR(256)
+                    NOT NULL,
+        acquired_at TIMESTAMP
+                    NOT NULL
+    );
+"""
+
+etl_lock_lock = "LOCK etl_lock;"
+
+etl_lock_select = "SELECT holder, run, acquired_at FROM etl_lock;"
+
+etl_lock_insert = """
+    INSERT INTO etl_lock (
+                holder,
+                run,
+                acquired_at)
+         VALUES (PG_BACKEND_PID(), %s, %s);
+"""
+
+etl_lock_delete = "DELETE FROM etl_lock WHERE holder = %s;"
+
+etl_lock_release = "DELETE FROM etl_lock WHERE holder = PG_BACKEND_PID();"
+
+# ------------------------------------------------------------------- #
+# Surrogate keys                                                      #
+#                                                                     #
+# With the setting 'SURROGATE_KEYS' on, 'songs', 'artists' and        #
+# 'songplays' are keyed by BIGINT surrogates instead of the VARCHAR   #
+# natural keys, which stay in the dimensions. The key maps below      #
+# assign the surrogates: natural keys are only ever added to them, so #
+# the surrogates are stable across incremental loads.                 #
+# ------------------------------------------------------------------- #
+
+song_keys_table_drop = "DROP TABLE IF EXISTS song_keys;"
+
+song_keys_table_create = """
+    CREATE TABLE IF NOT EXISTS song_keys (
+        song_key BIGINT
+                 IDENTITY(1, 1),
+         song_id VARCHAR
+                 PRIMARY KEY
+                 SORTKEY
+    )
+    DISTSTYLE ALL;
+"""
+
+artist_keys_table_drop = "DROP TABLE IF EXISTS artist_keys;"
+
+artist_keys_table_create = """
+    CREATE TABLE IF NOT EXISTS artist_keys (
+        artist_key BIGINT
+                   IDENTITY(1, 1),
+         artist_id VARCHAR
+                   PRIMARY KEY
+                   SORTKEY
+    )
+    DISTSTYLE ALL;
+"""
+
+key_maps_insert = [
+    """
+    INSERT INTO song_keys (
+                song_id)
+         SELECT DISTINCT staging_songs.song_id
+           FROM staging_songs
+      LEFT JOIN song_keys
+             ON staging_songs.song_id = song_keys.song_id
+          WHERE staging_songs.song_id IS NOT NULL
+            AND song_keys.song_id IS NULL;
+    """,
+    """
+    INSERT INTO artist_keys (
+                artist_id)
+         SELECT DISTINCT staging_songs.artist_id
+           FROM staging_songs
+      LEFT JOIN artist_keys
+             ON staging_songs.artist_id = artist_keys.artist_id
+          WHERE staging_songs.artist_id IS NOT NULL
+            AND artist_keys.artist_id IS NULL;
+    """
+]
+
+if config.ETL_SURROGATE_KEYS:
+
+    songplays_table_create = """
+        CREATE TABLE IF NOT EXISTS songplays (
+            songplay_id INTEGER
+                        IDENTITY(0, 1)
+                        PRIMARY KEY,
+             start_time TIMESTAMP
+                        NOT NULL
+                        REFERENCES time(start_time),
+                user_id INTEGER
+                        NOT NULL,
+               user_key BIGINT
+                        NOT NULL
+                        REFERENCES users(user_key),
+                  level VARCHAR
+                        NOT NULL,
+               song_key BIGINT
+                        NOT NULL
+                        REFERENCES songs(song_key)
+                        SORTKEY,
+             artist_key BIGINT
+                        NOT NULL
+                        REFERENCES artists(artist_key)
+                        DISTKEY,
+             session_id INTEGER
+                        NOT NULL,
+               location VARCHAR
+                        NOT NULL,
+             user_agent VARCHAR
+                        NOT NULL
+        )
+        DISTSTYLE KEY;
+    """
+
+    songplays_table_insert = """
+        INSERT INTO songplays (
+                    start_time,
+                    user_id,
+                    user_key,
+                    level,
+                    song_key,
+                    artist_key,
+                    session_id,
+                    location,
+                    user_agent)
+             SELECT staging_plays.ts AS start_time,
+                    staging_plays.userId AS user_id,
+                    users.user_key,
+                    staging_plays.level,
+                    song_keys.song_key,
+                    artist_keys.artist_key,
+                    staging_plays.sessionId AS session_id,
+                    staging_plays.location,
+                    staging_plays.userAgent AS user_agent
+               FROM staging_plays
+               JOIN staging_song_keys
+                 ON staging_plays.join_key = staging_song_keys.join_key
+               JOIN song_keys
+                 ON staging_song_keys.song_id = song_keys.song_id
+               JOIN artist_keys
+                 ON staging_song_keys.artist_id = artist_keys.artist_id
+               JOIN users
+                 ON staging_plays.userId = users.user_id
+                AND staging_plays.ts >= users.effective_from
+                AND staging_plays.ts < users.effective_to;
+    """
+
+    songs_table_create = """
+        CREATE TABLE IF NOT EXISTS songs (
+              song_key BIGINT
+                       PRIMARY KEY,
+               song_id VARCHAR
+                       NOT NULL,
+                 title VARCHAR(1024)
+                       NOT NULL,
+            artist_key BIGINT
+                       NOT NULL
+                       REFERENCES artists(artist_key)
+                       DISTKEY
+                       SORTKEY,
+                  year SMALLINT,
+              duration FLOAT
+        )
+        DISTSTYLE KEY;
+    """
+
+    songs_table_insert = """
+        INSERT INTO songs (
+                    song_key,
+                    song_id,
+                    title,
+                    artist_key,
+                    year,
+                    duration)
+             SELECT DISTINCT song_keys.song_key,
+                    staging_songs.song_id,
+                    staging_songs.title,
+                    artist_keys.artist_key,
+                    staging_songs.year,
+                    staging_songs.duration
+               FROM staging_songs
+               JOIN song_keys
+                 ON staging_songs.song_id = song_keys.song_id
+               JOIN artist_keys
+                 ON staging_songs.artist_id = artist_keys.artist_id;
+    """
+
+    artists_table_create = """
+        CREATE TABLE IF NOT EXISTS artists (
+            artist_key BIGINT
+                       PRIMARY KEY,
+             artist_id VARCHAR
+                       NOT NULL,
+                  name VARCHAR(1024)
+                       NOT NULL,
+              location VARCHAR(1024),
+              latitude FLOAT,
+             longitude FLOAT
+        )
+        DISTSTYLE ALL;
+    """
+
+    artists_table_insert = """
+        INSERT INTO artists (
+                    artist_key,
+                    artist_id,
+                    name,
+                    location,
+                    latitude,
+                    longitude)
+             SELECT DISTINCT artist_keys.artist_key,
+                    staging_songs.artist_id,
+                    staging_songs.artist_name AS name,
+                    staging_songs.artist_location AS location,
+                    staging_songs.artist_latitude AS latitude,
+                    staging_songs.artist_longitude AS longitude
+               FROM staging_songs
+               JOIN artist_keys
+                 ON staging_songs.artist_id = artist_keys.artist_id;
+    """
+
+    songs_table_merge = [songs_table_merge[0], songs_table_insert]
+
+    artists_table_merge = [artists_table_merge[0], artists_table_insert]
+
+    songplays_table_merge = [songplays_table_merge[0], songplays_table_insert]
+
+# ------------------------------------------------------------------- #
+# Rollups                                                             #
+#                                                                     #
+# Aggregates of 'songplays' for the common analytics queries. After a #
+# load, only the days of the staged events are recomputed, and they   #
+# can be checked against a full recompute.                            #
+# ------------------------------------------------------------------- #
+
+# The song column of 'songplays', which is a surrogate with the setting
+# 'SURROGATE_KEYS' on.
+_song_column = 'song_key' if config.ETL_SURROGATE_KEYS else 'song_id'
+
+# The condition matching the rows of 'songplays' of the days recomputed.
+_rollup_songplays = "CAST(start_time AS DATE) IN (SELECT day FROM rollup_days)"
+
+daily_plays_by_song_table_drop = "DROP TABLE IF EXISTS daily_plays_by_song;"
+
+daily_plays_by_song_table_create = """
+    CREATE TABLE IF NOT EXISTS daily_plays_by_song (
+            day DATE
+                NOT NULL
+                SORTKEY,
+        song_id VARCHAR
+                NOT NULL
+                DISTKEY,
+          plays BIGINT
+                NOT NULL
+    )
+    DISTSTYLE KEY;
+"""
+
+if config.ETL_SURROGATE_KEYS:
+
+    daily_plays_by_song_table_create = """
+        CREATE TABLE IF NOT EXISTS daily_plays_by_song (
+                 day DATE
+                     NOT NULL
+                     SORTKEY,
+            song_key BIGINT
+                     NOT NULL
+                     DISTKEY,
+               plays BIGINT
+                     NOT NULL
+        )
+        DISTSTYLE KEY;
+    """
+
+daily_plays_by_song_select = """
+         SELECT CAST(start_time AS DATE) AS day,
+                {0},
+                COUNT(*) AS plays
+           FROM songplays
+          WHERE {{}}
+       GROUP BY 1, 2
+""".format(_song_column)
+
+daily_active_users_by_level_table_drop = "DROP TABLE IF EXISTS daily_active_users_by_level;"
+
+daily_active_users_by_level_table_create = """
+    CREATE TABLE IF NOT EXISTS daily_active_users_by_level (
+          day DATE
+              NOT NULL
+              SORTKEY,
+        level VARCHAR
+              NOT NULL,
+        users BIGINT
+              NOT NULL
+    )
+    DISTSTYLE ALL;
+"""
+
+daily_active_users_by_level_select = """
+         SELECT CAST(start_time AS DATE) AS day,
+                level,
+                COUNT(DISTINCT user_id) AS users
+           FROM songplays
+          WHERE {}
+       GROUP BY 1, 2
+"""
+
+hourly_plays_table_drop = "DROP TABLE IF EXISTS hourly_plays;"
+
+hourly_plays_table_create = """
+    CREATE TABLE IF NOT EXISTS hourly_plays (
+         hour TIMESTAMP
+              NOT NULL
+              SORTKEY,
+        plays BIGINT
+              NOT NULL
+    )
+    DISTSTYLE ALL;
+"""
+
+hourly_plays_select = """
+         SELECT DATE_TRUNC('hour', start_time) AS hour,
+                COUNT(*) AS plays
+           FROM songplays
+          WHERE {}
+       GROUP BY 1
+"""
+
+
+def rollup_check(table, keys, value, recompute):
+
+    """
+    Generates the query counting the rows of a rollup that differ from a
+    full recompute, missing and extra rows included.
+
+    Args:
+        table (str): The name of the rollup.
+        keys (list): The key columns of the rollup.
+        value (str): The value column of the rollup.
+        recompute (str): The query aggregating all the rows.
+
+    Returns:
+        (str): The query counting the differences.
+    """
+
+    return """
+    SELECT COUNT(*)
+      FROM ({0}) AS expected
+      FULL OUTER JOIN {1}
+        ON {2}
+     WHERE expected.{3} IS NULL
+        OR {1}.{3} IS NULL
+        OR expected.{4} <> {1}.{4};
+    """.format(
+        recompute,
+        table,
+        '\n       AND '.join('expected.{0} = {1}.{0}'.format(key, table) for key in keys),
+        keys[0],
+        value
+    )
+
+
+# The tables of the rollups.
+rollup_tables = [
+    'daily_plays_by_song',
+    'daily_active_users_by_level',
+    'hourly_plays'
+]
+
+# The column holding the day or the hour of every rollup, and the query
+# aggregating the rows of 'songplays' into it.
+_rollup_selects = {
+    'daily_plays_by_song': ('day', daily_plays_by_song_select),
+    'daily_active_users_by_level': ('day', daily_active_users_by_level_select),
+    'hourly_plays': ('hour', hourly_plays_select)
+}
+
+
+def rollups_recompute(days):
+
+    """
+    Generates the queries recomputing the given days of the rollups: their
+    rows are deleted, and aggregated again from 'songplays'. Rows of the
+    fact table can be deleted and inserted again by a merge, under new ids,
+    so nothing short of whole days can be recomputed consistently.
+
+    Args:
+        days (str): The query selecting the days to recompute, as a
+            column 'day'.
+
+    Returns:
+        (list): The queries recomputing the days.
+    """
+
+    queries = [
+        "DROP TABLE IF EXISTS rollup_days;",
+        "CREATE TEMP TABLE rollup_days AS {};".format(days.strip())
+    ]
+    for table in rollup_tables:
+        column, select = _rollup_selects[table]
+        queries += [
+            """
+    DELETE FROM {0}
+          WHERE CAST({1} AS DATE) IN (SELECT day FROM rollup_days);
+            """.format(table, column),
+            """
+    INSERT INTO {}{};
+            """.format(table, select.format(_rollup_songplays).rstrip())
+        ]
+    return queries + ["DROP TABLE rollup_days;"]
+
+
+# Recomputes the days of the events staged by the load, in the same
+# transaction as the load itself.
+rollups_update = rollups_recompute("""
+    SELECT DISTINCT CAST(ts AS DATE) AS day
+      FROM staging_events
+     WHERE ts IS NOT NULL
+""")
+
+# Empties the rollups and recomputes every day of 'songplays'.
+rollups_rebuild = ['DELETE FROM {};'.format(table) for table in rollup_tables] + rollups_recompute("""
+    SELECT DISTINCT CAST(start_time AS DATE) AS day
+      FROM songplays
+""")
+
+# Counts the rows of every rollup that differ from a full recompute.
+rollups_check = {
+    'daily_plays_by_song': rollup_check(
+        'daily_plays_by_song',
+        ['day', _song_column],
+        'plays',
+        daily_plays_by_song_select.format('TRUE')
+    ),
+    'daily_active_users_by_level': rollup_check(
+        'daily_active_users_by_level',
+        ['day', 'level'],
+        'users',
+        daily_active_users_by_level_select.format('TRUE')
+    ),
+    'hourly_plays': rollup_check(
+        'hourly_plays',
+        ['hour'],
+        'plays',
+        hourly_plays_select.format('TRUE')
+    )
+}
+
+# -------------------- #
+# Table 'data_version' #
+# -------------------- #
+
+# A row per committed load, so readers can tell when the data changed.
+data_version_table_drop = "DROP TABLE IF EXISTS data_version;"
+
+data_version_table_create = """
+    CREATE TABLE IF NOT EXISTS data_version (
+        loaded_at TIMESTAMP
+                  NOT NULL
+    )
+    DISTSTYLE ALL;
+"""
+
+data_version_select = "SELECT MAX(loaded_at) FROM data_version;"
+
+data_version_insert = "INSERT INTO data_version (loaded_at) VALUES (%s);"
+
+# ------------------------------------------------------------------- #
+# Analytics queries                                                   #
+#                                                                     #
+# The parameterized queries served by 'query_api.py', by name. They   #
+# read the rollups where possible.                                    #
+# ------------------------------------------------------------------- #
+
+_artist_column = 'artist_key' if config.ETL_SURROGATE_KEYS else 'artist_id'
+
+analytics_queries = {
+    'top_artists': """
+         SELECT artists.name,
+                plays.listeners
+           FROM (
+                 SELECT {0},
+                        COUNT(*) AS listeners
+                   FROM songplays
+               GROUP BY {0}
+                ) AS plays
+           JOIN artists
+             ON plays.{0} = artists.{0}
+       ORDER BY plays.listeners DESC
+          LIMIT %(limit)s;
+    """.format(_artist_column),
+    'top_songs': """
+         SELECT songs.title,
+                plays.plays
+           FROM (
+                 SELECT {0},
+                        SUM(plays) AS plays
+                   FROM daily_plays_by_song
+                  WHERE day BETWEEN %(start)s AND %(end)s
+               GROUP BY {0}
+                ) AS plays
+           JOIN songs
+             ON plays.{0} = songs.{0}
+       ORDER BY plays.plays DESC
+          LIMIT %(limit)s;
+    """.format(_song_column),
+    'daily_plays': """
+         SELECT day,
+                SUM(plays) AS plays
+           FROM daily_plays_by_song
+          WHERE day BETWEEN %(start)s AND %(end)s
+       GROUP BY day
+       ORDER BY day;
+    """,
+    'daily_active_users': """
+         SELECT day,
+                level,
+                users
+           FROM daily_active_users_by_level
+          WHERE day BETWEEN %(start)s AND %(end)s
+       ORDER BY day, level;
+    """,
+    'hourly_plays': """
+         SELECT hour,
+                plays
+           FROM hourly_plays
+          WHERE hour BETWEEN %(start)s AND %(end)s
+       ORDER BY hour;
+    """
+}
+
+# ------------------------------------------------------------------- #
+# Column encodings                                                    #
+#                                                                     #
+# The encodings saved by 'compression.py' are declared in the DDL of  #
+# every table, so loads don't pay for the compression analysis.       #
+# ------------------------------------------------------------------- #
+
+
+def apply_encodings(ddl, encodings):
+
+    """
+    Declares the given encodings in the definition of the columns of a
+    'CREATE TABLE' query. The encoding is appended to the attributes of
+    every column, whatever their layout, and the columns left without an
+    encoding are logged.
+
+    Args:
+        ddl (str): The 'CREATE TABLE' query.
+        encodings (dict): The encodings of the tables, by table and
+            column names.
+
+    Returns:
+        (str): The query with the encodings declared.
+    """
+
+    table = re.search(r'CREATE TABLE IF NOT EXISTS (\w+)', ddl).group(1)
+    columns = encodings.get(table)
+    if not columns:
+        return ddl
+
+    # The column definitions end on the commas outside of parentheses.
+    start = ddl.index('(') + 1
+    end = ddl.rindex(')')
+    ends, depth = [], 0
+    for position in range(start, end):
+        if ddl[position] == '(':
+            depth += 1
+        elif ddl[position] == ')':
+            depth -= 1
+        elif ddl[position] == ',' and not depth:
+            ends.append(position)
+    ends.append(end)
+
+    parts, missing = [ddl[:start]], []
+    for first, last in zip([start] + [e + 1 for e in ends[:-1]], ends):
+        definition = ddl[first:last]
+        name = definition.split()[0].lower()
+        encoding = columns.get(name)
+        if encoding is None or 'ENCODE' in definition:
+            if encoding is None:
+                missing.append(name)
+            parts.append(definition)
+        else:
+            # A definition spread over lines gets its encoding on a line
+            # of its own, aligned with the other attributes.
+            body = definition.rstrip()
+            separator = ' '
+            if '\n' in body.strip():
+                separator = '\n' + re.match(r'\s*', body.rsplit('\n', 1)[-1]).group(0)
+            parts.append('{}{}ENCODE {}{}'.format(body, separator, encoding.upper(), definition[len(body):]))
+        parts.append(ddl[last])
+    parts.append(ddl[end + 1:])
+
+    if missing:
+        metrics.log('No encoding for the columns {} of \'{}\''.format(', '.join(missing), table))
+    return ''.join(parts)
+
+
+_encodings = compression.load_encodings()
+if _encodings:
+    for _name in [n for n in list(globals()) if n.endswith('_table_create')]:
+        globals()[_name] = apply_encodings(globals()[_name], _encodings)
+
+# ------------------------------------------------------------------- #
+# Promotion                                                           #
+#                                                                     #
+# With the setting 'PROMOTION' set to 'swap', the new contents of a   #
+# table are built into a shadow table with the same definition, and   #
+# promoted at once: by renaming it over the table, or by moving its   #
+# blocks with 'ALTER TABLE APPEND' into an append-only table.         #
+# ------------------------------------------------------------------- #
+
+
+def shadow_table_create(table):
+
+    """
+    Generates the query creating the shadow of a table. The shadow is
+    created from the definition of the table rather than 'LIKE' it, so it
+    keeps the primary and foreign keys as well as the distribution, sort
+    keys and encodings.
+
+    Args:
+        table (str): The name of the table.
+
+    Returns:
+        (str): The 'CREATE TABLE' query of the shadow.
+    """
+
+    return re.sub(
+        r'CREATE TABLE IF NOT EXISTS {}\b'.format(table),
+        'CREATE TABLE {}_shadow'.format(table),
+        globals()['{}_table_create'.format(table)]
+    )
+
+
+def shadow_table_insert(table):
+
+    """
+    Generates the query populating the shadow of a table.
+
+    Args:
+        table (str): The name of the table.
+
+    Returns:
+        (str): The 'INSERT' query of the shadow.
+    """
+
+    return re.sub(
+        r'INSERT INTO {}\b'.format(table),
+        'INSERT INTO {}_shadow'.format(table),
+        globals()['{}_table_insert'.format(table)]
+    )
+
+
+shadow_table_drop = "DROP TABLE IF EXISTS {}_shadow;"
+
+shadow_table_exists = """
+    SELECT COUNT(*)
+      FROM information_schema.tables
+     WHERE table_name = %s;
+"""
+
+# The foreign keys referencing a table, from other tables. Dropping the
+# table drops them, so they're declared again on its replacement.
+foreign_keys_select = """
+    SELECT referrer.relname,
+           pg_constraint.conname,
+           pg_get_constraintdef(pg_constraint.oid)
+      FROM pg_constraint
+      JOIN pg_class AS referrer
+        ON pg_constraint.conrelid = referrer.oid
+      JOIN pg_class AS referenced
+        ON pg_constraint.confrelid = referenced.oid
+     WHERE pg_constraint.contype = 'f'
+       AND referenced.relname = %s
+       AND referrer.relname <> referenced.relname;
+"""
+
+foreign_key_add = "ALTER TABLE {} ADD CONSTRAINT {} {};"
+
+table_swap = [
+    "ALTER TABLE {0} RENAME TO {0}_old;",
+    "ALTER TABLE {0}_shadow RENAME TO {0};",
+    "DROP TABLE {0}_old CASCADE;"
+]
+
+# Can't run within a transaction block.
+table_append = "ALTER TABLE {0} APPEND FROM {0}_shadow;"
+
+# ------------------------------------------------------------------- #
+# Export of songplays                                                 #
+#                                                                     #
+# 'songplays' is exported into Parquet files partitioned by the year  #
+# and month of its plays, read from 'time'. The partition columns are #
+# the last two of the query, and are left out of the files, as their  #
+# values are in the path of the partitions.                           #
+# ------------------------------------------------------------------- #
+
+
+def songplays_export_select(start=None, end=None):
+
+    """
+    Generates the query selecting the songplays to export.
+
+    Args:
+        start (date): The first day of the plays exported, if any.
+        end (date): The day after the plays exported, if any.
+
+    Returns:
+        (str): The 'SELECT' query of the songplays.
+    """
+
+    conditions = []
+    if start:
+        conditions.append("songplays.start_time >= '{}'".format(start.isoformat()))
+    if end:
+        conditions.append("songplays.start_time < '{}'".format(end.isoformat()))
+
+    return """
+    SELECT songplays.*,
+           time.year,
+           time.month
+      FROM songplays
+      JOIN time
+        ON songplays.start_time = time.start_time{}""".format(
+        '\n     WHERE ' + '\n       AND '.join(conditions) if conditions else ''
+    )
+
+
+def songplays_unload(target, start=None, end=None):
+
+    """
+    Generates the query unloading the songplays to S3, every slice writing
+    its own files in parallel. The files previously in the partitions
+    unloaded are removed first, and a manifest listing the new files is
+    written along.
+
+    Args:
+        target (str): The S3 prefix of the export.
+        start (date): The first day of the plays unloaded, if any.
+        end (date): The day after the plays unloaded, if any.
+
+    Returns:
+        (str): The 'UNLOAD' query of the songplays.
+    """
+
+    return """
+         UNLOAD ('{}')
+             TO '{}'
+    CREDENTIALS 'aws_iam_role={}'
+      FORMAT AS PARQUET
+   PARTITION BY (year, month)
+       MANIFEST VERBOSE
+       PARALLEL ON
+      CLEANPATH;
+""".format(
+        songplays_export_select(start, end).replace("'", "''"),
+        target.rstrip('/') + '/',
+        config.IAM_ROLE_ARN
+    )
+
+# --------------- #
+# Post-load stats #
+# --------------- #
+
+# The COPYs don't update the statistics, so they're refreshed once at the
+# end of the load.
+analyze_tables = [
+    'ANALYZE {};'.format(table) for table in compression.tables
+]
+
+# ------------------------------------------------------------------- #
+# Session profiles                                                    #
+#                                                                     #
+# Every stage of 'etl.py' runs its queries in a session set up for    #
+# its workload: the WLM query group routing them to a queue, the      #
+# number of slots of the queue they take (and so their share of its   #
+# memory), and a statement timeout. They only apply to Redshift.      #
+# ------------------------------------------------------------------- #
+
+# The profiles of the stages, by stage name: the query group, the slots
+# and the statement timeout in milliseconds (0 for none). The batches of
+# a stage, like 'staging_songs:3', share its profile, and the stages not
+# listed get the default one.
+session_profiles = {
+    'default': ('etl', 1, 1800000),
+    'staging_events': ('etl_copy', 2, 0),
+    'staging_user_events': ('etl_copy', 1, 0),
+    'staging_songs': ('etl_copy', 2, 0),
+    'staging_plays': ('etl', 2, 1800000),
+    'staging_song_keys': ('etl', 2, 1800000),
+    'songplays': ('etl_heavy', 3, 3600000),
+    'rollups': ('etl', 2, 1800000),
+    'analyze': ('etl', 1, 3600000)
+}
+
+session_profile_set = [
+    "SET query_group TO '{}';",
+    "SET wlm_query_slot_count TO {};",
+    "SET statement_timeout TO {};"
+]
+
+session_profile_reset = [
+    "RESET query_group;",
+    "RESET wlm_query_slot_count;",
+    "RESET statement_timeout;"
+]
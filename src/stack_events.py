@@ -0,0 +1,139 @@
+import boto3
+import config
+import metrics
+import time
+
+
+# The terminal states of a stack, by operation: the states reached when
+# it succeeds, and those reached when it fails.
+terminal_states = {
+    'create': (
+        ['CREATE_COMPLETE'],
+        ['CREATE_FAILED', 'ROLLBACK_COMPLETE', 'ROLLBACK_FAILED']
+    ),
+    'delete': (
+        ['DELETE_COMPLETE'],
+        ['DELETE_FAILED']
+    )
+}
+
+# The bounds of the delay between two polls, in seconds. The delay goes
+# back to the minimum whenever new events show up, and doubles otherwise.
+min_delay = 2
+max_delay = 30
+
+
+def get_client():
+
+    """
+    Creates a CloudFormation client. The setting 'ENDPOINT_URL' points it
+    to a stand-in, like a moto server.
+
+    Returns:
+        (client): The CloudFormation client.
+    """
+
+    return boto3.client(
+        'cloudformation',
+        region_name=config.AWS_REGION,
+        aws_access_key_id=config.AWS_ACCESS_KEY_ID or None,
+        aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY or None,
+        endpoint_url=config.CLOUDFORMATION_ENDPOINT_URL or None
+    )
+
+
+def get_new_events(cloudformation, stack_id, seen):
+
+    """
+    Gets the events of a stack not seen yet, and marks them as seen. The
+    events come newest first, so the pages are only read until the first
+    event already seen.
+
+    Args:
+        cloudformation (client): The CloudFormation client.
+        stack_id (str): The identifier of the stack.
+        seen (set): The identifiers of the events already seen.
+
+    Returns:
+        (list): The new events, oldest first.
+    """
+
+    events = []
+    paginator = cloudformation.get_paginator('describe_stack_events')
+    for page in paginator.paginate(StackName=stack_id):
+        new = [e for e in page['StackEvents'] if e['EventId'] not in seen]
+        events.extend(new)
+        if len(new) < len(page['StackEvents']):
+            break
+    seen.update(e['EventId'] for e in events)
+    return list(reversed(events))
+
+
+def format_event(event):
+
+    """
+    Formats a stack event as a line of the log.
+
+    Args:
+        event (dict): The stack event.
+
+    Returns:
+        (str): The line of the log.
+    """
+
+    line = '{} ({}): {}'.format(
+        event['LogicalResourceId'],
+        event['ResourceType'],
+        event['ResourceStatus']
+    )
+    if event.get('ResourceStatusReason'):
+        line += ' - {}'.format(event['ResourceStatusReason'])
+    return line
+
+
+def wait_for_stack(cloudformation, stack_id, operation, seen=None, sleep=time.sleep):
+
+    """
+    Tails the events of a stack until the stack itself reaches a terminal
+    state of the operation, printing them as they show up.
+
+    Args:
+        cloudformation (client): The CloudFormation client.
+        stack_id (str): The identifier of the stack. Unlike its name, it
+            still identifies the stack once deleted.
+        operation (str): The operation, 'create' or 'delete'.
+        seen (set): The identifiers of the events that happened before
+            the operation, which are ignored.
+        sleep (function): Waits the given number of seconds.
+
+    Returns:
+        (str): The terminal state of the stack.
+
+    Raises:
+        RuntimeError: If the stack reached a state of failure.
+    """
+
+    success, failure = terminal_states[operation]
+    seen = set() if seen is None else seen
+    reasons = []
+    delay = min_delay
+
+    while True:
+        events = get_new_events(cloudformation, stack_id, seen)
+        for event in events:
+            metrics.log(format_event(event))
+            if event['ResourceStatus'].endswith('_FAILED') and event.get('ResourceStatusReason'):
+                reasons.append('{}: {}'.format(event['LogicalResourceId'], event['ResourceStatusReason']))
+
+            if event['ResourceType'] != 'AWS::CloudFormation::Stack' or event['PhysicalResourceId'] != stack_id:
+                continue
+            if event['ResourceStatus'] in success:
+                return event['ResourceStatus']
+            if event['ResourceStatus'] in failure:
+                raise RuntimeError('The stack ended in {}{}'.format(
+                    event['ResourceStatus'],
+                    ': {}'.format('; '.join(reasons)) if reasons else ''
+                ))
+
+        delay = min_delay if events else min(delay * 2, max_delay)
+        sleep(delay)
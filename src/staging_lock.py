@@ -0,0 +1,68 @@
+import contextlib
+import database
+import datetime
+import metrics
+import sql_queries
+
+
+# Whether a session is still alive, on Redshift and on a PostgreSQL
+# stand-in.
+redshift_session = "SELECT COUNT(*) FROM stv_sessions WHERE process = %s;"
+postgres_session = "SELECT COUNT(*) FROM pg_stat_activity WHERE pid = %s;"
+
+
+def acquire(cur, run):
+
+    """
+    Takes the lock of the staging tables for the session of the cursor.
+    A lock left by a session that's gone, like a crashed run, is cleared.
+
+    Args:
+        cur (cursor): A cursor of the session holding the lock.
+        run (str): A description of the run, reported to the other runs.
+
+    Raises:
+        RuntimeError: If a live session holds the lock.
+    """
+
+    cur.execute(sql_queries.etl_lock_table_create)
+    cur.execute(sql_queries.etl_lock_lock)
+    cur.execute(sql_queries.etl_lock_select)
+    for holder, other, acquired_at in cur.fetchall():
+        cur.execute(redshift_session if metrics.is_redshift(cur) else postgres_session, (holder,))
+        if cur.fetchone()[0]:
+            raise RuntimeError('The staging tables are used by the {} run of session {} since {}'.format(
+                other, holder, acquired_at
+            ))
+        metrics.log(' --> Clearing the lock left by the {} run of session {}'.format(other, holder))
+        cur.execute(sql_queries.etl_lock_delete, (holder,))
+    cur.execute(sql_queries.etl_lock_insert, (run, datetime.datetime.utcnow()))
+
+
+@contextlib.contextmanager
+def hold(run):
+
+    """
+    Holds the lock of the staging tables while a run loads them, failing
+    fast if another run does. The lock is held by a connection of its
+    own, open until the run ends, so the lock of a run that dies goes
+    with its session.
+
+    Args:
+        run (str): A description of the run, like 'incremental'.
+
+    Raises:
+        RuntimeError: If another run holds the lock.
+    """
+
+    conn = database.connect()
+    try:
+        with conn, conn.cursor() as cur:
+            acquire(cur, run)
+        try:
+            yield
+        finally:
+            with conn, conn.cursor() as cur:
+                cur.execute(sql_queries.etl_lock_release)
+    finally:
+        conn.close()
@@ -0,0 +1,281 @@
+import boto3
+import config
+import os
+import tempfile
+
+
+class LocalStore:
+
+    """
+    A directory-backed stand-in of a S3 prefix. Keys are paths relative
+    to the root directory, using '/' as separator. Hidden files are
+    ignored.
+    """
+
+    def __init__(self, root):
+
+        """
+        Args:
+            root (str): The root directory of the store.
+        """
+
+        self.root = os.path.abspath(root)
+
+    def list(self, prefix=''):
+
+        """
+        Lists the objects under the given prefix.
+
+        Args:
+            prefix (str): The prefix of the keys to list.
+
+        Returns:
+            (list): The tuples (key, size in bytes) sorted by key.
+        """
+
+        objects = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    objects.append((key, os.path.getsize(path)))
+        return sorted(objects)
+
+    def exists(self, key):
+
+        """
+        Checks whether the given key exists.
+
+        Args:
+            key (str): The key of the object.
+
+        Returns:
+            (bool): True if the object exists.
+        """
+
+        return os.path.isfile(self.path(key))
+
+    def read(self, key):
+
+        """
+        Reads the content of an object.
+
+        Args:
+            key (str): The key of the object.
+
+        Returns:
+            (bytes): The content of the object.
+        """
+
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def write(self, key, data):
+
+        """
+        Writes an object. The content is written to a temporary file first
+        and then renamed, so a reader never sees a half-written object.
+
+        Args:
+            key (str): The key of the object.
+            data (bytes): The content of the object.
+        """
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+    def delete(self, key):
+
+        """
+        Deletes an object, if it exists.
+
+        Args:
+            key (str): The key of the object.
+        """
+
+        if os.path.isfile(self.path(key)):
+            os.remove(self.path(key))
+
+    def path(self, key):
+
+        """
+        Gets the local path of an object.
+
+        Args:
+            key (str): The key of the object.
+
+        Returns:
+            (str): The path of the object.
+        """
+
+        return os.path.join(self.root, *key.split('/'))
+
+    def url(self, key):
+
+        """
+        Gets the URL of an object.
+
+        Args:
+            key (str): The key of the object.
+
+        Returns:
+            (str): The URL of the object.
+        """
+
+        return self.path(key)
+
+
+class S3Store:
+
+    """
+    A S3 prefix. Keys are relative to the prefix.
+    """
+
+    def __init__(self, url):
+
+        """
+        Args:
+            url (str): The URL of the prefix, like 's3://bucket/prefix'.
+        """
+
+        self.bucket, _, self.prefix = url[len('s3://'):].partition('/')
+        self.prefix = self.prefix.strip('/')
+        self.client = boto3.client(
+            's3',
+            region_name=config.AWS_REGION,
+            aws_access_key_id=config.AWS_ACCESS_KEY_ID or None,
+            aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY or None,
+            endpoint_url=config.S3_ENDPOINT_URL or None
+        )
+
+    def list(self, prefix=''):
+
+        """
+        Lists the objects under the given prefix.
+
+        Args:
+            prefix (str): The prefix of the keys to list.
+
+        Returns:
+            (list): The tuples (key, size in bytes) sorted by key.
+        """
+
+        objects = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.key(prefix)):
+            for item in page.get('Contents', []):
+                key = item['Key'][len(self.key('')):]
+                if key and not key.endswith('/'):
+                    objects.append((key, item['Size']))
+        return sorted(objects)
+
+    def exists(self, key):
+
+        """
+        Checks whether the given key exists.
+
+        Args:
+            key (str): The key of the object.
+
+        Returns:
+            (bool): True if the object exists.
+        """
+
+        response = self.client.list_objects_v2(
+            Bucket=self.bucket,
+            Prefix=self.key(key),
+            MaxKeys=1
+        )
+        return any(o['Key'] == self.key(key) for o in response.get('Contents', []))
+
+    def read(self, key):
+
+        """
+        Reads the content of an object.
+
+        Args:
+            key (str): The key of the object.
+
+        Returns:
+            (bytes): The content of the object.
+        """
+
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key(key))
+        return response['Body'].read()
+
+    def write(self, key, data):
+
+        """
+        Writes an object.
+
+        Args:
+            key (str): The key of the object.
+            data (bytes): The content of the object.
+        """
+
+        self.client.put_object(Bucket=self.bucket, Key=self.key(key), Body=data)
+
+    def delete(self, key):
+
+        """
+        Deletes an object, if it exists.
+
+        Args:
+            key (str): The key of the object.
+        """
+
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(key))
+
+    def key(self, key):
+
+        """
+        Gets the full key of an object, prefix included.
+
+        Args:
+            key (str): The key of the object.
+
+        Returns:
+            (str): The full key of the object.
+        """
+
+        return '{}/{}'.format(self.prefix, key) if self.prefix else key
+
+    def url(self, key):
+
+        """
+        Gets the URL of an object.
+
+        Args:
+            key (str): The key of the object.
+
+        Returns:
+            (str): The URL of the object.
+        """
+
+        return 's3://{}/{}'.format(self.bucket, self.key(key))
+
+
+def open_store(url):
+
+    """
+    Opens the store located in the given URL.
+
+    Args:
+        url (str): A S3 URL, like 's3://bucket/prefix', or a local path.
+
+    Returns:
+        (object): A S3Store or a LocalStore.
+    """
+
+    if url.startswith('s3://'):
+        return S3Store(url)
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    return LocalStore(url)
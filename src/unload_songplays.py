@@ -0,0 +1,315 @@
+import argparse
+import config
+import database
+import datetime
+import json
+import metrics
+import re
+import snapshot
+import sql_queries
+import storage
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# The key of the manifest, relative to the target, where 'UNLOAD' writes
+# it.
+manifest_key = 'manifest'
+
+# The year and month of the partition of a file, in its key or URL.
+partition_pattern = re.compile(r'year=(\d+)/month=(\d+)/')
+
+
+def parse_month(text):
+
+    """
+    Parses a month given on the command line.
+
+    Args:
+        text (str): The month, like '2018-11'.
+
+    Returns:
+        (date): The first day of the month.
+    """
+
+    return datetime.datetime.strptime(text, '%Y-%m').date()
+
+
+def get_range(first=None, last=None):
+
+    """
+    Gets the days covered by a range of months. A partition is rewritten
+    as a whole by a backfill, so the range always spans whole months.
+
+    Args:
+        first (date): A day of the first month, if any.
+        last (date): A day of the last month, if any.
+
+    Returns:
+        (tuple): The first day of the range and the day after it, each
+            None if the range is open on that side.
+    """
+
+    start = first.replace(day=1) if first else None
+    end = None
+    if last:
+        end = (last.replace(day=1) + datetime.timedelta(days=31)).replace(day=1)
+    return start, end
+
+
+def partition_key(year, month):
+
+    """
+    Gets the key of the file of a partition, named as 'UNLOAD' names the
+    file written by the first slice.
+
+    Args:
+        year (int): The year of the partition.
+        month (int): The month of the partition.
+
+    Returns:
+        (str): The key of the file, relative to the target.
+    """
+
+    return 'year={}/month={}/0000_part_00.parquet'.format(year, month)
+
+
+def manifest(entries):
+
+    """
+    Builds the content of a manifest, in the format of 'MANIFEST VERBOSE'.
+
+    Args:
+        entries (list): The tuples (URL, size in bytes, rows) of the files.
+
+    Returns:
+        (bytes): The manifest, JSON encoded.
+    """
+
+    return json.dumps({
+        'entries': [
+            {'url': url, 'meta': {'content_length': size, 'record_count': rows}}
+            for url, size, rows in entries
+        ],
+        'meta': {
+            'content_length': sum(size for _, size, _ in entries),
+            'record_count': sum(rows for _, _, rows in entries)
+        }
+    }, indent=2).encode('utf-8')
+
+
+def in_range(key, start, end):
+
+    """
+    Checks whether a file belongs to a partition of a range of months.
+
+    Args:
+        key (str): The key or URL of the file.
+        start (date): The first day of the range, if any.
+        end (date): The day after the range, if any.
+
+    Returns:
+        (bool): True if the file is in a partition of the range.
+    """
+
+    match = partition_pattern.search(key)
+    if not match:
+        return False
+    month = datetime.date(int(match.group(1)), int(match.group(2)), 1)
+    return (start is None or month >= start) and (end is None or month < end)
+
+
+def read_manifest(store):
+
+    """
+    Reads the entries of the manifest of a previous export.
+
+    Args:
+        store (object): The store of the export.
+
+    Returns:
+        (list): The tuples (URL, size in bytes, rows) of the files, empty
+            if there's no manifest yet.
+    """
+
+    if not store.exists(manifest_key):
+        return []
+    return [
+        (e['url'], e['meta']['content_length'], e['meta']['record_count'])
+        for e in json.loads(store.read(manifest_key))['entries']
+    ]
+
+
+def replace_partitions(store, previous, entries, start, end):
+
+    """
+    Replaces the partitions of a range of months with the files just
+    written: the other files left in these partitions are deleted, and
+    the manifest lists the new files along with the files of the
+    partitions out of the range.
+
+    Args:
+        store (object): The store of the export.
+        previous (list): The entries of the manifest before the export.
+        entries (list): The tuples (URL, size in bytes, rows) of the files
+            just written.
+        start (date): The first day of the range, if any.
+        end (date): The day after the range, if any.
+
+    Returns:
+        (list): The entries of the manifest.
+    """
+
+    urls = {url for url, _, _ in entries}
+    for key, _ in store.list():
+        if in_range(key, start, end) and store.url(key) not in urls:
+            store.delete(key)
+
+    entries = sorted([e for e in previous if not in_range(e[0], start, end)] + entries)
+    store.write(manifest_key, manifest(entries))
+    return entries
+
+
+def write_partitions(store, cur, batch_size):
+
+    """
+    Streams the songplays into a Parquet file per partition, the rows
+    coming ordered by partition. The partitions are written to the store
+    one after the other, so a single one is held in memory at once.
+
+    Args:
+        store (object): The store of the export.
+        cur (cursor): The server-side cursor that ran the query.
+        batch_size (int): The number of rows fetched at once.
+
+    Returns:
+        (list): The tuples (URL, size in bytes, rows) of the files.
+    """
+
+    rows = cur.fetchmany(batch_size)
+    schema = snapshot.get_schema(cur.description[:-2])
+    entries = []
+    partition, sink, writer, count = None, None, None, 0
+
+    def close():
+        writer.close()
+        data = sink.getvalue().to_pybytes()
+        key = partition_key(*partition)
+        store.write(key, data)
+        entries.append((store.url(key), len(data), count))
+
+    while rows:
+        # Splits the batch where the partition changes.
+        while rows:
+            current = tuple(rows[0][-2:])
+            if current != partition:
+                if writer:
+                    close()
+                partition, count = current, 0
+                sink = pyarrow.BufferOutputStream()
+                writer = pyarrow.parquet.ParquetWriter(sink, schema)
+            size = next((i for i, row in enumerate(rows) if tuple(row[-2:]) != partition), len(rows))
+            writer.write_batch(snapshot.get_batch([row[:-2] for row in rows[:size]], schema))
+            count += size
+            rows = rows[size:]
+        rows = cur.fetchmany(batch_size)
+
+    if writer:
+        close()
+    return entries
+
+
+def unload_songplays(first=None, last=None, target=None, batch_size=None):
+
+    """
+    Exports the songplays into Parquet files partitioned by year and month.
+    On Redshift, with a S3 target, the slices unload them in parallel with
+    'UNLOAD'. Otherwise, like with a local directory or a S3 stand-in as
+    target, they're streamed through a server-side cursor and written by
+    the client, with the same layout and manifest.
+
+    Args:
+        first (date): A day of the first month exported, if any.
+        last (date): A day of the last month exported, if any.
+        target (str): The S3 prefix or local directory of the export.
+            Defaults to the setting 'TARGET'.
+        batch_size (int): The number of rows fetched at once by the client.
+            Defaults to the setting 'BATCH_SIZE' of the snapshots.
+    """
+
+    target = target or config.EXPORT_TARGET
+    batch_size = batch_size or config.SNAPSHOT_BATCH_SIZE
+    start, end = get_range(first, last)
+    store = storage.open_store(target)
+    metrics.log('Exporting songplays from {} to {} into {}'.format(
+        start or 'the beginning',
+        end or 'the end',
+        target
+    ))
+
+    # The manifest is rewritten by the export, so the files it lists out
+    # of the range are read first.
+    previous = read_manifest(store)
+
+    conn = database.connect()
+    try:
+        with metrics.stage('unload_songplays') as record, conn:
+            with conn.cursor() as cur:
+                unload = target.startswith('s3://') and metrics.is_redshift(cur)
+                if unload:
+                    store.delete(manifest_key)
+                    cur.execute(sql_queries.songplays_unload(target, start, end))
+                    entries = read_manifest(store)
+
+            if not unload:
+                snapshot.require_pyarrow()
+                with conn.cursor(name='unload_songplays') as cur:
+                    cur.itersize = batch_size
+                    cur.execute(
+                        sql_queries.songplays_export_select(start, end) +
+                        '\n  ORDER BY time.year, time.month;'
+                    )
+                    entries = write_partitions(store, cur, batch_size)
+
+            listed = replace_partitions(store, previous, entries, start, end)
+            record['rows'] = sum(rows for _, _, rows in entries)
+            record['bytes'] = sum(size for _, size, _ in entries)
+            record['files'] = len(entries)
+    finally:
+        conn.close()
+
+    metrics.log(' --> {} rows in {} files, manifest {} listing {} files'.format(
+        record['rows'],
+        record['files'],
+        store.url(manifest_key),
+        len(listed)
+    ))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Exports songplays into Parquet files partitioned by year and month.'
+    )
+    parser.add_argument(
+        '--from',
+        dest='first',
+        type=parse_month,
+        help='the first month exported, like 2018-11'
+    )
+    parser.add_argument(
+        '--to',
+        dest='last',
+        type=parse_month,
+        help='the last month exported, like 2018-11'
+    )
+    parser.add_argument('--target', help='the S3 prefix or local directory of the export')
+    parser.add_argument('--batch-size', type=int, help='the number of rows fetched at once')
+    args = parser.parse_args()
+
+    unload_songplays(args.first, args.last, args.target, args.batch_size)
+    metrics.print_summary()
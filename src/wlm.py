@@ -0,0 +1,59 @@
+import config
+import contextlib
+import metrics
+import sql_queries
+
+
+def get_profile(stage):
+
+    """
+    Gets the session profile of a stage. The batches of a stage, named
+    after it like 'staging_songs:3', share its profile.
+
+    Args:
+        stage (str): The name of the stage.
+
+    Returns:
+        (tuple): The query group, the number of WLM slots and the
+            statement timeout in milliseconds.
+    """
+
+    name = stage.split(':')[0]
+    return sql_queries.session_profiles.get(name, sql_queries.session_profiles['default'])
+
+
+@contextlib.contextmanager
+def session(conn, stage):
+
+    """
+    Sets up the session of a connection with the profile of a stage while
+    it runs, and resets it afterwards, as the connection is reused by the
+    next stages. Does nothing with the setting 'SESSION_PROFILES' off, or
+    on a database other than Redshift.
+
+    Args:
+        conn (connection): A connection not in autocommit mode.
+        stage (str): The name of the stage.
+
+    Yields:
+        (tuple): The profile applied, or None.
+    """
+
+    with conn, conn.cursor() as cur:
+        applied = config.ETL_SESSION_PROFILES and metrics.is_redshift(cur)
+        if applied:
+            profile = get_profile(stage)
+            for query, value in zip(sql_queries.session_profile_set, profile):
+                cur.execute(query.format(value))
+    if not applied:
+        yield None
+        return
+
+    metrics.log(' --> {}: query group \'{}\', slot count {}, statement timeout {}ms'.format(stage, *profile))
+    try:
+        yield profile
+    finally:
+        if not conn.closed:
+            with conn, conn.cursor() as cur:
+                for query in sql_queries.session_profile_reset:
+                    cur.execute(query)
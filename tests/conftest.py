@@ -0,0 +1,49 @@
+import os
+import pytest
+import sys
+
+
+# The scripts live in 'src' and read 'sparkify.cfg' from the working
+# directory, so the tests run from there.
+src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, src)
+os.chdir(src)
+
+
+@pytest.fixture(autouse=True)
+def no_metrics_sink(monkeypatch):
+
+    """
+    Keeps the records of the stages run by the tests out of the sink.
+    """
+
+    import config
+    import metrics
+    monkeypatch.setattr(config, 'METRICS_SINK', 'none')
+    monkeypatch.setattr(metrics, 'records', [])
+
+
+@pytest.fixture
+def conn():
+
+    """
+    Connects to the PostgreSQL database set in 'SPARKIFY_TEST_DSN', in a
+    schema of its own dropped afterwards. Skips the test without one.
+    """
+
+    import psycopg2
+    import uuid
+    dsn = os.environ.get('SPARKIFY_TEST_DSN')
+    if not dsn:
+        pytest.skip('SPARKIFY_TEST_DSN is not set')
+    schema = 'test_{}'.format(uuid.uuid4().hex[:8])
+    connection = psycopg2.connect(dsn, options='-c search_path={}'.format(schema))
+    with connection, connection.cursor() as cur:
+        cur.execute('CREATE SCHEMA {};'.format(schema))
+    try:
+        yield connection
+    finally:
+        connection.rollback()
+        with connection, connection.cursor() as cur:
+            cur.execute('DROP SCHEMA {} CASCADE;'.format(schema))
+        connection.close()
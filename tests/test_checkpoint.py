@@ -0,0 +1,58 @@
+import checkpoint
+import metrics
+import psycopg2
+import pytest
+
+
+def test_run_stage_records_its_completion(conn):
+    with conn, conn.cursor() as cur:
+        checkpoint.prepare(cur, resume=False)
+        cur.execute('CREATE TABLE target (id INTEGER);')
+
+    checkpoint.run_stage(conn, 'target', ['INSERT INTO target VALUES (1), (2);'])
+
+    with conn, conn.cursor() as cur:
+        assert checkpoint.prepare(cur, resume=True) == {'target'}
+        cur.execute('SELECT COUNT(*) FROM target;')
+        assert cur.fetchone()[0] == 2
+    assert metrics.records[-1]['status'] == 'completed'
+    assert metrics.records[-1]['rows'] == 2
+
+
+def test_failed_stage_rolls_back_its_rows_and_checkpoint(conn):
+    with conn, conn.cursor() as cur:
+        checkpoint.prepare(cur, resume=False)
+        cur.execute('CREATE TABLE target (id INTEGER);')
+
+    with pytest.raises(psycopg2.Error):
+        checkpoint.run_stage(conn, 'target', [
+            'INSERT INTO target VALUES (1), (2);',
+            'INSERT INTO missing VALUES (3);'
+        ])
+
+    with conn, conn.cursor() as cur:
+        assert checkpoint.prepare(cur, resume=True) == set()
+        cur.execute('SELECT COUNT(*) FROM target;')
+        assert cur.fetchone()[0] == 0
+    assert metrics.records[-1]['status'] == 'failed'
+
+
+def test_prepare_clears_the_checkpoints_unless_resuming(conn):
+    with conn, conn.cursor() as cur:
+        checkpoint.prepare(cur, resume=False)
+    checkpoint.run_stage(conn, 'stage', [])
+
+    with conn, conn.cursor() as cur:
+        assert checkpoint.prepare(cur, resume=True) == {'stage'}
+        assert checkpoint.prepare(cur, resume=False) == set()
+
+
+def test_days_copied_into_the_staging_tables_stay_completed(conn):
+    with conn, conn.cursor() as cur:
+        checkpoint.prepare(cur, resume=False)
+    checkpoint.run_stage(conn, 'staging_events:2018-11-01', [])
+    checkpoint.run_stage(conn, 'staging_events:1', [])
+    checkpoint.run_stage(conn, 'users', [])
+
+    with conn, conn.cursor() as cur:
+        assert checkpoint.prepare(cur, resume=False) == {'staging_events:2018-11-01'}
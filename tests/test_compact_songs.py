@@ -0,0 +1,74 @@
+import compact_songs
+import gzip
+import json
+import os
+
+
+def write_songs(directory, songs):
+    for key, text in songs.items():
+        path = os.path.join(directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+
+def test_compact_part_writes_every_object(tmp_path):
+    source, target = str(tmp_path / 'songs'), str(tmp_path / 'parts')
+    write_songs(source, {
+        'A/a.json': '{"song_id": "1"}',
+        'A/b.json': '{"song_id": "2"} {"song_id": "3"}\n'
+    })
+
+    assert compact_songs.compact_part(source, target, 1, ['A/a.json', 'A/b.json'])[0] == 3
+    with gzip.open(os.path.join(target, compact_songs.part_key(1))) as f:
+        assert [json.loads(line)['song_id'] for line in f] == ['1', '2', '3']
+
+
+def test_compact_part_skips_existing_part(tmp_path):
+    source, target = str(tmp_path / 'songs'), str(tmp_path / 'parts')
+    write_songs(source, {'A/a.json': '{"song_id": "1"}'})
+    write_songs(target, {compact_songs.part_key(1): 'done'})
+
+    assert compact_songs.compact_part(source, target, 1, ['A/a.json']) is None
+    with open(os.path.join(target, compact_songs.part_key(1))) as f:
+        assert f.read() == 'done'
+
+
+def read_parts(target):
+    songs = {}
+    for key in sorted(os.listdir(target)):
+        if key.startswith('part-'):
+            with gzip.open(os.path.join(target, key)) as f:
+                songs[key] = sorted(json.loads(line)['song_id'] for line in f)
+    return songs
+
+
+def test_resumed_run_compacts_missing_parts_and_new_files(tmp_path):
+    source, target = str(tmp_path / 'songs'), str(tmp_path / 'parts')
+    write_songs(source, {'A/{}.json'.format(n): '{{"song_id": "{}"}}'.format(n) for n in range(6)})
+
+    compact_songs.compact_songs(source, target, parts=3, workers=1)
+    first = read_parts(target)
+    os.remove(os.path.join(target, compact_songs.part_key(2)))
+    write_songs(source, {'B/new.json': '{"song_id": "new"}'})
+    compact_songs.compact_songs(source, target, parts=3, workers=1)
+
+    # The parts of the first plan are kept, and the new file gets its own.
+    parts = read_parts(target)
+    assert {key: parts[key] for key in first} == first
+    assert parts[compact_songs.part_key(4)] == ['new']
+    assert sorted(sum(parts.values(), [])) == sorted([str(n) for n in range(6)] + ['new'])
+
+
+def test_modified_song_file_makes_a_new_plan(tmp_path):
+    source, target = str(tmp_path / 'songs'), str(tmp_path / 'parts')
+    write_songs(source, {'A/{}.json'.format(n): '{{"song_id": "{}"}}'.format(n) for n in range(6)})
+    compact_songs.compact_songs(source, target, parts=3, workers=1)
+
+    os.remove(os.path.join(source, 'A/5.json'))
+    write_songs(source, {'A/0.json': '{"song_id": "0"} {"song_id": "changed"}'})
+    compact_songs.compact_songs(source, target, parts=2, workers=1)
+
+    parts = read_parts(target)
+    assert sorted(parts) == [compact_songs.part_key(1), compact_songs.part_key(2)]
+    assert sorted(sum(parts.values(), [])) == ['0', '1', '2', '3', '4', 'changed']
@@ -0,0 +1,102 @@
+import asyncio
+import checkpoint
+import copy_monitor
+import database
+import pytest
+import threading
+import time
+
+
+class FakeConnection:
+
+    """
+    Stands in for both the connection running the COPY and the monitoring
+    one, recording the queries run through its cursors.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.cancelled = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def get_backend_pid(self):
+        return 42
+
+    def set_session(self, autocommit):
+        pass
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, vars=None):
+        self.queries.append((query, vars))
+        if query == copy_monitor.cancel_backend:
+            self.cancelled.set()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = FakeConnection()
+    monkeypatch.setattr(database, 'connect', lambda dsn=None: connection)
+    return connection
+
+
+def run_stage_for(seconds):
+
+    """
+    Generates a stage running for the given seconds, or until cancelled.
+    """
+
+    def run_stage(conn, stage, queries):
+        if conn.cancelled.wait(seconds):
+            raise RuntimeError('canceling statement due to user request')
+        return stage
+
+    return run_stage
+
+
+def monitor(conn, samples, stall_timeout):
+    samples = iter(samples)
+    return asyncio.run(copy_monitor.monitor_copy(
+        conn, 'staging_songs:1', 'COPY', None, lambda cur, pid: next(samples, None), 0.01, stall_timeout
+    ))
+
+
+def test_queued_copy_is_never_cancelled(connection, monkeypatch):
+    monkeypatch.setattr(checkpoint, 'run_stage', run_stage_for(0.3))
+
+    assert monitor(connection, [], 0.05) == 'staging_songs:1'
+    assert connection.queries == []
+
+
+def test_stalled_copy_is_cancelled_after_the_stall_timeout(connection, monkeypatch):
+    monkeypatch.setattr(checkpoint, 'run_stage', run_stage_for(5))
+    start = time.time()
+
+    # The COPY is queued first, then stops moving once started.
+    with pytest.raises(RuntimeError):
+        monitor(connection, [None] * 20 + [(10, 100, 1)] * 1000, 0.1)
+
+    assert connection.queries == [(copy_monitor.cancel_backend, (42,))]
+    assert 0.3 <= time.time() - start < 5
+
+
+def test_moving_copy_is_not_cancelled(connection, monkeypatch):
+    monkeypatch.setattr(checkpoint, 'run_stage', run_stage_for(0.3))
+
+    assert monitor(connection, [(n, 1000, n) for n in range(1000)], 0.05) == 'staging_songs:1'
+    assert connection.queries == []
+
+
+def test_format_progress_reports_the_rates_and_the_eta():
+    assert copy_monitor.format_progress('staging_songs:1', (2048, 4096, 20), (1024, 4096, 10), 2, 1) == (
+        ' --> staging_songs:1: 2.0 KB loaded, 1.0 KB/s, 10 rows/s, 50% of 4.0 KB, ETA 2s'
+    )
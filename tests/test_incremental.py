@@ -0,0 +1,20 @@
+import datetime
+import incremental
+import storage
+
+
+def test_get_ts_range_reads_the_file_own_range(tmp_path):
+    store = storage.open_store(str(tmp_path))
+    store.write('2018/11/2018-11-02-events.json', b'\n'.join([
+        b'{"ts": 1541116800000, "page": "Home"}',
+        b'',
+        b'{"ts": 1541120400500, "page": "NextSong"}',
+        b'{"page": "Logout"}'
+    ]))
+    store.write('2018/11/2018-11-03-events.json', b'{"page": "Home"}\n')
+
+    assert incremental.get_ts_range(store, '2018/11/2018-11-02-events.json') == (
+        datetime.datetime(2018, 11, 2, 0, 0),
+        datetime.datetime(2018, 11, 2, 1, 0, 0, 500000)
+    )
+    assert incremental.get_ts_range(store, '2018/11/2018-11-03-events.json') == (None, None)
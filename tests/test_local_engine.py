@@ -0,0 +1,162 @@
+import config
+import database
+import datetime
+import gzip
+import json
+import local_engine
+import metrics
+import pytest
+
+from benchmarks import generator
+
+
+def test_read_rows_applies_the_jsonpaths_and_the_time_format(tmp_path):
+    path = tmp_path / 'events.json'
+    path.write_text('\n'.join(json.dumps(event) for event in [
+        {'artist': 'A', 'gender': 'Female', 'registration': 1540210333708.0, 'ts': 1541105830796},
+        {'artist': ' ', 'gender': 'M', 'registration': None, 'ts': None}
+    ]))
+    columns = [('artist', 'VARCHAR'), ('gender', 'VARCHAR(1)'), ('registration', 'BIGINT'), ('ts', 'TIMESTAMP')]
+
+    rows = local_engine.read_rows(str(path), False, ['artist', 'gender', 'registration', 'ts'], columns, True)
+
+    assert rows == [
+        ['A', 'F', 1540210333708, datetime.datetime(2018, 11, 1, 20, 57, 10, 796000)],
+        [None, 'M', None, None]
+    ]
+
+
+def test_read_rows_matches_the_gzipped_objects_by_name(tmp_path):
+    path = tmp_path / 'users.json.gz'
+    with gzip.open(str(path), 'wt') as f:
+        f.write(json.dumps({'userId': 7, 'LEVEL': 'paid'}) + '\n')
+    columns = [('userid', 'INTEGER'), ('firstname', 'VARCHAR'), ('level', 'VARCHAR')]
+
+    assert local_engine.read_rows(str(path), True, None, columns, True) == [[7, None, 'paid']]
+
+
+def test_list_sources_reads_a_prefix_like_s3(tmp_path, monkeypatch):
+    for key in ['song_data/A/A/1.json', 'song_data/A/B/2.json', 'song_data/AB/3.json', 'song_data/B/4.json']:
+        (tmp_path / key).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / key).write_text('{}')
+    monkeypatch.setattr(local_engine, 'locations', {'s3://bucket/song-data': str(tmp_path / 'song_data')})
+
+    assert local_engine.list_sources('s3://bucket/song-data/A', False) == [
+        str(tmp_path / 'song_data/A/A/1.json'),
+        str(tmp_path / 'song_data/A/B/2.json'),
+        str(tmp_path / 'song_data/AB/3.json')
+    ]
+
+
+def test_list_sources_reads_the_entries_of_a_manifest(tmp_path, monkeypatch):
+    manifest = tmp_path / 'batch.manifest'
+    manifest.write_text(json.dumps({'entries': [
+        {'url': 's3://bucket/song-data/B/4.json', 'mandatory': True},
+        {'url': str(tmp_path / '1.json'), 'mandatory': True}
+    ]}))
+    monkeypatch.setattr(local_engine, 'locations', {'s3://bucket/song-data': str(tmp_path / 'song_data')})
+
+    assert local_engine.list_sources(str(manifest), True) == [
+        str(tmp_path / 'song_data/B/4.json'),
+        str(tmp_path / '1.json')
+    ]
+
+
+@pytest.fixture
+def local_settings(monkeypatch):
+
+    """
+    Restores the settings and the connections changed by the local engine.
+    """
+
+    for name in [
+        'SPARKIFYDB_DSN', 'S3_LOG_DATA', 'S3_LOG_JSON_PATH', 'S3_SONG_DATA', 'S3_SONG_DATA_COMPACTED',
+        'S3_LOG_DATA_SPLIT', 'S3_MANIFESTS'
+    ]:
+        monkeypatch.setattr(config, name, getattr(config, name))
+    monkeypatch.setattr(database, 'cursor_factory', None)
+    monkeypatch.setattr(local_engine, 'locations', {})
+    monkeypatch.setattr(metrics, 'redshift', None)
+
+
+def count_rows(conn, tables):
+    with conn, conn.cursor() as cur:
+        counts = {}
+        for table in tables:
+            cur.execute('SELECT COUNT(*) FROM {};'.format(table))
+            counts[table] = cur.fetchone()[0]
+        return counts
+
+
+@pytest.mark.parametrize('split_events', [False, True])
+def test_run_locally_loads_the_dataset_through_the_etl(conn, tmp_path, monkeypatch, local_settings, split_events):
+    data = tmp_path / 'data'
+    generator.generate(str(data), 0.002, 7)
+    monkeypatch.setattr(config, 'ETL_SPLIT_EVENTS', split_events)
+
+    local_engine.run_locally(conn.dsn, str(data), 2)
+
+    events = [
+        json.loads(line)
+        for path in sorted((data / 'log_data').rglob('*.json'))
+        for line in path.read_text().splitlines()
+        if line.strip()
+    ]
+    plays = [event for event in events if event['page'] == 'NextSong']
+    with conn, conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM staging_songs;')
+        assert cur.fetchone()[0] == len(list((data / 'song_data').rglob('*.json')))
+        cur.execute('SELECT COUNT(*) FROM songplays;')
+        assert cur.fetchone()[0] == len(plays)
+        cur.execute('SELECT COUNT(DISTINCT user_id) FROM users;')
+        assert cur.fetchone()[0] == len({event['userId'] for event in events if event['userId']})
+        cur.execute('SELECT COUNT(*) FROM etl_checkpoints WHERE stage = \'songplays\';')
+        assert cur.fetchone()[0] == 1
+
+
+def test_ranged_load_merges_into_the_loaded_tables(conn, tmp_path, local_settings):
+    data = tmp_path / 'data'
+    generator.generate(str(data), 0.002, 7)
+    tables = ['songs', 'artists', 'time', 'users', 'songplays', 'daily_plays_by_song']
+    local_engine.run_locally(conn.dsn, str(data), 2)
+    loaded = count_rows(conn, tables)
+
+    for _ in range(2):
+        local_engine.run_locally(
+            conn.dsn, str(data), 2, first=datetime.date(2018, 11, 1), last=datetime.date(2018, 11, 30)
+        )
+        assert count_rows(conn, tables) == loaded
+
+
+def test_incremental_load_runs_on_a_fresh_database(conn, tmp_path, local_settings):
+    data = tmp_path / 'data'
+    generator.generate(str(data), 0.002, 7)
+
+    local_engine.run_locally(conn.dsn, str(data), 2, incremental_load=True)
+
+    assert [record['status'] for record in metrics.records if record['stage'] == 'analyze'] == ['completed']
+    assert count_rows(conn, ['songplays'])['songplays'] > 0
+
+
+def test_incremental_load_matches_the_plays_like_a_full_load(conn, tmp_path, local_settings):
+    data = tmp_path / 'data'
+    generator.generate(str(data), 0.002, 7)
+    paths = sorted((data / 'log_data').rglob('*.json'))
+    events = [json.loads(line) for line in paths[0].read_text().splitlines() if line.strip()]
+    for event in events:
+        if event['page'] == 'NextSong':
+            event['song'] = ' {} '.format(event['song'].upper())
+    paths[0].write_text('\n'.join(json.dumps(event) for event in events))
+    later = paths[-1].read_text()
+    paths[-1].unlink()
+
+    # The log file added afterwards only matches songs loaded by the first run.
+    local_engine.run_locally(conn.dsn, str(data), 2, incremental_load=True)
+    paths[-1].write_text(later)
+    local_engine.run_locally(conn.dsn, str(data), 2, incremental_load=True)
+
+    plays = [
+        event for path in paths for event in map(json.loads, path.read_text().splitlines())
+        if event['page'] == 'NextSong'
+    ]
+    assert count_rows(conn, ['songplays'])['songplays'] == len(plays)
@@ -0,0 +1,30 @@
+import maintenance
+
+
+# The rows of 'SVV_TABLE_INFO': (table, size in MB, rows, visible rows,
+# unsorted %, stats off %).
+rows = [
+    ('songplays', 1000, 100, 70, 40.0, 5.0),
+    ('songs', 200, 100, 100, 50.0, 0.0),
+    ('artists', 100, 100, 60, 0.0, 0.0),
+    ('users', 10, 100, 100, None, 80.0),
+    ('time', 500, 0, 0, 5.0, 30.0)
+]
+
+
+def test_plan_maintenance_orders_the_vacuums_then_the_analyzes_by_benefit():
+    assert maintenance.plan_maintenance(rows, 20, 10, 10) == [
+        ('songplays', 'full', 400.0),
+        ('songs', 'sort', 100.0),
+        ('artists', 'delete', 40.0),
+        ('time', 'analyze', 150.0),
+        ('users', 'analyze', 8.0)
+    ]
+
+
+def test_plan_maintenance_only_runs_the_operations_above_the_thresholds():
+    assert maintenance.plan_maintenance(rows, 40, 80, 30) == [
+        ('songs', 'sort', 100.0),
+        ('artists', 'delete', 40.0)
+    ]
+    assert maintenance.plan_maintenance(rows, 100, 100, 100) == []
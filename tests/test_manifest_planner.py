@@ -0,0 +1,52 @@
+import json
+import manifest_planner
+import storage
+
+
+def test_balance_deals_largest_first_in_snake_order():
+    objects = [('f', 1), ('e', 5), ('d', 10), ('c', 80), ('b', 90), ('a', 100)]
+    batches = manifest_planner.balance(objects, [3, 3])
+    assert batches == [
+        [('a', 100), ('d', 10), ('e', 5)],
+        [('b', 90), ('c', 80), ('f', 1)]
+    ]
+
+
+def test_balance_skips_full_batches():
+    objects = [(str(n), n) for n in range(5)]
+    batches = manifest_planner.balance(objects, [1, 4])
+    assert [len(b) for b in batches] == [1, 4]
+    assert batches[0] == [('4', 4)]
+
+
+def test_plan_batches_are_multiples_of_slices():
+    objects = [('{:03d}'.format(n), n) for n in range(37)]
+    batches = manifest_planner.plan(objects, batches=3, slices=8)
+    assert [len(b) for b in batches] == [16, 8, 13]
+    assert sorted(o for b in batches for o in b) == objects
+
+
+def test_plan_fewer_objects_than_slices():
+    objects = [('a', 1), ('b', 2), ('c', 3)]
+    assert manifest_planner.plan(objects, batches=4, slices=8) == [objects]
+
+
+def test_write_manifests_lists_the_json_objects_of_the_source(tmp_path):
+    source, target = tmp_path / 'song_data', tmp_path / 'manifests'
+    for key, content in [('A/a.json', '{}'), ('A/b.json', '{"a": 1}'), ('B/c.json', '[]'), ('B/d.txt', 'x')]:
+        (source / key).parent.mkdir(parents=True, exist_ok=True)
+        (source / key).write_text(content)
+    store = storage.LocalStore(str(target))
+
+    urls = manifest_planner.write_manifests(str(source), str(target), 'songs', batches=2, slices=1)
+
+    assert urls == [store.url('songs-0001.manifest'), store.url('songs-0002.manifest')]
+    entries = [
+        entry for key in ['songs-0001.manifest', 'songs-0002.manifest']
+        for entry in json.loads(store.read(key))['entries']
+    ]
+    assert sorted((e['url'], e['mandatory'], e['meta']['content_length']) for e in entries) == [
+        (str(source / 'A/a.json'), True, 2),
+        (str(source / 'A/b.json'), True, 8),
+        (str(source / 'B/c.json'), True, 2)
+    ]
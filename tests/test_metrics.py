@@ -0,0 +1,64 @@
+import config
+import json
+import metrics
+import pytest
+
+
+class FakeCursor:
+
+    """
+    Serves a canned row count, outside of Redshift.
+    """
+
+    rowcount = 7
+
+
+@pytest.fixture
+def sink(monkeypatch, tmp_path):
+
+    """
+    Points the sink at a temporary file, outside of Redshift.
+    """
+
+    path = tmp_path / 'metrics'
+    monkeypatch.setattr(config, 'METRICS_PATH', str(path))
+    monkeypatch.setattr(metrics, 'redshift', False)
+    return path
+
+
+def test_stage_writes_a_json_line_per_stage(sink, monkeypatch):
+    monkeypatch.setattr(config, 'METRICS_SINK', 'jsonl')
+
+    with metrics.stage('songs') as record:
+        record.measure(FakeCursor())
+        record.measure(FakeCursor())
+    with pytest.raises(ValueError), metrics.stage('songplays'):
+        raise ValueError('failed stage')
+
+    lines = [json.loads(line) for line in sink.read_text().splitlines()]
+    assert [(line['stage'], line['status'], line['rows']) for line in lines] == [
+        ('songs', 'completed', 14),
+        ('songplays', 'failed', 0)
+    ]
+    assert lines == metrics.records
+    assert all(line['seconds'] is not None and line['end'] for line in lines)
+
+
+def test_flush_writes_the_gauges_of_the_stages(sink, monkeypatch):
+    monkeypatch.setattr(config, 'METRICS_SINK', 'prometheus')
+    with metrics.stage('songs') as record:
+        record.measure(FakeCursor())
+        record['files'] = 2
+
+    metrics.flush()
+
+    lines = sink.read_text().splitlines()
+    assert lines[:2] == [
+        '# HELP sparkify_etl_stage_duration_seconds Duration of the stage.',
+        '# TYPE sparkify_etl_stage_duration_seconds gauge'
+    ]
+    assert 'sparkify_etl_stage_rows{stage="songs",status="completed"} 7' in lines
+    assert 'sparkify_etl_stage_files_loaded{stage="songs",status="completed"} 2' in lines
+
+    # The measures not taken outside of Redshift have no sample.
+    assert not [line for line in lines if line.startswith('sparkify_etl_stage_bytes_scanned')]
@@ -0,0 +1,105 @@
+import migrations
+
+
+# A table referencing 'time', a keyword quoted by the catalog.
+ddl = """
+    CREATE TABLE IF NOT EXISTS plays (
+           play_id INTEGER
+                   IDENTITY(0, 1)
+                   PRIMARY KEY,
+        start_time TIMESTAMP
+                   NOT NULL
+                   REFERENCES time(start_time),
+           song_id VARCHAR(1024)
+                   NOT NULL
+                   DISTKEY
+                   SORTKEY,
+          location VARCHAR
+    )
+    DISTSTYLE KEY;
+"""
+
+
+class FakeCursor:
+
+    """
+    Serves canned rows of the catalog queries.
+    """
+
+    def __init__(self, results):
+        self.results = results
+        self.rows = []
+
+    def execute(self, query):
+        self.rows = self.results[query]
+
+    def fetchall(self):
+        return self.rows
+
+
+def catalog(constraints, song_id_type='character varying(1024)'):
+    return {
+        migrations.columns_select: [
+            ('plays', 'play_id', 'integer', True),
+            ('plays', 'start_time', 'timestamp without time zone', True),
+            ('plays', 'song_id', song_id_type, True),
+            ('plays', 'location', 'character varying(256)', False)
+        ],
+        migrations.constraints_select: [('plays', definition) for definition in constraints],
+        migrations.column_keys_select: [
+            ('plays', 'play_id', 'az64', False, 0),
+            ('plays', 'start_time', 'az64', False, 0),
+            ('plays', 'song_id', 'lzo', True, 1),
+            ('plays', 'location', 'lzo', False, 0)
+        ],
+        migrations.diststyles_select: [('plays', 1)]
+    }
+
+
+def test_parse_table_describes_the_declared_table():
+    table = migrations.parse_table(ddl)
+
+    assert table['columns']['play_id'] == {'type': 'INTEGER', 'not_null': True, 'identity': True, 'encoding': None}
+    assert table['columns']['location']['not_null'] is False
+    assert table['primary_key'] == ['play_id']
+    assert table['foreign_keys'] == {'start_time': ('time', 'start_time')}
+    assert (table['diststyle'], table['distkey'], table['sortkey']) == ('KEY', 'song_id', ['song_id'])
+
+
+def test_get_live_reads_the_quoted_identifiers():
+    live = migrations.get_live(FakeCursor(catalog([
+        'PRIMARY KEY ("play_id")',
+        'FOREIGN KEY (start_time) REFERENCES "time"(start_time)'
+    ])), redshift=True)['plays']
+
+    assert live['primary_key'] == ['play_id']
+    assert live['foreign_keys'] == {'start_time': ('time', 'start_time')}
+    assert (live['diststyle'], live['distkey'], live['sortkey']) == ('KEY', 'song_id', ['song_id'])
+    assert live['columns']['song_id']['encoding'] == 'lzo'
+
+
+def test_plan_table_leaves_an_unchanged_table_alone():
+    live = migrations.get_live(FakeCursor(catalog([
+        'PRIMARY KEY (play_id)',
+        'FOREIGN KEY (start_time) REFERENCES public."time"(start_time)'
+    ])), redshift=True)
+
+    assert migrations.plan_table('plays', migrations.parse_table(ddl), live['plays'], True) == (None, [])
+
+
+def test_plan_table_picks_the_cheapest_operation():
+    desired = migrations.parse_table(ddl)
+    narrow = catalog(['PRIMARY KEY (play_id)'], song_id_type='character varying(256)')
+    live = migrations.get_live(FakeCursor(narrow), redshift=True)['plays']
+
+    assert migrations.plan_table('plays', desired, None, True) == ('create', [])
+    assert migrations.plan_table('plays', desired, live, True) == (
+        'deep_copy',
+        [('foreign_keys', 'start_time', None), ('alter_type', 'song_id', 'VARCHAR(1024)')]
+    )
+    assert migrations.plan_table('staging_plays', desired, live, True)[0] == 'recreate'
+    live['foreign_keys'] = {'start_time': ('time', 'start_time')}
+    assert migrations.plan_table('plays', desired, live, True) == (
+        'alter',
+        [('alter_type', 'song_id', 'VARCHAR(1024)')]
+    )
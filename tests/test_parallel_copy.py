@@ -0,0 +1,86 @@
+import config
+import copy_monitor
+import database
+import parallel_copy
+import pytest
+import threading
+import time
+
+
+class FakeConnection:
+
+    """
+    Stands in for the connection of a worker, recording whether it's
+    closed.
+    """
+
+    def __init__(self):
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return self
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connections(monkeypatch):
+
+    """
+    Gives the workers fake connections, without session profiles, and
+    lists them.
+    """
+
+    connections = []
+
+    def connect(dsn=None):
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(database, 'connect', connect)
+    monkeypatch.setattr(config, 'ETL_SESSION_PROFILES', False)
+    return connections
+
+
+def test_run_copies_bounds_the_copies_running_at_once(connections, monkeypatch):
+    running, peak = [], []
+    lock = threading.Lock()
+
+    def run_copy(conn, stage, query):
+        with lock:
+            running.append(stage)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(stage)
+
+    monkeypatch.setattr(copy_monitor, 'run_copy', run_copy)
+    batches = [('staging_songs:{}'.format(n), 'COPY') for n in range(1, 7)]
+
+    results = parallel_copy.run_copies(batches, workers=4, max_concurrent=2)
+
+    assert [stage for stage, _ in results] == [stage for stage, _ in batches]
+    assert max(peak) == 2
+    assert 1 <= len(connections) <= 4
+    assert all(conn.closed for conn in connections)
+
+
+def test_run_copies_raises_the_error_of_a_failed_copy(connections, monkeypatch):
+    def run_copy(conn, stage, query):
+        if stage == 'staging_songs:2':
+            raise RuntimeError('S3 object not found')
+
+    monkeypatch.setattr(copy_monitor, 'run_copy', run_copy)
+    batches = [('staging_songs:{}'.format(n), 'COPY') for n in range(1, 4)]
+
+    with pytest.raises(RuntimeError, match='S3 object not found'):
+        parallel_copy.run_copies(batches, workers=2, max_concurrent=2)
+
+    assert all(conn.closed for conn in connections)
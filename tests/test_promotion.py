@@ -0,0 +1,100 @@
+import checkpoint
+import metrics
+import promotion
+import pytest
+import sql_queries
+
+
+class FakeConnection:
+
+    """
+    Records the queries run through its cursors, and serves the foreign
+    keys referencing the table and whether its shadow exists.
+    """
+
+    def __init__(self, shadow=True):
+        self.queries = []
+        self.shadow = shadow
+        self.rowcount = 0
+        self.foreign_keys = [('songplays', 'songplays_song_id_fkey', 'FOREIGN KEY (song_id) REFERENCES songs')]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_session(self, autocommit):
+        pass
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, vars=None):
+        self.queries.append(query)
+
+    def fetchone(self):
+        return (int(self.shadow),) if self.queries[-1] == sql_queries.shadow_table_exists else (0, 0, 0)
+
+    def fetchall(self):
+        return self.foreign_keys
+
+
+@pytest.fixture
+def stages(monkeypatch):
+
+    """
+    Lists the stages run, with their queries, instead of running them.
+    """
+
+    stages = []
+    monkeypatch.setattr(checkpoint, 'run_stage', lambda conn, stage, queries: stages.append((stage, queries)))
+    return stages
+
+
+def test_promote_swaps_the_shadow_of_a_dimension_in(stages, monkeypatch):
+    monkeypatch.setattr(metrics, 'redshift', True)
+
+    promotion.promote(FakeConnection(), set(), 'songs')
+
+    assert stages == [('songs', promotion.get_shadow_queries('songs') + [
+        'ALTER TABLE songs RENAME TO songs_old;',
+        'ALTER TABLE songs_shadow RENAME TO songs;',
+        'DROP TABLE songs_old CASCADE;',
+        'ALTER TABLE songplays ADD CONSTRAINT songplays_song_id_fkey FOREIGN KEY (song_id) REFERENCES songs;'
+    ])]
+
+
+def test_promote_appends_the_shadow_of_songplays_on_redshift(stages, monkeypatch):
+    monkeypatch.setattr(metrics, 'redshift', True)
+    conn = FakeConnection()
+
+    promotion.promote(conn, set(), 'songplays')
+
+    assert stages == [('songplays:shadow', promotion.get_shadow_queries('songplays')), ('songplays', [])]
+    assert sql_queries.table_append.format('songplays') in conn.queries
+    assert conn.queries[-1] == sql_queries.shadow_table_drop.format('songplays')
+
+
+def test_promote_skips_the_append_already_done(stages, monkeypatch):
+    monkeypatch.setattr(metrics, 'redshift', True)
+    conn = FakeConnection(shadow=False)
+
+    # The run failed after the append, before recording the stage.
+    promotion.promote(conn, {'songplays:shadow'}, 'songplays')
+
+    assert stages == [('songplays', [])]
+    assert sql_queries.table_append.format('songplays') not in conn.queries
+
+
+def test_promote_swaps_songplays_off_redshift(stages, monkeypatch):
+    monkeypatch.setattr(metrics, 'redshift', False)
+    conn = FakeConnection()
+    conn.foreign_keys = []
+
+    promotion.promote(conn, set(), 'songplays')
+
+    assert stages == [('songplays', promotion.get_shadow_queries('songplays') + [
+        query.format('songplays') for query in sql_queries.table_swap
+    ])]
+    assert sql_queries.table_append.format('songplays') not in conn.queries
@@ -0,0 +1,82 @@
+import datetime
+import local_engine
+import os
+import pytest
+import query_api
+import sql_queries
+
+
+def test_cache_evicts_the_least_recently_used_entry():
+    cache = query_api.ResultCache(2)
+    cache.set_version('v1')
+    cache.put('v1', 'a', [1])
+    cache.put('v1', 'b', [2])
+    cache.get('v1', 'a')
+    cache.put('v1', 'c', [3])
+
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.get('v1', 'b') == (False, None)
+
+
+def test_cache_reads_the_entries_kept_on_disk(tmp_path):
+    cache = query_api.ResultCache(1, str(tmp_path))
+    cache.set_version('v1')
+    cache.put('v1', 'a', [1])
+    cache.put('v1', 'b', [2])
+
+    # A new cache, like the one of a restarted process, finds both.
+    cache = query_api.ResultCache(1, str(tmp_path))
+    assert cache.get('v1', 'a') == (True, [1])
+    assert cache.get('v1', 'b') == (True, [2])
+    assert (cache.hits, cache.misses) == (2, 0)
+
+
+def test_cache_drops_the_entries_of_the_previous_version(tmp_path):
+    cache = query_api.ResultCache(2, str(tmp_path))
+    cache.set_version('v1')
+    cache.put('v1', 'a', [1])
+
+    assert cache.get('v2', 'a') == (False, None)
+    assert cache.entries == {}
+    assert not os.path.exists(str(tmp_path / 'v1'))
+
+    # A result of the previous version computed meanwhile isn't kept.
+    cache.put('v1', 'b', [2])
+    assert cache.entries == {}
+
+
+@pytest.fixture
+def api(conn, tmp_path):
+
+    """
+    Serves the queries of a database with a data version, caching their
+    results on disk.
+    """
+
+    with conn, conn.cursor() as cur:
+        cur.execute(local_engine.translate(sql_queries.data_version_table_create))
+        cur.execute(sql_queries.data_version_insert, (datetime.datetime(2018, 12, 1),))
+    api = query_api.QueryAPI(conn.dsn, 2, 10, str(tmp_path))
+    yield api
+    api.close()
+
+
+def test_query_counts_the_hits_and_misses(api):
+    assert api.query('SELECT %(n)s + 1;', {'n': 1}) == [(2,)]
+    assert api.query('SELECT %(n)s + 1;', {'n': 1}) == [(2,)]
+    assert api.query('SELECT %(n)s + 1;', {'n': 2}) == [(3,)]
+
+    assert api.stats() == {'hits': 1, 'misses': 2, 'entries': 2}
+
+
+def test_query_runs_again_once_a_load_moves_the_data_version(api, conn):
+    assert api.query('SELECT COUNT(*) FROM data_version;') == [(1,)]
+    with conn, conn.cursor() as cur:
+        cur.execute(sql_queries.data_version_insert, (datetime.datetime(2018, 12, 2),))
+
+    assert api.query('SELECT COUNT(*) FROM data_version;') == [(2,)]
+    assert api.stats() == {'hits': 0, 'misses': 2, 'entries': 1}
+
+
+def test_query_reads_the_version_and_the_result_in_one_snapshot(api):
+    assert api.query('SHOW transaction_isolation;') == [('repeatable read',)]
@@ -0,0 +1,57 @@
+import local_engine
+import rollups
+import sql_queries
+
+
+def create_tables(cur):
+    for table in ['staging_events', 'songplays'] + sql_queries.rollup_tables:
+        cur.execute(local_engine.translate(getattr(sql_queries, '{}_table_create'.format(table))))
+
+
+def stage_plays(cur, plays):
+    cur.execute('TRUNCATE staging_events;')
+    cur.executemany(
+        "INSERT INTO staging_events (ts, userId, sessionId, level, page) VALUES (%s, %s, 1, %s, 'NextSong');",
+        plays
+    )
+    cur.execute("""
+        DELETE FROM songplays
+              USING staging_events
+              WHERE songplays.start_time = staging_events.ts
+                AND songplays.user_id = staging_events.userId;
+        INSERT INTO songplays (start_time, user_id, user_key, level, song_id, artist_id, session_id, location,
+                               user_agent)
+             SELECT ts, userId, 0, level, 'S1', 'A1', sessionId, '', ''
+               FROM staging_events;
+    """)
+    for query in sql_queries.rollups_update:
+        cur.execute(local_engine.translate(query))
+
+
+def test_rollups_update_recomputes_the_days_of_reloaded_plays(conn):
+    with conn, conn.cursor() as cur:
+        create_tables(cur)
+        stage_plays(cur, [
+            ('2018-11-01 10:00', 1, 'free'),
+            ('2018-11-01 11:00', 2, 'free'),
+            ('2018-11-02 10:00', 1, 'paid')
+        ])
+        # A reload of the first day deletes and inserts its plays again,
+        # under new ids, along with a new one.
+        stage_plays(cur, [
+            ('2018-11-01 10:00', 1, 'free'),
+            ('2018-11-01 12:00', 1, 'free')
+        ])
+
+        assert rollups.check_rollups(cur) == {
+            'daily_plays_by_song': 0,
+            'daily_active_users_by_level': 0,
+            'hourly_plays': 0
+        }
+        cur.execute('SELECT day, plays FROM daily_plays_by_song ORDER BY day;')
+        assert [(str(day), plays) for day, plays in cur.fetchall()] == [('2018-11-01', 3), ('2018-11-02', 1)]
+        cur.execute('SELECT day, level, users FROM daily_active_users_by_level ORDER BY day;')
+        assert [(str(day), level, users) for day, level, users in cur.fetchall()] == [
+            ('2018-11-01', 'free', 2),
+            ('2018-11-02', 'paid', 1)
+        ]
@@ -0,0 +1,118 @@
+import config
+import database
+import pytest
+import scheduler
+import threading
+import time
+
+
+class FakePool:
+
+    """
+    Hands out fake connections, recording whether it's closed.
+    """
+
+    def __init__(self):
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return self
+
+    def getconn(self):
+        return self
+
+    def putconn(self, conn):
+        pass
+
+    def closeall(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(database, 'create_pool', lambda size, dsn=None: pool)
+    monkeypatch.setattr(config, 'ETL_SESSION_PROFILES', False)
+    return pool
+
+
+def make_stages(events, failing=None):
+
+    """
+    Makes the stages of a small ETL, recording when they start and end.
+    """
+
+    lock = threading.Lock()
+
+    def run(name):
+        def run_stage(conn):
+            with lock:
+                events.append(('start', name))
+            time.sleep(0.05)
+            if name == failing:
+                raise RuntimeError('{} failed'.format(name))
+            with lock:
+                events.append(('end', name))
+        return run_stage
+
+    return [
+        scheduler.Stage('songplays', ['users', 'songs'], ['songplays'], run('songplays')),
+        scheduler.Stage('users', ['staging_events'], ['users'], run('users')),
+        scheduler.Stage('songs', ['staging_songs'], ['songs'], run('songs')),
+        scheduler.Stage('staging_events', [], ['staging_events'], run('staging_events')),
+        scheduler.Stage('staging_songs', [], ['staging_songs'], run('staging_songs'))
+    ]
+
+
+def test_sort_stages_puts_the_dependencies_first():
+    assert [stage.name for stage in scheduler.sort_stages(make_stages([]))] == [
+        'staging_events', 'users', 'staging_songs', 'songs', 'songplays'
+    ]
+
+
+def test_sort_stages_detects_a_cycle():
+    stages = [
+        scheduler.Stage('a', ['b'], ['a'], None),
+        scheduler.Stage('b', ['a'], ['b'], None)
+    ]
+    with pytest.raises(ValueError):
+        scheduler.sort_stages(stages)
+
+
+def test_run_stages_starts_a_stage_once_its_dependencies_end(pool):
+    events = []
+
+    durations = scheduler.run_stages(make_stages(events), workers=2)
+
+    assert set(durations) == {'staging_events', 'staging_songs', 'users', 'songs', 'songplays'}
+    for name, dependencies in [('users', ['staging_events']), ('songs', ['staging_songs']),
+                               ('songplays', ['users', 'songs'])]:
+        for dependency in dependencies:
+            assert events.index(('end', dependency)) < events.index(('start', name))
+
+    # The copies don't depend on each other, so they run at once.
+    assert events[:2] == [('start', 'staging_events'), ('start', 'staging_songs')]
+    assert pool.closed
+
+
+def test_run_stages_raises_the_error_of_a_failed_stage(pool):
+    events = []
+
+    with pytest.raises(RuntimeError, match='songs failed'):
+        scheduler.run_stages(make_stages(events, failing='songs'), workers=2)
+
+    assert ('start', 'songplays') not in events
+    assert pool.closed
+
+
+def test_get_critical_path_follows_the_longest_chain():
+    stages = scheduler.sort_stages(make_stages([]))
+    durations = {'staging_events': 1, 'staging_songs': 5, 'users': 1, 'songs': 2, 'songplays': 3}
+
+    assert scheduler.get_critical_path(stages, durations) == (['staging_songs', 'songs', 'songplays'], 10)
@@ -0,0 +1,55 @@
+import config
+import datetime
+import local_engine
+import pytest
+import snapshot
+import sql_queries
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def dimensions(conn, monkeypatch):
+
+    """
+    Creates the dimensions and the data version, and points the export at
+    them.
+    """
+
+    monkeypatch.setattr(config, 'SPARKIFYDB_DSN', conn.dsn)
+    with conn, conn.cursor() as cur:
+        for table in snapshot.tables + ['data_version']:
+            cur.execute(local_engine.translate(getattr(sql_queries, '{}_table_create'.format(table))))
+    return conn
+
+
+def load(conn, times, version):
+    with conn, conn.cursor() as cur:
+        cur.executemany(
+            'INSERT INTO time (start_time, hour, day, week, month, year, weekday) VALUES (%s, 0, 1, 1, 11, 2018, 1);',
+            [(t,) for t in times]
+        )
+        cur.execute(sql_queries.data_version_insert, (version,))
+
+
+def test_export_snapshot_exports_the_times_backfilled_before_the_latest(dimensions, tmp_path):
+    load(dimensions, [datetime.datetime(2018, 11, 2)], datetime.datetime(2018, 12, 1))
+    snapshot.export_snapshot(str(tmp_path), 2)
+
+    # A later load backfills a time before the one exported.
+    load(dimensions, [datetime.datetime(2018, 11, 1)], datetime.datetime(2018, 12, 2))
+    snapshot.export_snapshot(str(tmp_path), 2)
+
+    assert sorted(snapshot.load_table('time', str(tmp_path)).column('start_time').to_pylist()) == [
+        datetime.datetime(2018, 11, 1), datetime.datetime(2018, 11, 2)
+    ]
+    assert sorted(path.name for path in (tmp_path / 'time').iterdir()) == ['part-00002.arrow']
+
+
+def test_export_snapshot_skips_the_tables_up_to_date(dimensions, tmp_path):
+    load(dimensions, [datetime.datetime(2018, 11, 2)], datetime.datetime(2018, 12, 1))
+    snapshot.export_snapshot(str(tmp_path), 2)
+
+    snapshot.export_snapshot(str(tmp_path), 2)
+
+    assert snapshot.read_state(str(tmp_path))['time']['parts'] == ['part-00001.arrow']
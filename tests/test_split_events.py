@@ -0,0 +1,45 @@
+import gzip
+import json
+import split_events
+
+
+def read_events(path):
+    with gzip.open(str(path), 'rt') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_route_events_splits_the_plays_from_the_other_events():
+    events = [
+        {'page': 'NextSong', 'userId': '1', 'song': 'A', 'artist': 'B', 'length': 200.0, 'ts': 1},
+        {'page': 'Home', 'userId': '2', 'level': 'paid', 'song': None, 'auth': 'Logged In', 'ts': 2},
+        {'page': 'Home', 'userId': '', 'ts': 3}
+    ]
+
+    routed = list(split_events.route_events(events))
+
+    assert [kind for kind, _ in routed] == ['plays', 'users']
+    assert sorted(routed[0][1]) == sorted(split_events.play_fields)
+    assert routed[0][1]['song'] == 'A'
+    assert sorted(routed[1][1]) == sorted(split_events.user_fields)
+    assert routed[1][1]['level'] == 'paid'
+
+
+def test_split_file_writes_the_plays_and_the_user_events(tmp_path):
+    key = '2018/11/2018-11-01-events.json'
+    source = tmp_path / 'log_data' / key
+    source.parent.mkdir(parents=True)
+    source.write_text('\n'.join(json.dumps(event) for event in [
+        {'page': 'NextSong', 'userId': '1', 'song': 'A', 'ts': 1},
+        {'page': 'Logout', 'userId': '1', 'ts': 2},
+        {'page': 'NextSong', 'userId': '2', 'song': 'B', 'ts': 3}
+    ]) + '\n\n')
+    target = tmp_path / 'split_log_data'
+
+    results = split_events.split_file(str(tmp_path / 'log_data'), str(target), key)
+
+    assert {kind: count for kind, (count, _) in results.items()} == {'plays': 2, 'users': 1}
+    assert [e['song'] for e in read_events(target / 'plays' / (key + '.gz'))] == ['A', 'B']
+    assert [e['ts'] for e in read_events(target / 'users' / (key + '.gz'))] == [2]
+
+    # The file already split is skipped.
+    assert split_events.split_file(str(tmp_path / 'log_data'), str(target), key) is None
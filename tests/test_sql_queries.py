@@ -0,0 +1,87 @@
+import local_engine
+import migrations
+import sql_queries
+
+
+def test_apply_encodings_appends_the_encoding_to_every_layout():
+    ddl = sql_queries.apply_encodings(sql_queries.songs_table_create, {
+        'songs': {'song_id': 'raw', 'title': 'lzo', 'artist_id': 'zstd', 'year': 'az64', 'duration': 'raw'}
+    })
+
+    assert '                  SORTKEY\n                  ENCODE ZSTD,' in ddl
+    assert 'year SMALLINT ENCODE AZ64,' in ddl
+    columns = migrations.parse_table(ddl)['columns']
+    assert {name: c['encoding'] for name, c in columns.items()} == {
+        'song_id': 'raw', 'title': 'lzo', 'artist_id': 'zstd', 'year': 'az64', 'duration': 'raw'
+    }
+
+
+def test_apply_encodings_keeps_the_attributes_on_the_same_line():
+    ddl = sql_queries.apply_encodings(
+        "CREATE TABLE IF NOT EXISTS t (a BIGINT IDENTITY(0, 1) NOT NULL, b VARCHAR(10) DEFAULT 'x')",
+        {'t': {'a': 'az64', 'b': 'lzo'}}
+    )
+
+    assert ddl == (
+        "CREATE TABLE IF NOT EXISTS t (a BIGINT IDENTITY(0, 1) NOT NULL ENCODE AZ64, "
+        "b VARCHAR(10) DEFAULT 'x' ENCODE LZO)"
+    )
+
+
+def test_apply_encodings_logs_the_columns_without_encoding(capsys):
+    ddl = sql_queries.apply_encodings(sql_queries.artists_table_create, {'artists': {'artist_id': 'raw'}})
+
+    assert migrations.parse_table(ddl)['columns']['name']['encoding'] is None
+    assert "No encoding for the columns name, location, latitude, longitude of 'artists'" in capsys.readouterr().out
+    assert sql_queries.apply_encodings(sql_queries.time_table_create, {}) == sql_queries.time_table_create
+
+
+def merge_user_events(cur, events):
+    cur.execute('TRUNCATE staging_events;')
+    cur.executemany("""
+        INSERT INTO staging_events (userId, firstName, lastName, gender, level, ts)
+             VALUES (%s, 'F', 'L', 'M', %s, %s);
+    """, events)
+    for query in sql_queries.users_table_merge:
+        cur.execute(local_engine.translate(query))
+    cur.execute("""
+        SELECT user_key, user_id, level, effective_from, effective_to
+          FROM users
+         ORDER BY user_id, effective_from;
+    """)
+    return [(key, user, level, str(start), str(end)) for key, user, level, start, end in cur.fetchall()]
+
+
+def test_users_merge_keeps_the_keys_and_covers_the_plays_of_a_backfill(conn):
+    with conn, conn.cursor() as cur:
+        for table in ['staging_events', 'staging_user_events', 'users']:
+            cur.execute(local_engine.translate(getattr(sql_queries, '{}_table_create'.format(table))))
+
+        loaded = merge_user_events(cur, [
+            (1, 'free', '2018-11-08 10:00'),
+            (1, 'paid', '2018-11-09 10:00')
+        ])
+        assert [row[1:] for row in loaded] == [
+            (1, 'free', '1900-01-01 00:00:00', '2018-11-09 10:00:00'),
+            (1, 'paid', '2018-11-09 10:00:00', '9999-12-31 00:00:00')
+        ]
+
+        # A backfill of the previous week, and a reload of the same week,
+        # keep the versions and their keys.
+        backfilled = merge_user_events(cur, [
+            (1, 'free', '2018-11-01 10:00'),
+            (2, 'paid', '2018-11-02 10:00')
+        ])
+        assert backfilled[:2] == loaded
+        assert backfilled[2][1:] == (2, 'paid', '1900-01-01 00:00:00', '9999-12-31 00:00:00')
+        assert merge_user_events(cur, [(1, 'free', '2018-11-08 10:00'), (1, 'paid', '2018-11-09 10:00')]) == backfilled
+
+        # The plays of the backfill find the version of their user.
+        cur.execute("""
+            SELECT users.user_key
+              FROM users
+             WHERE users.user_id = 1
+               AND TIMESTAMP '2018-11-01 10:00' >= users.effective_from
+               AND TIMESTAMP '2018-11-01 10:00' < users.effective_to;
+        """)
+        assert cur.fetchall() == [(loaded[0][0],)]
@@ -0,0 +1,57 @@
+import os
+import pytest
+import shutil
+import sparkify_stack_create
+import sparkify_stack_delete
+import stack_events
+import stat
+
+moto = pytest.importorskip('moto')
+
+
+@pytest.fixture
+def cloudformation(tmp_path, monkeypatch):
+
+    """
+    Mocks AWS, and runs the scripts from a copy of the template and of
+    the config file.
+    """
+
+    for name in ['sparkify_stack.json', 'sparkify.cfg']:
+        shutil.copy(name, str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setattr(stack_events, 'min_delay', 0)
+    with moto.mock_aws():
+        client = stack_events.get_client()
+        monkeypatch.setattr(sparkify_stack_create, 'cloudformation', client)
+        monkeypatch.setattr(sparkify_stack_delete, 'cloudformation', client)
+        yield client
+
+
+def test_create_and_delete_reach_their_terminal_states(cloudformation, tmp_path):
+    os.chmod('sparkify.cfg', 0o644)
+
+    sparkify_stack_create.create_sparkify_stack()
+    stack = sparkify_stack_create.get_stack_info()
+    assert stack['StackStatus'] == 'CREATE_COMPLETE'
+    with open('sparkify.cfg', 'r') as f:
+        content = f.read()
+    assert 'ROLE_ARN = {}\n'.format(sparkify_stack_create.get_output_value(stack, 'SparkifyRoleArn')) in content
+    assert stat.S_IMODE(os.stat('sparkify.cfg').st_mode) == 0o644
+
+    sparkify_stack_delete.delete_sparkify_stack()
+    stacks = cloudformation.describe_stacks(StackName=stack['StackId'])['Stacks']
+    assert stacks[0]['StackStatus'] == 'DELETE_COMPLETE'
+
+
+def test_write_settings_refuses_a_missing_output(tmp_path):
+    path = str(tmp_path / 'sparkify.cfg')
+    with open(path, 'w') as f:
+        f.write('[IAM]\nROLE_ARN =\n')
+
+    with pytest.raises(ValueError, match='ROLE_ARN'):
+        sparkify_stack_create.write_settings(path, {('IAM', 'ROLE_ARN'): None})
+    with open(path, 'r') as f:
+        assert f.read() == '[IAM]\nROLE_ARN =\n'
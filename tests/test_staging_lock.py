@@ -0,0 +1,46 @@
+import config
+import datetime
+import pytest
+import sql_queries
+import staging_lock
+
+
+@pytest.fixture
+def lock_dsn(conn, monkeypatch):
+
+    """
+    Points the lock at the schema of the test.
+    """
+
+    monkeypatch.setattr(config, 'SPARKIFYDB_DSN', conn.dsn)
+    return conn.dsn
+
+
+def test_hold_fails_fast_while_another_run_holds_the_lock(conn, lock_dsn):
+    with staging_lock.hold('incremental'):
+        with pytest.raises(RuntimeError, match='used by the incremental run'):
+            with staging_lock.hold('full load'):
+                pass
+
+    with staging_lock.hold('full load'):
+        with conn, conn.cursor() as cur:
+            cur.execute('SELECT run FROM etl_lock;')
+            assert cur.fetchall() == [('full load',)]
+
+    with conn, conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM etl_lock;')
+        assert cur.fetchone()[0] == 0
+
+
+def test_hold_clears_the_lock_of_a_session_that_is_gone(conn, lock_dsn):
+    with conn, conn.cursor() as cur:
+        cur.execute(sql_queries.etl_lock_table_create)
+        cur.execute(
+            'INSERT INTO etl_lock (holder, run, acquired_at) VALUES (%s, %s, %s);',
+            (-1, 'crashed', datetime.datetime(2018, 11, 1))
+        )
+
+    with staging_lock.hold('full load'):
+        with conn, conn.cursor() as cur:
+            cur.execute('SELECT run FROM etl_lock;')
+            assert cur.fetchall() == [('full load',)]
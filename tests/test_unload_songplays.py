@@ -0,0 +1,66 @@
+import collections
+import datetime
+import json
+import pytest
+import storage
+import unload_songplays
+
+parquet = pytest.importorskip('pyarrow.parquet')
+
+Column = collections.namedtuple('Column', ['name', 'type_code'])
+
+
+class FakeCursor:
+
+    """
+    Serves canned rows of the export query, ordered by partition.
+    """
+
+    description = [Column('songplay_id', 23), Column('location', 1043), Column('year', 21), Column('month', 21)]
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+def export(store, rows, start=None, end=None):
+    previous = unload_songplays.read_manifest(store)
+    entries = unload_songplays.write_partitions(store, FakeCursor(rows), 2)
+    return unload_songplays.replace_partitions(store, previous, entries, start, end)
+
+
+def test_write_partitions_writes_a_file_per_partition(tmp_path):
+    store = storage.open_store(str(tmp_path))
+    entries = export(store, [(1, 'a', 2018, 10), (2, 'b', 2018, 11), (3, 'c', 2018, 11)])
+
+    assert [(url[len(str(tmp_path)) + 1:], rows) for url, _, rows in entries] == [
+        ('year=2018/month=10/0000_part_00.parquet', 1),
+        ('year=2018/month=11/0000_part_00.parquet', 2)
+    ]
+    table = parquet.read_table(store.path('year=2018/month=11/0000_part_00.parquet'))
+    assert table.to_pydict() == {'songplay_id': [2, 3], 'location': ['b', 'c']}
+    content = json.loads(store.read(unload_songplays.manifest_key))
+    assert content['meta']['record_count'] == 3
+
+
+def test_backfill_keeps_the_other_partitions_and_cleans_its_own(tmp_path):
+    store = storage.open_store(str(tmp_path))
+    export(store, [(1, 'a', 2018, 10), (2, 'b', 2018, 11)])
+    store.write('year=2018/month=11/0001_part_00.parquet', b'stale')
+
+    start, end = unload_songplays.get_range(datetime.date(2018, 11, 1), datetime.date(2018, 11, 1))
+    entries = export(store, [(3, 'c', 2018, 11)], start, end)
+
+    assert [(url[len(str(tmp_path)) + 1:], rows) for url, _, rows in entries] == [
+        ('year=2018/month=10/0000_part_00.parquet', 1),
+        ('year=2018/month=11/0000_part_00.parquet', 1)
+    ]
+    assert [key for key, _ in store.list()] == [
+        'manifest',
+        'year=2018/month=10/0000_part_00.parquet',
+        'year=2018/month=11/0000_part_00.parquet'
+    ]
+    assert unload_songplays.read_manifest(store) == entries
@@ -0,0 +1,68 @@
+import config
+import metrics
+import pytest
+import sql_queries
+import wlm
+
+
+class FakeConnection:
+
+    """
+    Records the queries run through its cursors, each block of 'with
+    conn' committing them.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        self.queries.append(query)
+
+
+def test_get_profile_shares_the_profile_of_the_stage_with_its_batches():
+    assert wlm.get_profile('staging_songs:3') == sql_queries.session_profiles['staging_songs']
+    assert wlm.get_profile('songplays') == ('etl_heavy', 3, 3600000)
+
+
+def test_get_profile_falls_back_to_the_default_profile():
+    assert wlm.get_profile('time') == sql_queries.session_profiles['default']
+    assert wlm.get_profile('key_maps:2') == sql_queries.session_profiles['default']
+
+
+@pytest.mark.parametrize('redshift, enabled', [(False, True), (True, False)])
+def test_session_does_nothing_off_redshift_or_disabled(monkeypatch, redshift, enabled):
+    monkeypatch.setattr(metrics, 'redshift', redshift)
+    monkeypatch.setattr(config, 'ETL_SESSION_PROFILES', enabled)
+    conn = FakeConnection()
+
+    with wlm.session(conn, 'songplays') as profile:
+        assert profile is None
+
+    assert conn.queries == []
+
+
+def test_session_sets_the_profile_and_resets_it_on_redshift(monkeypatch):
+    monkeypatch.setattr(metrics, 'redshift', True)
+    monkeypatch.setattr(config, 'ETL_SESSION_PROFILES', True)
+    conn = FakeConnection()
+
+    with pytest.raises(ValueError), wlm.session(conn, 'staging_songs:3') as profile:
+        assert profile == ('etl_copy', 2, 0)
+        assert conn.queries == [
+            "SET query_group TO 'etl_copy';",
+            "SET wlm_query_slot_count TO 2;",
+            "SET statement_timeout TO 0;"
+        ]
+        raise ValueError('failed stage')
+
+    assert conn.queries[3:] == sql_queries.session_profile_reset